@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Junit XML Generator
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+# run from the repository root:
+#   python3 -m bench.junit_gen [-n CASES] [-f FAILED] [-s SKIPPED] [-o LINES]
+#                              [--seed SEED] [--hostname HOST] output
+
+
+import random
+import argparse
+from datetime import datetime
+from xml.sax.saxutils import escape, quoteattr
+
+
+# topotest suites the generated test cases are spread across
+BENCH_TOPOLOGIES = [
+    "bgp_features",
+    "bgp_evpn_mh",
+    "bgp_l3vpn_to_bgp_vrf",
+    "isis_topo1",
+    "ldp_vpls_topo1",
+    "ospf_basic_functionality",
+    "ospf6_topo1",
+    "pim_basic",
+    "zebra_rib",
+]
+
+
+# test cases of a synthetic topotest run as lists of [classname, file, line,
+# name, time, result], result is passed, failed or skipped
+def generate_cases(cases, failed=0.01, skipped=0.05, seed=0):
+    rnd = random.Random(seed)
+    for i in range(cases):
+        topology = BENCH_TOPOLOGIES[i // 50 % len(BENCH_TOPOLOGIES)]
+        value = rnd.random()
+        if value < failed:
+            result = "failed"
+        elif value < failed + skipped:
+            result = "skipped"
+        else:
+            result = "passed"
+        yield [
+            "{0}.test_{0}".format(topology),
+            "{0}/test_{0}.py".format(topology),
+            str(100 + i % 50 * 20),
+            "test_case_{}".format(i),
+            "{:.3f}".format(0.001 if result == "skipped" else rnd.expovariate(0.2)),
+            result,
+        ]
+
+
+# write a junit xml file in the format of pytest as run by topotests, with
+# lines of captured output per test case
+def write_junit(path, cases, hostname="frr-topotest-bench", lines=5):
+    counts = {"passed": 0, "failed": 0, "skipped": 0}
+    total_time = 0.0
+    body = []
+    for classname, file, line, name, time, result in cases:
+        counts[result] += 1
+        total_time += float(time)
+        case = '<testcase classname={} file={} line="{}" name={} time="{}">'.format(
+            quoteattr(classname), quoteattr(file), line, quoteattr(name), time
+        )
+        if result == "failed":
+            case += (
+                '<failure message="AssertionError: generated failure&#10;assert '
+                'False">def {}():\n    assert False</failure>'.format(escape(name))
+            )
+        elif result == "skipped":
+            case += (
+                '<skipped message="skipped by benchmark" type="pytest.skip">'
+                "{}:{}: skipped by benchmark</skipped>".format(escape(file), line)
+            )
+        output = "".join(
+            "2021-01-05 12:16:{:02d},{:03d} INFO: {}: step {}\n".format(
+                j % 60, j * 7 % 1000, escape(name), j
+            )
+            for j in range(lines)
+        )
+        case += "<system-out>{}</system-out></testcase>".format(output)
+        body.append(case)
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?><testsuites>')
+        f.write(
+            '<testsuite errors="0" failures="{}" hostname={} name="pytest" '
+            'skipped="{}" tests="{}" time="{:.3f}" timestamp="{}">'.format(
+                counts["failed"],
+                quoteattr(hostname),
+                counts["skipped"],
+                sum(counts.values()),
+                total_time,
+                datetime.now().isoformat(),
+            )
+        )
+        f.write("".join(body))
+        f.write("</testsuite></testsuites>")
+    return counts
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", "--cases", help="test cases", type=int, default=1000)
+    ap.add_argument("-f", "--failed", help="failed share", type=float, default=0.01)
+    ap.add_argument("-s", "--skipped", help="skipped share", type=float, default=0.05)
+    ap.add_argument(
+        "-o", "--output-lines", help="output lines per case", type=int, default=5
+    )
+    ap.add_argument("--seed", help="random seed", type=int, default=0)
+    ap.add_argument("--hostname", help="test suite hostname", default="frr-bench")
+    ap.add_argument("output", help="junit xml file")
+    args = ap.parse_args()
+
+    counts = write_junit(
+        args.output,
+        generate_cases(args.cases, args.failed, args.skipped, args.seed),
+        args.hostname,
+        args.output_lines,
+    )
+    print(
+        "wrote {} test cases ({} passed, {} failed, {} skipped) to {}".format(
+            sum(counts.values()),
+            counts["passed"],
+            counts["failed"],
+            counts["skipped"],
+            args.output,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Load Generator
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+# run from the repository root:
+#   python3 -m bench.load [-c CLIENTS] [-m MESSAGES] [-r ROWS] [-k CHUNK]
+#                         [-e ENCODING] [-w WORKERS] [--loop LOOP] [--dir DIR]
+
+
+import os
+import sys
+import time
+import socket
+import signal
+import argparse
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+
+from lib.topostat import Logger, TopotestResult
+from lib.config import ClientConfig
+from lib.upload import Upload, UploadSocket
+from bench.junit_gen import generate_cases
+
+
+BENCH_AUTH_KEY = "benchmark"
+
+
+# unused tcp port on the loopback interface
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# write the server configuration file of a benchmark run
+def write_server_config(path, directory, ports, args):
+    with open(path, "w") as f:
+        f.write("[server]\n")
+        f.write("verbose = no\n")
+        f.write("log_file = {}\n".format(os.path.join(directory, "server.log")))
+        f.write("server_no_ipv6 = yes\n")
+        f.write("server_no_query = yes\n")
+        f.write("server_address_ipv4 = 127.0.0.1\n")
+        f.write("server_port_ipv4 = {}\n".format(ports[0]))
+        f.write("server_ack_port_ipv4 = {}\n".format(ports[1]))
+        f.write("auth_key = {}\n".format(BENCH_AUTH_KEY))
+        f.write("sqlite3_db = {}\n".format(os.path.join(directory, "bench.db")))
+        f.write("ingest_workers = {}\n".format(args.workers))
+        f.write("server_loop = {}\n".format(args.loop))
+
+
+# start the server and wait until its database writer is running
+def start_server(config, log_file):
+    proc = subprocess.Popen(
+        [sys.executable, "server.py", "-c", config],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            break
+        try:
+            with open(log_file) as f:
+                if "started database writer thread" in f.read():
+                    return proc
+        except FileNotFoundError:
+            pass
+        time.sleep(0.1)
+    proc.kill()
+    sys.exit("failed to start server, see {}".format(log_file))
+
+
+# resident set size of a process and its child processes in KiB
+def process_rss(pid):
+    rss = 0
+    with open("/proc/{}/status".format(pid)) as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1])
+                break
+    try:
+        with open("/proc/{0}/task/{0}/children".format(pid)) as f:
+            children = f.read().split()
+    except OSError:
+        children = []
+    for child in children:
+        try:
+            rss += process_rss(child)
+        except OSError:
+            pass
+    return rss
+
+
+class RssSampler:
+    """
+    Thread sampling the resident set size of the server and its ingest worker
+    processes every interval seconds, keeping the peak.
+    """
+
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self.last = 0
+        self.stopped = threading.Event()
+        self.worker = threading.Thread(target=self.worker_thread)
+
+    def worker_thread(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.last = process_rss(self.pid)
+            except OSError:
+                return
+            self.peak = max(self.peak, self.last)
+
+    def start(self):
+        self.worker.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.worker.join()
+
+
+# simulated client, uploads messages runs of rows results as a real client
+# does and reports the latency from sending a message until the server
+# confirmed that it is stored
+def run_client(index, args, port, start, reports):
+    conf = ClientConfig()
+    conf.log_file = os.devnull
+    conf.server_address_type = "IPV4"
+    conf.socket_address_str = "tcp://127.0.0.1:{}".format(port)
+    conf.connection_timeout = 120
+    conf.auth_key = BENCH_AUTH_KEY
+    conf.sender_id = "bench-agent-{}".format(index)
+    conf.message_encoding = args.encoding
+    conf.message_chunk_size = args.chunk
+    log = Logger(conf)
+    log.start()
+
+    results = [
+        TopotestResult(
+            "{}.{}".format(classname, name),
+            result,
+            duration,
+            conf.sender_id,
+            "2021-01-05 12:16:30.245931",
+            "BENCH",
+            "",
+            "JOB",
+        )
+        for classname, file, line, name, duration, result in generate_cases(
+            args.rows, seed=index
+        )
+    ]
+    sock = UploadSocket(conf, log)
+    latencies = []
+
+    def send(frames):
+        sent = time.perf_counter()
+        sock.send(frames)
+        latencies.append(time.perf_counter() - sent)
+
+    start.wait()
+    for message in range(args.messages):
+        build = str(index * 1000000 + message)
+        upload = Upload(conf, log, "BENCH", build, "JOB", send)
+        for result in results:
+            result.build = build
+            upload.add(result)
+        upload.finish()
+    sock.close()
+    log.stop()
+    reports.put([latencies, sock.stored])
+
+
+# value at quantile q of sorted values
+def quantile(values, q):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-c", "--clients", help="simulated clients", type=int, default=8)
+    ap.add_argument("-m", "--messages", help="uploads per client", type=int, default=20)
+    ap.add_argument("-r", "--rows", help="results per upload", type=int, default=1000)
+    ap.add_argument(
+        "-k", "--chunk", help="message chunk size, 0 for none", type=int, default=0
+    )
+    ap.add_argument("-e", "--encoding", help="message encoding", default="zlib")
+    ap.add_argument(
+        "-w", "--workers", help="server ingest workers", type=int, default=0
+    )
+    ap.add_argument(
+        "--loop", help="server loop", choices=["poller", "asyncio"], default="poller"
+    )
+    ap.add_argument("--dir", help="directory of the benchmark database")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        config = os.path.join(directory, "topostat.conf")
+        ports = [free_port(), free_port()]
+        write_server_config(config, directory, ports, args)
+        server = start_server(config, os.path.join(directory, "server.log"))
+        sampler = RssSampler(server.pid)
+        sampler.start()
+
+        # start all clients at once
+        start = multiprocessing.Event()
+        reports = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(
+                target=run_client, args=(i, args, ports[1], start, reports)
+            )
+            for i in range(args.clients)
+        ]
+        for client in clients:
+            client.start()
+        time.sleep(0.5)
+        started = time.perf_counter()
+        start.set()
+        latencies = []
+        stored = 0
+        for client in clients:
+            client_latencies, client_stored = reports.get()
+            latencies += client_latencies
+            stored += client_stored
+        elapsed = time.perf_counter() - started
+        for client in clients:
+            client.join()
+
+        sampler.stop()
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+    latencies.sort()
+    print("clients       {}".format(args.clients))
+    print("messages      {}".format(len(latencies)))
+    print("rows stored   {}".format(stored))
+    print("elapsed s     {:.2f}".format(elapsed))
+    print("rows/s        {:.0f}".format(stored / elapsed))
+    print("messages/s    {:.1f}".format(len(latencies) / elapsed))
+    print("latency p50   {:.1f} ms".format(quantile(latencies, 0.5) * 1000))
+    print("latency p99   {:.1f} ms".format(quantile(latencies, 0.99) * 1000))
+    print("latency max   {:.1f} ms".format(quantile(latencies, 1.0) * 1000))
+    print("server rss    {:.1f} MiB peak".format(sampler.peak / 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Message Encoding Benchmark
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+# run from the repository root:
+#   python3 -m bench.message_encoding [-r ROWS] [-n REPEAT]
+
+
+import time
+import argparse
+
+from lib.topostat import (
+    Message,
+    TopotestResult,
+    TopotestRun,
+    TOPOSTAT_MESSAGE_ENCODINGS,
+    message_encoding_available,
+)
+from lib.ingest import validate_results
+
+
+# results of a client run with rows results
+def run_results(rows):
+    return [
+        TopotestResult(
+            "bgp_features.test_bgp_features_{}.test_case_{}".format(i // 10, i),
+            "failed" if i % 97 == 0 else "passed",
+            "{:.3f}".format(1.5 + i % 7 + i / 1000),
+            "frr-topotest-agent-3",
+            "2021-01-05 12:16:30.245931",
+            "FRR-FRR",
+            "4711",
+            "TOPO3U20AMD64",
+        )
+        for i in range(rows)
+    ]
+
+
+# best time of repeat calls of func in milliseconds
+def best_time(func, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = (time.perf_counter() - start) * 1000
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-r", "--rows", help="results per message", type=int, default=5000)
+    ap.add_argument("-n", "--repeat", help="runs per encoding", type=int, default=10)
+    args = ap.parse_args()
+
+    results = run_results(args.rows)
+    rows = [result.to_json() for result in results]
+    run = TopotestRun(results[0].host, "FRR-FRR", "4711", "TOPO3U20AMD64")
+    for result in results:
+        run.add(result)
+    run = run.to_json()
+
+    # version 1 message as the baseline, a version 2 message with the results
+    # as a list, and with the results as a run in every available encoding
+    variants = [["v1 rows", 1, "none", rows], ["v2 rows zlib", 2, "zlib", rows]]
+    for encoding in TOPOSTAT_MESSAGE_ENCODINGS:
+        if message_encoding_available(encoding):
+            variants.append(["v2 run " + encoding, 2, encoding, run])
+
+    print(
+        "{:<14} {:>10} {:>7} {:>10} {:>10} {:>12}".format(
+            "message", "bytes", "ratio", "encode ms", "decode ms", "validate ms"
+        )
+    )
+    baseline = None
+    for name, version, encoding, payload in variants:
+        msg = Message(version=version)
+        msg.add_payload(payload)
+        msg.gen_upload_id()
+        msg.gen_auth("benchmark")
+        frames = msg.to_frames(encoding)
+        size = sum(len(frame) for frame in frames)
+        if baseline is None:
+            baseline = size
+        encode_ms = best_time(lambda: msg.to_frames(encoding), args.repeat)
+        decode_ms = best_time(lambda: Message().from_frames(frames), args.repeat)
+        validate_ms = best_time(lambda: validate_results(payload), args.repeat)
+        print(
+            "{:<14} {:>10} {:>7.3f} {:>10.2f} {:>10.2f} {:>12.2f}".format(
+                name, size, size / baseline, encode_ms, decode_ms, validate_ms
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Data Model Microbenchmarks
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+# run from the repository root:
+#   python3 -m bench.micro [-r ROWS] [-n REPEAT] [-R ROUNDS] [-o OUTPUT]
+#                          [-b BASELINE] [--no-baseline] [-t THRESHOLD]
+#                          [--json]
+
+
+import os
+import gc
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+from junitparser import JUnitXml, TestSuite, TestCase
+
+from lib.topostat import Message, TopotestResult, TopotestRun
+from lib.ingest import validate_results
+from lib.junit import read_junit
+from bench.junit_gen import generate_cases, write_junit
+
+
+# format version of the json output
+BENCH_MICRO_VERSION = 2
+
+# benchmarks with a best call time below this are reported but not gated, timer
+# resolution and cache effects dominate them
+BENCH_MICRO_GATE_MIN_NS = 100000
+
+# exit status if a regression is flagged, and if the baseline is not comparable
+BENCH_MICRO_EXIT_REGRESSION = 1
+BENCH_MICRO_EXIT_BASELINE = 2
+
+# baseline compared with unless another baseline is given
+BENCH_MICRO_BASELINE = os.path.join(os.path.dirname(__file__), "micro_baseline.json")
+
+
+# results of a client run with rows results
+def run_results(rows):
+    return [
+        TopotestResult(
+            "{}.{}".format(classname, name),
+            result,
+            duration,
+            "frr-topotest-agent-3",
+            "2021-01-05 12:16:30.245931",
+            "FRR-FRR",
+            "4711",
+            "TOPO3U20AMD64",
+        )
+        for classname, file, line, name, duration, result in generate_cases(rows)
+    ]
+
+
+# junitparser test cases of a junit xml file
+def junit_cases(path):
+    xml = JUnitXml.fromfile(path)
+    cases = []
+    for suite in xml:
+        if isinstance(suite, TestSuite):
+            cases += [case for case in suite]
+        elif isinstance(suite, TestCase):
+            cases.append(suite)
+    return cases
+
+
+# results of a junit xml file as read by the client before lib.junit
+def junit_fromfile(path):
+    return [
+        TopotestResult().from_case(
+            case, "frr-topotest-agent-3", "FRR-FRR", "4711", "TOPO3U20AMD64"
+        )
+        for case in junit_cases(path)
+    ]
+
+
+# results of a junit xml file as read by the client
+def junit_read(path):
+    return list(
+        read_junit(path, "frr-topotest-agent-3", "FRR-FRR", "4711", "TOPO3U20AMD64")
+    )
+
+
+# benchmarks as [name, unit, ops, func], func processes ops units per call,
+# path is a junit xml file with rows test cases
+def benchmarks(rows, path):
+    results = run_results(rows)
+    rows_json = [result.to_json() for result in results]
+    cases = junit_cases(path)
+    run = TopotestRun("frr-topotest-agent-3", "FRR-FRR", "4711", "TOPO3U20AMD64")
+    for result in results:
+        run.add(result)
+    run_json = run.to_json()
+
+    msg = Message()
+    msg.add_payload(run_json)
+    msg.gen_upload_id()
+    msg.gen_auth("benchmark")
+    frames = msg.to_frames("zlib")
+
+    def add_run():
+        run = TopotestRun("frr-topotest-agent-3", "FRR-FRR", "4711", "TOPO3U20AMD64")
+        for result in results:
+            run.add(result)
+
+    return [
+        ["result.to_json", "row", rows, lambda: [r.to_json() for r in results]],
+        [
+            "result.from_json",
+            "row",
+            rows,
+            lambda: [TopotestResult().from_json(j) for j in rows_json],
+        ],
+        ["result.check", "row", rows, lambda: [r.check() for r in results]],
+        ["result.to_row", "row", rows, lambda: [r.to_row() for r in results]],
+        [
+            "result.from_case",
+            "row",
+            len(cases),
+            lambda: [
+                TopotestResult().from_case(
+                    case, "frr-topotest-agent-3", "FRR-FRR", "4711", "TOPO3U20AMD64"
+                )
+                for case in cases
+            ],
+        ],
+        ["junit.fromfile", "row", rows, lambda: junit_fromfile(path)],
+        ["junit.read", "row", rows, lambda: junit_read(path)],
+        ["run.add", "row", rows, add_run],
+        [
+            "run.to_rows",
+            "row",
+            rows,
+            lambda: TopotestRun().from_json(run_json).to_rows(),
+        ],
+        [
+            "message.add_payload rows",
+            "row",
+            rows,
+            lambda: Message(version=1).add_payload(rows_json),
+        ],
+        [
+            "message.add_payload run",
+            "row",
+            rows,
+            lambda: Message().add_payload(run_json),
+        ],
+        ["message.gen_auth", "message", 1, lambda: msg.gen_auth("benchmark")],
+        ["message.check_auth", "message", 1, lambda: msg.check_auth("benchmark")],
+        ["message.to_frames", "row", rows, lambda: msg.to_frames("zlib")],
+        ["message.from_frames", "row", rows, lambda: Message().from_frames(frames)],
+        ["ingest.validate rows", "row", rows, lambda: validate_results(rows_json)],
+        ["ingest.validate run", "row", rows, lambda: validate_results(run_json)],
+    ]
+
+
+# memory benchmarks as [name, func], func returns the allocated objects of
+# rows results so that they are alive when the memory use is measured
+def memory_benchmarks(rows, path):
+    cases = junit_cases(path)
+    results = run_results(rows)
+
+    def compose_message():
+        msg = Message(version=1)
+        msg.add_payload([result.to_json() for result in results])
+        msg.gen_auth("benchmark")
+        return msg.to_frames("zlib")
+
+    return [
+        [
+            "result.from_case",
+            lambda: [
+                TopotestResult().from_case(
+                    case, "frr-topotest-agent-3", "FRR-FRR", "4711", "TOPO3U20AMD64"
+                )
+                for case in cases
+            ],
+        ],
+        ["junit.fromfile", lambda: junit_fromfile(path)],
+        ["junit.read", lambda: junit_read(path)],
+        ["message.compose", compose_message],
+    ]
+
+
+# peak memory allocated by a call of func in bytes
+def peak_memory(func):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        objects = func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+# best time of repeat calls of func in nanoseconds, without garbage collection
+# as timeit does
+def best_time(func, repeat):
+    best = None
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for i in range(repeat):
+            start = time.perf_counter_ns()
+            func()
+            elapsed = time.perf_counter_ns() - start
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        if enabled:
+            gc.enable()
+    return best
+
+
+# best call time of every benchmark in nanoseconds over rounds rounds of repeat
+# calls, the benchmarks take turns so that a slow phase of the machine does not
+# hit a single benchmark
+def best_times(benches, repeat, rounds):
+    best = {}
+    for i in range(rounds):
+        for name, unit, ops, func in benches:
+            elapsed = best_time(func, repeat)
+            if not name in best or elapsed < best[name]:
+                best[name] = elapsed
+    return best
+
+
+# names of the benchmarks slower or using more memory than their baseline by
+# more than threshold, comparing only gated benchmarks
+def find_regressions(report, threshold):
+    regressions = []
+    for section in ["benchmarks", "memory"]:
+        for name, result in report[section].items():
+            if "ratio" in result and result["gated"]:
+                if result["ratio"] > 1 + threshold:
+                    regressions.append([section, name])
+    return regressions
+
+
+# add the baseline value and ratio of every benchmark to report
+def compare_baseline(report, baseline):
+    for section, key in [["benchmarks", "ns"], ["memory", "bytes"]]:
+        for name, result in report[section].items():
+            if not name in baseline.get(section, {}):
+                continue
+            result["baseline"] = baseline[section][name][key]
+            result["ratio"] = round(result[key] / result["baseline"], 3)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-r", "--rows", help="results per message", type=int, default=1000)
+    ap.add_argument(
+        "-n", "--repeat", help="runs per benchmark and round", type=int, default=20
+    )
+    ap.add_argument(
+        "-R", "--rounds", help="rounds of runs per benchmark", type=int, default=5
+    )
+    ap.add_argument("-o", "--output", help="write results as json to file")
+    ap.add_argument(
+        "-b",
+        "--baseline",
+        help="compare with json results file",
+        default=BENCH_MICRO_BASELINE,
+    )
+    ap.add_argument(
+        "--no-baseline", help="do not compare with a baseline", action="store_true"
+    )
+    ap.add_argument(
+        "-t",
+        "--threshold",
+        help="slowdown flagged as regression",
+        type=float,
+        default=0.25,
+    )
+    ap.add_argument("--json", help="print results as json", action="store_true")
+    args = ap.parse_args()
+
+    report = {
+        "version": BENCH_MICRO_VERSION,
+        "python": platform.python_version(),
+        "rows": args.rows,
+        "repeat": args.repeat,
+        "rounds": args.rounds,
+        "benchmarks": {},
+        "memory": {},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "junit.xml")
+        write_junit(path, generate_cases(args.rows))
+        benches = benchmarks(args.rows, path)
+        best = best_times(benches, args.repeat, args.rounds)
+        for name, unit, ops, func in benches:
+            report["benchmarks"][name] = {
+                "unit": unit,
+                "ns": round(best[name] / ops, 1),
+                "gated": best[name] >= BENCH_MICRO_GATE_MIN_NS,
+            }
+        for name, func in memory_benchmarks(args.rows, path):
+            report["memory"][name] = {
+                "unit": "row",
+                "bytes": round(peak_memory(func) / args.rows, 1),
+                "gated": True,
+            }
+
+        # timings are only comparable for the same python version and runs,
+        # benchmarks slower than the baseline are run once more and only
+        # flagged if they are still slower
+        baseline = None
+        comparable = True
+        if args.baseline and not args.no_baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            for var in ["python", "rows", "repeat", "rounds"]:
+                if baseline.get(var) != report[var]:
+                    print(
+                        "baseline {} {} differs from {}, not compared".format(
+                            var, baseline.get(var), report[var]
+                        ),
+                        file=sys.stderr,
+                    )
+                    comparable = False
+        regressions = []
+        if baseline is not None and comparable:
+            compare_baseline(report, baseline)
+            slower = [
+                name
+                for section, name in find_regressions(report, args.threshold)
+                if section == "benchmarks"
+            ]
+            if slower:
+                again = best_times(
+                    [bench for bench in benches if bench[0] in slower],
+                    args.repeat,
+                    args.rounds,
+                )
+                for name, unit, ops, func in benches:
+                    if name in again:
+                        result = report["benchmarks"][name]
+                        result["ns"] = min(result["ns"], round(again[name] / ops, 1))
+                compare_baseline(report, baseline)
+            regressions = [
+                "{} {}".format(section, name)
+                for section, name in find_regressions(report, args.threshold)
+            ]
+        report["regressions"] = regressions
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for section, key, heading in [
+            ["benchmarks", "ns", "ns/unit"],
+            ["memory", "bytes", "bytes/unit"],
+        ]:
+            print(
+                "{:<26} {:>8} {:>12} {:>12} {:>7}".format(
+                    section, "unit", heading, "baseline", "ratio"
+                )
+            )
+            for name, result in report[section].items():
+                line = "{:<26} {:>8} {:>12.1f}".format(
+                    name, result["unit"], result[key]
+                )
+                if "baseline" in result:
+                    line += " {:>12.1f} {:>7.3f}".format(
+                        result["baseline"], result["ratio"]
+                    )
+                    if "{} {}".format(section, name) in regressions:
+                        line += "  REGRESSION"
+                if not result["gated"]:
+                    line += "  not gated"
+                print(line)
+
+    # the exit status is 1 if any gated benchmark regressed, and 2 if the
+    # baseline could not be compared
+    if regressions:
+        sys.exit(BENCH_MICRO_EXIT_REGRESSION)
+    if baseline is not None and not comparable:
+        sys.exit(BENCH_MICRO_EXIT_BASELINE)
+
+
+if __name__ == "__main__":
+    main()
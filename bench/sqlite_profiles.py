@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool SQLite Profile Benchmark
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+# run from the repository root:
+#   python3 -m bench.sqlite_profiles [-m MESSAGES] [-r ROWS] [-g GROUP]
+#                                    [--reader] [--dir DIR] [--profile NAME]
+
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+from lib.config import ServerConfig
+from lib.database import ResultStore, create_results_tables, configure_connection
+from lib.query import query_build_summary
+
+
+# storage profiles as [journal mode, synchronous, cache KiB, mmap MiB], default
+# is what sqlite3 uses without any pragma, wal-normal is the server default
+BENCH_PROFILES = {
+    "default": ["delete", "full", 2000, 0],
+    "delete-normal": ["delete", "normal", 65536, 256],
+    "wal-full": ["wal", "full", 65536, 256],
+    "wal-normal": ["wal", "normal", 65536, 256],
+    "wal-off": ["wal", "off", 65536, 256],
+}
+
+
+# configuration of a benchmarked profile
+def profile_config(db, profile):
+    conf = ServerConfig()
+    conf.sqlite3_db = db
+    (
+        conf.db_journal_mode,
+        conf.db_synchronous,
+        conf.db_cache_size_kib,
+        conf.db_mmap_size_mib,
+    ) = BENCH_PROFILES[profile]
+    return conf
+
+
+# rows of a message as sent by one client run of a build
+def message_rows(build, rows):
+    return [
+        (
+            "test_{}.py::test_{}".format(i // 10, i),
+            1 if i % 97 == 0 else 0,
+            1.5 + i % 7,
+            "agent{}".format(build % 4),
+            1617184800 + build * 60,
+            "TOPO-PLAN",
+            build,
+            "JOB{}".format(build % 3),
+        )
+        for i in range(rows)
+    ]
+
+
+# query the database as fast as possible until stopped, counting the answered
+# and failed queries
+def reader_thread(conf, stopped, counts):
+    conn = sqlite3.connect(conf.sqlite3_db)
+    configure_connection(conn, conf)
+    sql, args, columns = query_build_summary(
+        [conf.results_table], {"plan": "TOPO-PLAN", "build": "1"}
+    )
+    while not stopped.is_set():
+        try:
+            conn.execute(sql, args).fetchall()
+            counts[0] += 1
+        except sqlite3.Error:
+            counts[1] += 1
+    conn.close()
+
+
+# insert messages rows per message and commit every group messages, returns
+# rows per second and the reader counts
+def run_profile(db, profile, messages, rows, group, reader):
+    conf = profile_config(db, profile)
+    conn = sqlite3.connect(db)
+    configure_connection(conn, conf)
+    create_results_tables(conn, conf.results_table)
+    store = ResultStore(conn, conf.results_table)
+    payloads = [message_rows(build, rows) for build in range(1, messages + 1)]
+
+    stopped = threading.Event()
+    counts = [0, 0]
+    if reader:
+        store.insert_many(payloads[0])
+        conn.commit()
+        payloads = payloads[1:]
+        thread = threading.Thread(target=reader_thread, args=(conf, stopped, counts))
+        thread.start()
+
+    start = time.perf_counter()
+    for i, payload in enumerate(payloads):
+        store.insert_many(payload)
+        if (i + 1) % group == 0:
+            conn.commit()
+    conn.commit()
+    elapsed = time.perf_counter() - start
+
+    if reader:
+        stopped.set()
+        thread.join()
+    conn.close()
+    return len(payloads) * rows / elapsed, counts
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-m", "--messages", help="messages", type=int, default=200)
+    ap.add_argument("-r", "--rows", help="rows per message", type=int, default=100)
+    ap.add_argument("-g", "--group", help="messages per commit", type=int, default=1)
+    ap.add_argument(
+        "--reader", help="query concurrently from a reader", action="store_true"
+    )
+    ap.add_argument("--dir", help="directory of the benchmark databases")
+    ap.add_argument(
+        "--profile",
+        help="benchmark only this profile",
+        action="append",
+        choices=list(BENCH_PROFILES),
+    )
+    args = ap.parse_args()
+
+    print(
+        "{:<14} {:>12} {:>10} {:>10}".format("profile", "rows/s", "queries", "failed")
+    )
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for profile in args.profile or list(BENCH_PROFILES):
+            db = os.path.join(tmp, "{}.db".format(profile))
+            rate, counts = run_profile(
+                db, profile, args.messages, args.rows, args.group, args.reader
+            )
+            print(
+                "{:<14} {:>12.0f} {:>10} {:>10}".format(
+                    profile, rate, counts[0], counts[1]
+                )
+            )
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -24,28 +24,34 @@
 import os
 import sys
 import argparse
-from threading import Timer
+import multiprocessing
+from collections import deque
 
-from junitparser import JUnitXml, TestSuite, TestCase
 import zmq
 
 from lib.topostat import (
     Logger,
-    Message,
     TopotestResult,
+    build_to_int,
+    TOPOSTAT_MESSAGE_VERSIONS,
+    TOPOSTAT_MESSAGE_ENCODINGS,
+    message_encoding_available,
     compose_zmq_client_address_str,
     determine_client_sender_id,
 )
 from lib.config import ClientConfig, read_config_file
+from lib.upload import Upload, UploadSocket, UploadError, UploadRejectedError
+from lib.spool import Spool, SpoolError
+from lib.junit import (
+    JunitError,
+    junit_files,
+    read_junit_file,
+    read_junit_valid,
+)
+from lib.ack import TOPOSTAT_DELIVERY_MODES
 import lib.check as check
 
 
-# Upload watchdog handler to terminate non-responsive ZeroMQ connect and send
-# threads
-def watchdog_handler(log):
-    log.kill("upload watchdog timer expired")
-
-
 # parse cli arguments
 def parse_cli_arguments(conf, log):
     ap = argparse.ArgumentParser()
@@ -53,13 +59,23 @@ def parse_cli_arguments(conf, log):
     ap.add_argument("-d", "--debug", help="debug messages", action="store_true")
     ap.add_argument("-c", "--config", help="configuration file")
     ap.add_argument("-a", "--address", help="server address")
-    ap.add_argument("-p", "--port", help="server tcp port")
+    ap.add_argument("-p", "--port", help="server tcp port of delivery push")
     ap.add_argument("-s", "--sender", help="sender identification")
     ap.add_argument("-k", "--key", help="authentication key")
-    ap.add_argument("-f", "--file", help="junit xml file")
+    ap.add_argument(
+        "-f", "--file", help="junit xml files, globs or directories", nargs="+"
+    )
     ap.add_argument("-l", "--log", help="log file")
+    ap.add_argument(
+        "--flush-spool",
+        help="resend spooled uploads and exit",
+        action="store_true",
+    )
     try:
         args = vars(ap.parse_args())
+        # junit xml files are separated by newlines as in the config file
+        if args["file"] is not None:
+            args["file"] = "\n".join(args["file"])
         conf_to_args = {
             "verbose": "verbose",
             "debug": "debug",
@@ -69,6 +85,7 @@ def parse_cli_arguments(conf, log):
             "auth_key": "key",
             "junit_xml": "file",
             "log_file": "log",
+            "flush_spool": "flush_spool",
         }
         for conf_var, arg_val in conf_to_args.items():
             if not conf_var in conf.config_no_overwrite:
@@ -124,6 +141,114 @@ def parse_cli_arguments(conf, log):
         log.abort("failed to parse arguments")
 
 
+# log the counts of valid, skipped and invalid results of a junit xml file and
+# add them to the counts of all files
+def count_junit_file(path, file_counts, counts, log):
+    log.info(
+        "read {} test results ({} valid, {} skipped, {} invalid) from {}".format(
+            sum(file_counts), file_counts[0], file_counts[1], file_counts[2], path
+        )
+    )
+    for i, count in enumerate(file_counts):
+        counts[i] += count
+
+
+# read junit xml files in a pool of junit_workers processes and add the valid
+# results to the upload in the order of the files, at most one file more than
+# there are workers is read ahead to bound the results held in memory
+def read_junit_pool(files, conf, log, plan, build, job, upload, counts):
+    # spawn workers instead of forking the threaded client process
+    processes = min(conf.junit_workers, len(files))
+    pool = multiprocessing.get_context("spawn").Pool(processes=processes)
+    log.info("started {} junit xml reader processes".format(processes))
+    pending = deque()
+
+    def add_next():
+        path, reading = pending.popleft()
+        file_counts, results = reading.get()
+        for name, result, time, timestamp in results:
+            upload.add(
+                TopotestResult(
+                    name, result, time, conf.sender_id, timestamp, plan, build, job
+                )
+            )
+        count_junit_file(path, file_counts, counts, log)
+
+    try:
+        for path in files:
+            pending.append(
+                [
+                    path,
+                    pool.apply_async(
+                        read_junit_file, (path, conf.sender_id, plan, build, job)
+                    ),
+                ]
+            )
+            if len(pending) > conf.junit_workers:
+                add_next()
+        while pending:
+            add_next()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# read the valid results of the junit xml files into upload, returns the counts
+# of valid, skipped and invalid results
+def read_results(files, conf, log, plan, build, job, upload):
+    counts = [0, 0, 0]
+    if len(files) > 1 and conf.junit_workers > 0:
+        read_junit_pool(files, conf, log, plan, build, job, upload, counts)
+    else:
+        for path in files:
+            file_counts = [0, 0, 0]
+            for result in read_junit_valid(
+                path, conf.sender_id, plan, build, job, file_counts
+            ):
+                upload.add(result)
+            count_junit_file(path, file_counts, counts, log)
+    return counts
+
+
+# open the spool of uploads, None if no spool directory is configured or it
+# can not be used
+def open_spool(conf, log):
+    if not check.is_str_no_empty(conf.spool_dir):
+        return None
+    spool = Spool(conf, log)
+    try:
+        spool.open()
+    except SpoolError as err:
+        log.warn(str(err))
+        return None
+    return spool
+
+
+# resend the spooled uploads in one session and exit
+def flush_spool(conf, log):
+    spool = open_spool(conf, log)
+    if spool is None:
+        log.abort("failed to open spool directory {}".format(conf.spool_dir))
+    sock = UploadSocket(conf, log)
+    try:
+        left = spool.flush(sock)
+        sock.close()
+        spool.confirm()
+    except zmq.ZMQError:
+        log.abort("failed to send topotest results to server")
+    if left > 0:
+        log.abort("failed to resend {} spooled uploads".format(left))
+    if not conf.verbose and not conf.debug:
+        print(
+            "{}: flushed spool {} to server {}".format(
+                conf.progname, conf.spool_dir, conf.server_address
+            )
+        )
+    log.ok("terminating")
+    log.stop()
+    sys.exit(0)
+
+
 def main():
     # initialize config
     conf = ClientConfig()
@@ -169,6 +294,55 @@ def main():
         log.debug("conf.connection_timeout = {}".format(conf.connection_timeout))
         log.abort("upload watchdog timeout value is invalid")
 
+    # make sure the message version and payload encoding are supported
+    if not conf.message_version in TOPOSTAT_MESSAGE_VERSIONS:
+        log.debug("conf.message_version = {}".format(conf.message_version))
+        log.abort("message version value is invalid")
+    conf.message_encoding = conf.message_encoding.lower()
+    if not conf.message_encoding in TOPOSTAT_MESSAGE_ENCODINGS:
+        log.debug("conf.message_encoding = {}".format(conf.message_encoding))
+        log.abort("message encoding value is invalid")
+    if not message_encoding_available(conf.message_encoding):
+        log.abort(
+            "message encoding {} requires the python3 module zstandard".format(
+                conf.message_encoding
+            )
+        )
+    if not check.is_int_min(conf.message_chunk_size, 0):
+        log.debug("conf.message_chunk_size = {}".format(conf.message_chunk_size))
+        log.abort("message chunk size value is invalid")
+
+    # make sure the delivery mode and socket options are valid
+    conf.delivery = conf.delivery.lower()
+    if not conf.delivery in TOPOSTAT_DELIVERY_MODES:
+        log.debug("conf.delivery = {}".format(conf.delivery))
+        log.abort("delivery mode value is invalid")
+    if not check.is_int_min(conf.socket_sndhwm, 0):
+        log.debug("conf.socket_sndhwm = {}".format(conf.socket_sndhwm))
+        log.abort("socket high-water mark value is invalid")
+    if not check.is_int_min(conf.socket_linger_ms, 0):
+        log.debug("conf.socket_linger_ms = {}".format(conf.socket_linger_ms))
+        log.abort("socket linger value is invalid")
+    if not check.is_int_min(conf.junit_workers, 0):
+        log.debug("conf.junit_workers = {}".format(conf.junit_workers))
+        log.abort("junit workers value is invalid")
+    if not check.is_int_min(conf.spool_max_mb, 1):
+        log.debug("conf.spool_max_mb = {}".format(conf.spool_max_mb))
+        log.abort("spool size value is invalid")
+
+    # compose ZeroMQ server address string (includes DNS resolve), acknowledged
+    # messages are sent to server_ack_port instead of server_port
+    port = conf.server_port
+    if conf.delivery == "ack":
+        port = conf.server_ack_port
+    if compose_zmq_client_address_str(conf, log, port) is None:
+        log.abort("failed to compose ZeroMQ server address string")
+    log.info("sending with delivery {} to server port {}".format(conf.delivery, port))
+
+    # only resend the spooled uploads
+    if conf.flush_spool:
+        flush_spool(conf, log)
+
     # get bamboo environment variables
     try:
         plan = str(os.environ["bamboo_planKey"])
@@ -180,136 +354,128 @@ def main():
         log.debug("env[bamboo_buildNumber] = {} (str)".format(build))
     except:
         log.abort("failed to get environment variable bamboo_buildNumber")
+    # the server stores builds as integers and rejects results of other builds
+    try:
+        build_to_int(build)
+    except ValueError:
+        log.abort("environment variable bamboo_buildNumber is not a build number")
     try:
         job = str(os.environ["bamboo_shortJobName"])
         log.debug("env[bamboo_shortJobName] = {} (str)".format(job))
     except:
         log.abort("failed to get environment variable bamboo_shortJobName")
 
-    # compose ZeroMQ server address string (includes DNS resolve)
-    if compose_zmq_client_address_str(conf, log) is None:
-        log.abort("failed to compose ZeroMQ server address string")
-
-    # parse junit xml file
+    # expand the junit xml files, globs and directories
     try:
-        xml = JUnitXml.fromfile(conf.junit_xml)
-        log.info("parsed junit xml file {}".format(conf.junit_xml))
-    except:
-        log.abort("failed to parse junit xml file {}".format(conf.junit_xml))
-
-    # gather test results
-    results_valid = 0
-    results_invalid = 0
-    results_skipped = 0
-    results_total = 0
-    results = []
-    for suite in xml:
-        if isinstance(suite, TestSuite):
-            for case in suite:
-                results_total += 1
-                result = TopotestResult().from_case(
-                    case, conf.sender_id, plan, build, job
-                )
-                # check result
-                if not result.check():
-                    results_invalid += 1
-                    continue
-                # do not report if test was skipped
-                if result.skipped():
-                    results_skipped += 1
-                    continue
-                # append to results list
-                results.append(result.to_json())
-                results_valid += 1
-        elif isinstance(suite, TestCase):
-            results_total += 1
-            result = TopotestResult().from_case(suite, conf.sender_id, plan, build, job)
-            # check result
-            if not result.check():
-                results_invalid += 1
-                continue
-            # do not report if test was skipped
-            if result.skipped():
-                results_skipped += 1
-                continue
-            # append to results list
-            results.append(result.to_json())
-            results_valid += 1
-
-    log.info(
-        "gathered {} test results ({} valid, {} skipped, {} invalid)".format(
-            results_total, results_valid, results_skipped, results_invalid
+        files = junit_files(
+            [path.strip() for path in conf.junit_xml.splitlines() if path.strip()]
         )
-    )
+    except JunitError as err:
+        log.abort(str(err))
+    if not files:
+        log.abort("no junit xml file configured")
+    log.info("reading {} junit xml files".format(len(files)))
+
+    # with delivery ack the uploads spooled by earlier runs are resent first,
+    # the messages of this upload are written to the spool until the server
+    # confirmed them, once the server can not be reached the upload is spooled
+    # without sending it. With delivery push the upload watchdog timer may
+    # expire while the spool is flushed, the upload is spooled completely
+    # first and flushed with the spooled uploads
+    sock = UploadSocket(conf, log)
+    spool = open_spool(conf, log)
+    spooled = None
+    send = sock.send
+    if spool is not None:
+        left = 0
+        if sock.ack:
+            left = spool.flush(sock)
+        spooled = spool.upload(sock, sock.ack and left == 0)
+        sock.expire = spooled.expire
+        send = spooled.send
+    stored = sock.stored
+    duplicates = sock.duplicates
+
+    # gather test results while the junit xml files are read, the results are
+    # sent in chunks while the files are still being processed
+    upload = Upload(conf, log, plan, build, job, send)
+    try:
+        counts = read_results(files, conf, log, plan, build, job, upload)
+        results_valid, results_skipped, results_invalid = counts
+        results_total = sum(counts)
 
-    # send valid results to collection server
-    if results:
-
-        # compose topostat message
-        msg = Message()
-        try:
-            msg.add_payload(results)
-            msg.gen_auth(conf.auth_key)
-        except:
-            log.abort("failed to compose topostat message")
-        if not msg.check():
-            log.abort("check of composed topostat message failed")
-        log.info("composed topostat message")
-
-        # create ZeroMQ context and socket
-        context = zmq.Context()
-        sock = context.socket(zmq.PUSH)
-        if conf.server_address_type in ["IPV6", "DNS"]:
-            sock.setsockopt(zmq.IPV6, True)
-
-        # start upload watchdog timer
-        watchdog = Timer(conf.connection_timeout, watchdog_handler, [log])
-        watchdog.start()
         log.info(
-            "started upload watchdog timer with interval of {}s".format(
-                conf.connection_timeout
+            "gathered {} test results ({} valid, {} skipped, {} invalid)".format(
+                results_total, results_valid, results_skipped, results_invalid
             )
         )
 
-        # establish connection to ZeroMQ server
-        try:
-            sock.connect(conf.socket_address_str)
-            log.info(
-                "connected ZeroMQ PUSH socket to address {}".format(
-                    conf.socket_address_str
-                )
-            )
-        except:
-            watchdog.cancel()
-            sock.close()
-            context.term()
-            log.abort(
-                "failed to connect ZeroMQ PUSH socket to address {}".format(
-                    conf.socket_address_str
+        # send remaining results and wait until all messages are delivered
+        messages = upload.finish()
+        if spooled is not None:
+            spooled.finish()
+        if spooled is not None and not sock.ack:
+            committed = messages > 0 and spooled.commit()
+            spooled.discard()
+            spooled = None
+            left = spool.flush(sock)
+            if left > 0:
+                log.abort("failed to resend {} spooled uploads".format(left))
+            # an upload not fitting into the spool is read again and sent
+            # after the spooled uploads
+            if messages > 0 and not committed:
+                log.warn("sending upload without spooling it")
+                upload = Upload(conf, log, plan, build, job, sock.send)
+                read_results(files, conf, log, plan, build, job, upload)
+                messages = upload.finish()
+        sock.close()
+        if spool is not None:
+            spool.confirm()
+    except JunitError as err:
+        # chunks sent so far are discarded by the server without the final chunk
+        if spooled is not None:
+            spooled.discard()
+        sock.fail("failed to parse junit xml file {}".format(err))
+    except UploadRejectedError as err:
+        if spooled is not None:
+            spooled.discard()
+        sock.fail(str(err))
+    except UploadError as err:
+        log.abort(str(err))
+    except zmq.ZMQError:
+        log.abort("failed to send topotest results to server")
+
+    # spool the upload if the server could not be reached
+    if spooled is not None and not spooled.sending and messages > 0:
+        if not spooled.close():
+            log.abort("failed to send topotest results to server")
+        log.info(
+            "spooled {} topotest results in {} messages".format(results_valid, messages)
+        )
+        if not conf.verbose and not conf.debug:
+            print(
+                "{}: spooled {} valid results to {}".format(
+                    conf.progname, results_valid, conf.spool_dir
                 )
             )
+        log.ok("terminating")
+        log.stop()
+        sys.exit(0)
+    if spooled is not None:
+        spooled.close()
 
-        # send test results JSON data to server
-        try:
-            sock.send_json(msg.to_json())
-            sock.close()
-            context.term()
-            log.info("sent {} topotest results to server".format(results_valid))
+    if messages > 0:
+        log.info(
+            "sent {} topotest results in {} messages to server".format(
+                results_valid, messages
+            )
+        )
+        if sock.ack:
             log.info(
-                "closed ZeroMQ PUSH socket connected to address {}".format(
-                    conf.socket_address_str
+                "server stored {} topotest results ({} duplicates)".format(
+                    sock.stored - stored, sock.duplicates - duplicates
                 )
             )
-        except:
-            watchdog.cancel()
-            sock.close()
-            context.term()
-            log.err("failed to send topotest results to server")
-
-        # stop upload watchdog timer
-        watchdog.cancel()
-        log.info("stopped upload watchdog timer")
-
     else:
         # nothing to do if no valid results
         log.info("no results to send")
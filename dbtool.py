@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Database Tool
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import os
+import sys
+import argparse
+import sqlite3
+
+from lib.topostat import Logger, TopotestResult
+from lib.config import ServerConfig, read_config_file
+from lib.database import (
+    ResultStore,
+    TOPOSTAT_DB_SCHEMA_VERSION,
+    configure_connection,
+    results_schema_version,
+    create_results_tables,
+    create_results_indexes,
+    delete_duplicate_results,
+    rebuild_results_stats,
+)
+from lib.partition import partition_file, list_partitions
+import lib.check as check
+
+
+DBTOOL_COMMANDS = ["migrate", "rebuild-stats", "dedup"]
+
+
+# convert a version 1 results table to the current schema, the old table is
+# renamed to <table>_v1 and copied in chunks of chunk_size rows keeping the row
+# ids, an interrupted migration continues after the last copied row
+def migrate(conn, conf, log, chunk_size, drop):
+    table = conf.results_table
+    old_table = table + "_v1"
+    version = results_schema_version(conn, table)
+    old_version = results_schema_version(conn, old_table)
+
+    if version == TOPOSTAT_DB_SCHEMA_VERSION and old_version == 0:
+        log.info(
+            "table {} in database {} already uses schema version {}".format(
+                table, conf.sqlite3_db, version
+            )
+        )
+        return True
+    if version == 0 and old_version == 0:
+        log.err("table {} does not exist in database {}".format(table, conf.sqlite3_db))
+        return False
+    if version == 1:
+        if old_version != 0:
+            log.err(
+                "unable to rename table {} to {}, table exists".format(table, old_table)
+            )
+            return False
+        conn.execute("ALTER TABLE {} RENAME TO {}".format(table, old_table))
+        conn.commit()
+        log.info("renamed table {} to {}".format(table, old_table))
+    elif old_version != 1:
+        log.err("table {} does not use schema version 1".format(old_table))
+        return False
+
+    create_results_tables(conn, table, indexes=False)
+    store = ResultStore(conn, table, stats=False)
+
+    # continue after the last already copied row
+    last_id = conn.execute("SELECT max(id) FROM {}".format(table)).fetchone()[0]
+    if last_id is None:
+        last_id = 0
+    else:
+        log.info("continuing migration after row id {}".format(last_id))
+
+    results_migrated = 0
+    results_invalid = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, name, result, time, host, timestamp, plan, build, job"
+            + " FROM {} WHERE id > ? ORDER BY id LIMIT ?".format(old_table),
+            (last_id, chunk_size),
+        ).fetchall()
+        if not rows:
+            break
+        typed_rows = []
+        for row in rows:
+            result = TopotestResult(*row[1:])
+            if not result.check():
+                results_invalid += 1
+                continue
+            try:
+                typed_rows.append((row[0], result.to_row()))
+            except:
+                results_invalid += 1
+        last_id = rows[-1][0]
+        try:
+            store.insert_many_with_ids(typed_rows)
+            conn.commit()
+        except:
+            store.rollback()
+            log.err(
+                "failed to copy rows up to id {} into table {}".format(last_id, table)
+            )
+            return False
+        results_migrated += len(typed_rows)
+        log.debug("copied rows up to id {} into table {}".format(last_id, table))
+
+    log.info(
+        "migrated {} results ({} invalid results skipped) to table {}".format(
+            results_migrated, results_invalid, table
+        )
+    )
+    count = delete_duplicate_results(conn, table)
+    if count > 0:
+        log.info("deleted {} duplicate results of table {}".format(count, table))
+    create_results_indexes(conn, table)
+    log.info("created indexes on table {}".format(table))
+    rebuild_results_stats(conn, table)
+    log.info("rebuilt aggregates of table {}".format(table))
+
+    if drop:
+        conn.execute("DROP TABLE {}".format(old_table))
+        conn.commit()
+        log.info(
+            "dropped table {}, run VACUUM to reclaim its disk space".format(old_table)
+        )
+    return True
+
+
+# recompute the per test and plan aggregates from the raw results
+def rebuild_stats(conn, conf, log):
+    table = conf.results_table
+    version = results_schema_version(conn, table)
+    if version != TOPOSTAT_DB_SCHEMA_VERSION:
+        log.err(
+            "table {} in database {} uses schema version {}".format(
+                table, conf.sqlite3_db, version
+            )
+        )
+        return False
+    create_results_tables(conn, table)
+    rebuild_results_stats(conn, table)
+    count = conn.execute("SELECT count(*) FROM {}_stats".format(table)).fetchone()[0]
+    log.info("rebuilt {} aggregates of table {}".format(count, table))
+    return True
+
+
+# delete all but the newest of the results sharing plan, build, job and test
+# name, create the unique key index and recompute the aggregates
+def dedup(conn, conf, log):
+    table = conf.results_table
+    version = results_schema_version(conn, table)
+    if version != TOPOSTAT_DB_SCHEMA_VERSION:
+        log.err(
+            "table {} in database {} uses schema version {}".format(
+                table, conf.sqlite3_db, version
+            )
+        )
+        return False
+    create_results_tables(conn, table, indexes=False)
+    count = delete_duplicate_results(conn, table)
+    log.info("deleted {} duplicate results of table {}".format(count, table))
+    create_results_indexes(conn, table)
+    rebuild_results_stats(conn, table)
+    log.info("rebuilt aggregates of table {}".format(table))
+    return True
+
+
+def parse_cli_arguments(conf, log):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("command", help="database command", choices=DBTOOL_COMMANDS)
+    ap.add_argument("-v", "--verbose", help="verbose output", action="store_true")
+    ap.add_argument("-d", "--debug", help="debug messages", action="store_true")
+    ap.add_argument("-c", "--config", help="configuration file")
+    ap.add_argument("-b", "--database", help="sqlite3 database file")
+    ap.add_argument("-l", "--log", help="log file")
+    ap.add_argument(
+        "-n",
+        "--chunk-size",
+        help="rows per transaction (default 10000)",
+        type=int,
+        default=10000,
+    )
+    ap.add_argument(
+        "--drop", help="drop the version 1 table after migrate", action="store_true"
+    )
+
+    try:
+        args = vars(ap.parse_args())
+        conf_to_args = {
+            "verbose": "verbose",
+            "debug": "debug",
+            "config_file": "config",
+            "sqlite3_db": "database",
+            "log_file": "log",
+        }
+        for conf_var, arg_val in conf_to_args.items():
+            if not args[arg_val] is None:
+                if conf_var in conf.config_bools:
+                    if args[arg_val]:
+                        conf.__dict__[conf_var] = True
+                        log.debug(
+                            "conf.{} = args[{}] = True (bool)".format(conf_var, arg_val)
+                        )
+                elif check.is_str_no_empty(args[arg_val]):
+                    conf.__dict__[conf_var] = args[arg_val]
+                    log.debug(
+                        "conf.{} = args[{}] = {} (str)".format(
+                            conf_var, arg_val, args[arg_val]
+                        )
+                    )
+    except:
+        log.abort("failed to parse arguments")
+    return args
+
+
+def main():
+    # initialize config, the database tool uses the server configuration
+    conf = ServerConfig()
+    conf.progname = "topostat-dbtool"
+    conf.progname_long = "NetDEF FRR Topotest Results Statistics Tool Database Tool"
+
+    # initialize logger
+    log = Logger(conf)
+
+    # log start entry
+    log.info("started {}".format(conf.progname_long))
+
+    # read config file
+    for arg in sys.argv:
+        if sys.argv.index(arg) + 1 == len(sys.argv):
+            break
+        if arg in ("-c", "--config"):
+            conf.config_file = sys.argv[sys.argv.index(arg) + 1]
+    if check.is_str_no_empty(conf.config_file):
+        read_config_file(conf.config_file, conf, log)
+    elif os.path.isfile(conf.default_config_file):
+        read_config_file(conf.default_config_file, conf, log)
+
+    # parse cli arguments
+    args = parse_cli_arguments(conf, log)
+
+    # start log buffer output
+    log.info("writing to log file {}".format(conf.log_file))
+    log.start()
+
+    # do a configuration check
+    if not conf.check():
+        log.abort("configuration check failed")
+    if not check.is_int_min(args["chunk_size"], 1):
+        log.abort("chunk size value is invalid")
+
+    # a partitioned database is processed partition by partition
+    if conf.db_partition == "none":
+        databases = [conf.sqlite3_db]
+    else:
+        try:
+            databases = [
+                partition_file(conf.sqlite3_db, key)
+                for key in list_partitions(conf.sqlite3_db, conf.db_partition)
+            ]
+        except:
+            log.abort(
+                "failed to list partitions of database {}".format(conf.sqlite3_db)
+            )
+        if not databases:
+            log.abort("database {} has no partitions".format(conf.sqlite3_db))
+
+    ok = True
+    for db in databases:
+        conf.sqlite3_db = db
+
+        # connect to sqlite3 db
+        try:
+            conn = sqlite3.connect(conf.sqlite3_db)
+            configure_connection(conn, conf)
+        except:
+            log.abort("failed to connect to database {}".format(conf.sqlite3_db))
+        log.info("opened database {}".format(conf.sqlite3_db))
+
+        # run command
+        try:
+            if args["command"] == "migrate":
+                db_ok = migrate(conn, conf, log, args["chunk_size"], args["drop"])
+            elif args["command"] == "rebuild-stats":
+                db_ok = rebuild_stats(conn, conf, log)
+            elif args["command"] == "dedup":
+                db_ok = dedup(conn, conf, log)
+        except:
+            db_ok = False
+            log.err("{} failed on database {}".format(args["command"], conf.sqlite3_db))
+        ok = ok and db_ok
+
+        # closing database connection
+        conn.close()
+        log.info("closed connection to database {}".format(conf.sqlite3_db))
+
+    # exit
+    if not ok:
+        log.abort("{} failed".format(args["command"]))
+    log.ok("terminating")
+    log.stop()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
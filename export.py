@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Export
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import os
+import sys
+import json
+import argparse
+import sqlite3
+from urllib.parse import quote
+
+from lib.topostat import Logger
+from lib.config import ServerConfig, read_config_file
+from lib.database import (
+    TOPOSTAT_DB_SCHEMA_VERSION,
+    results_schema_version,
+    configure_read_connection,
+)
+from lib.partition import partition_file, list_partitions
+from lib.export import (
+    EXPORT_FORMATS,
+    export_format_available,
+    default_export_format,
+    read_dictionaries,
+    read_chunks,
+    count_text_builds,
+    open_export,
+)
+import lib.check as check
+
+
+# read the last exported row id per partition from the state file, the key of
+# an unpartitioned database is ""
+def read_state(state_file, conf, log):
+    if not os.path.isfile(state_file):
+        return {}
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except:
+        log.abort("failed to read export state file {}".format(state_file))
+    if state.get("database") != conf.sqlite3_db or state.get("table") != (
+        conf.results_table
+    ):
+        log.abort(
+            "export state file {} belongs to table {} in database {}".format(
+                state_file, state.get("table"), state.get("database")
+            )
+        )
+    return state["last_ids"]
+
+
+# replace the state file atomically
+def write_state(state_file, conf, last_ids):
+    tmp_file = state_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(
+            {
+                "database": conf.sqlite3_db,
+                "table": conf.results_table,
+                "last_ids": last_ids,
+            },
+            f,
+        )
+    os.replace(tmp_file, state_file)
+
+
+def parse_cli_arguments(conf, log):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("output", help="export file")
+    ap.add_argument("-v", "--verbose", help="verbose output", action="store_true")
+    ap.add_argument("-d", "--debug", help="debug messages", action="store_true")
+    ap.add_argument("-c", "--config", help="configuration file")
+    ap.add_argument("-b", "--database", help="sqlite3 database file")
+    ap.add_argument("-l", "--log", help="log file")
+    ap.add_argument("-f", "--format", help="export file format", choices=EXPORT_FORMATS)
+    ap.add_argument(
+        "-s", "--state", help="state file, export only rows newer than last export"
+    )
+    ap.add_argument(
+        "-n",
+        "--chunk-size",
+        help="rows per chunk (default 100000)",
+        type=int,
+        default=100000,
+    )
+
+    try:
+        args = vars(ap.parse_args())
+        conf_to_args = {
+            "verbose": "verbose",
+            "debug": "debug",
+            "config_file": "config",
+            "sqlite3_db": "database",
+            "log_file": "log",
+        }
+        for conf_var, arg_val in conf_to_args.items():
+            if not args[arg_val] is None:
+                if conf_var in conf.config_bools:
+                    if args[arg_val]:
+                        conf.__dict__[conf_var] = True
+                        log.debug(
+                            "conf.{} = args[{}] = True (bool)".format(conf_var, arg_val)
+                        )
+                elif check.is_str_no_empty(args[arg_val]):
+                    conf.__dict__[conf_var] = args[arg_val]
+                    log.debug(
+                        "conf.{} = args[{}] = {} (str)".format(
+                            conf_var, arg_val, args[arg_val]
+                        )
+                    )
+    except:
+        log.abort("failed to parse arguments")
+    return args
+
+
+def main():
+    # initialize config, the export uses the server configuration
+    conf = ServerConfig()
+    conf.progname = "topostat-export"
+    conf.progname_long = "NetDEF FRR Topotest Results Statistics Tool Export"
+
+    # initialize logger
+    log = Logger(conf)
+
+    # log start entry
+    log.info("started {}".format(conf.progname_long))
+
+    # read config file
+    for arg in sys.argv:
+        if sys.argv.index(arg) + 1 == len(sys.argv):
+            break
+        if arg in ("-c", "--config"):
+            conf.config_file = sys.argv[sys.argv.index(arg) + 1]
+    if check.is_str_no_empty(conf.config_file):
+        read_config_file(conf.config_file, conf, log)
+    elif os.path.isfile(conf.default_config_file):
+        read_config_file(conf.default_config_file, conf, log)
+
+    # parse cli arguments
+    args = parse_cli_arguments(conf, log)
+
+    # start log buffer output
+    log.info("writing to log file {}".format(conf.log_file))
+    log.start()
+
+    # do a configuration check
+    if not conf.check():
+        log.abort("configuration check failed")
+    if not check.is_int_min(args["chunk_size"], 1):
+        log.abort("chunk size value is invalid")
+
+    # select the export format
+    fmt = args["format"]
+    if fmt is None:
+        fmt = default_export_format(args["output"])
+    if fmt is None:
+        log.abort("exporting requires the python3 module pyarrow or numpy")
+    if not export_format_available(fmt):
+        log.abort(
+            "export format {} requires the python3 module {}".format(
+                fmt, "numpy" if fmt == "npz" else "pyarrow"
+            )
+        )
+
+    # a partitioned database is exported partition by partition
+    if conf.db_partition == "none":
+        databases = [["", conf.sqlite3_db]]
+    else:
+        try:
+            databases = [
+                [key, partition_file(conf.sqlite3_db, key)]
+                for key in list_partitions(conf.sqlite3_db, conf.db_partition)
+            ]
+        except:
+            log.abort(
+                "failed to list partitions of database {}".format(conf.sqlite3_db)
+            )
+
+    # last exported row ids of an incremental export
+    last_ids = {}
+    if args["state"] is not None:
+        last_ids = read_state(args["state"], conf, log)
+
+    # open every database in a read transaction, so the export is a consistent
+    # snapshot while the server keeps inserting results
+    conns = []
+    max_ids = {}
+    for key, db in databases:
+        try:
+            conn = sqlite3.connect("file:{}?mode=ro".format(quote(db)), uri=True)
+            configure_read_connection(conn, conf)
+            conn.execute("BEGIN")
+            version = results_schema_version(conn, conf.results_table)
+            if version == TOPOSTAT_DB_SCHEMA_VERSION:
+                max_ids[key] = conn.execute(
+                    "SELECT coalesce(max(id), 0) FROM {}".format(conf.results_table)
+                ).fetchone()[0]
+        except:
+            log.abort("failed to open database {}".format(db))
+        if version != TOPOSTAT_DB_SCHEMA_VERSION:
+            log.abort(
+                "table {} in database {} uses schema version {}".format(
+                    conf.results_table, db, version
+                )
+            )
+        conns.append(conn)
+    if not any(max_ids[key] > last_ids.get(key, 0) for key, db in databases):
+        log.ok("no new results to export")
+        log.stop()
+        sys.exit(0)
+
+    # write the export to a temporary file replacing the export file once done
+    tmp_file = args["output"] + ".tmp"
+    rows = 0
+    try:
+        dictionaries, codes = read_dictionaries(conns, conf.results_table)
+        export = open_export(tmp_file, fmt, dictionaries)
+        for i, (key, db) in enumerate(databases):
+            skipped = count_text_builds(
+                conns[i], conf.results_table, last_ids.get(key, 0), max_ids[key]
+            )
+            if skipped > 0:
+                log.warn(
+                    "skipped {} results of database {} with a build that is not a number".format(
+                        skipped, db
+                    )
+                )
+            for columns in read_chunks(
+                conns[i],
+                conf.results_table,
+                codes[i],
+                last_ids.get(key, 0),
+                max_ids[key],
+                args["chunk_size"],
+            ):
+                export.write(columns)
+                rows += len(columns["id"])
+                log.debug(
+                    "exported rows up to id {} of database {}".format(
+                        columns["id"][-1], db
+                    )
+                )
+        export.close()
+        os.replace(tmp_file, args["output"])
+    except:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        log.abort(
+            "failed to export table {} to {}".format(conf.results_table, args["output"])
+        )
+    for conn in conns:
+        conn.close()
+    log.info("exported {} results to {} file {}".format(rows, fmt, args["output"]))
+
+    # remember the last exported rows
+    if args["state"] is not None:
+        last_ids.update(max_ids)
+        try:
+            write_state(args["state"], conf, last_ids)
+        except:
+            log.abort("failed to write export state file {}".format(args["state"]))
+
+    # exit
+    log.ok("terminating")
+    log.stop()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
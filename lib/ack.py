@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Delivery Acknowledgements
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import os
+from queue import Queue, Empty
+
+
+# client delivery modes, push sends without confirmation, ack waits for the
+# server to reply once the results are committed
+TOPOSTAT_DELIVERY_MODES = ["push", "ack"]
+
+# error replied to the final chunk of an upload missing earlier chunks, e.g.
+# staged before a server restart or expired, the client sends the upload again
+TOPOSTAT_ACK_INCOMPLETE = "incomplete upload"
+
+
+# reply to an acknowledged message, the counts of stored, duplicate and staged
+# results are added by the database writer once they are committed, committed
+# is set once the upload of an unchunked message or a final chunk is stored
+def ack_reply(upload=None, error=None, committed=False):
+    reply = {"status": "ok" if error is None else "error"}
+    if upload is not None:
+        reply["upload_id"] = upload[0]
+        reply["chunk"] = upload[1]
+        reply["chunks"] = upload[2]
+    reply["committed"] = committed
+    reply["stored"] = 0
+    reply["duplicates"] = 0
+    reply["staged"] = 0
+    if error is not None:
+        reply["error"] = error
+    return reply
+
+
+class AckQueue:
+    """
+    Replies to acknowledged messages. The ingest callback and database writer
+    threads queue replies, the main thread owning the ZeroMQ ROUTER sockets
+    sends them. A pipe wakes up the poller of the main thread, ZeroMQ sockets
+    must not be shared between threads.
+    """
+
+    def __init__(self):
+        self.queue = Queue()
+        self.rfd, self.wfd = os.pipe()
+        os.set_blocking(self.rfd, False)
+        os.set_blocking(self.wfd, False)
+
+    # queue a reply to the client of route, [socket index, identity]
+    def put(self, route, reply):
+        self.queue.put([route, reply])
+        try:
+            os.write(self.wfd, b"\0")
+        except BlockingIOError:
+            # the main thread has not yet drained earlier wake ups
+            pass
+
+    # poller interface
+    def fileno(self):
+        return self.rfd
+
+    # clear the wake ups and return all queued replies
+    def drain(self):
+        try:
+            while os.read(self.rfd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        replies = []
+        while True:
+            try:
+                replies.append(self.queue.get_nowait())
+            except Empty:
+                return replies
+
+    def close(self):
+        os.close(self.rfd)
+        os.close(self.wfd)
@@ -111,9 +111,45 @@ class Config:
 class ServerConfig(Config):
     def __init__(self):
         self.default_variables()
-        self.bool_vars(["run", "verbose", "debug", "server_no_ipv6", "server_no_ipv4"])
+        self.bool_vars(
+            [
+                "run",
+                "verbose",
+                "debug",
+                "server_no_ipv6",
+                "server_no_ipv4",
+                "server_no_query",
+                "server_no_ack",
+                "stage_timers",
+            ]
+        )
         self.int_vars(
-            ["server_port_ipv6", "server_port_ipv4", "socket_recv_timeout_ms"]
+            [
+                "server_port_ipv6",
+                "server_port_ipv4",
+                "db_batch_size",
+                "db_flush_interval_ms",
+                "db_queue_size",
+                "ingest_workers",
+                "server_query_port_ipv6",
+                "server_query_port_ipv4",
+                "query_page_size",
+                "query_max_page_size",
+                "db_cache_size_kib",
+                "db_mmap_size_mib",
+                "db_busy_timeout_ms",
+                "db_checkpoint_interval_ms",
+                "db_partition_retention",
+                "db_dedup_filter_capacity",
+                "db_staging_timeout_s",
+                "server_ack_port_ipv6",
+                "server_ack_port_ipv4",
+                "server_rcvhwm",
+                "server_sndhwm",
+                "server_linger_ms",
+                "metrics_port",
+                "stage_timers_interval_s",
+            ]
         )
         self.no_overwrite_vars(["run", "default_config_file"])
         self.no_show_vars(["auth_key"])
@@ -151,8 +187,33 @@ class ServerConfig(Config):
         self.server_port_ipv4 = 5678
         self.socket_address_ipv4_str = ""
 
-        # sockets receive timeout in milliseconds
-        self.socket_recv_timeout_ms = 100
+        # server query sockets, bound to the ipv6 and ipv4 server addresses
+        self.server_no_query = False
+        self.server_query_port_ipv6 = 5679
+        self.server_query_port_ipv4 = 5679
+        self.socket_address_query_ipv6_str = ""
+        self.socket_address_query_ipv4_str = ""
+
+        # server sockets of acknowledged uploads, bound to the ipv6 and ipv4
+        # server addresses, replying to every message once its results are
+        # committed
+        self.server_no_ack = False
+        self.server_ack_port_ipv6 = 5680
+        self.server_ack_port_ipv4 = 5680
+        self.socket_address_ack_ipv6_str = ""
+        self.socket_address_ack_ipv4_str = ""
+
+        # high-water marks of all server sockets in messages, receiving stops
+        # once server_rcvhwm messages are queued and the ingest workers and the
+        # database writer are busy, pending replies are dropped after
+        # server_linger_ms on shutdown
+        self.server_rcvhwm = 1000
+        self.server_sndhwm = 1000
+        self.server_linger_ms = 1000
+
+        # default and maximum number of rows per query response page
+        self.query_page_size = 100
+        self.query_max_page_size = 1000
 
         # authentication
         self.auth_key = ""
@@ -161,12 +222,88 @@ class ServerConfig(Config):
         self.sqlite3_db = "/home/topostat/topotests.db"
         self.results_table = "testresults"
 
+        # sqlite3 storage profile, journal mode and synchronous level take the
+        # values of the sqlite3 pragmas of the same name, the page cache size
+        # is given in KiB, the memory mapped size in MiB, 0 disables memory
+        # mapped i/o
+        self.db_journal_mode = "wal"
+        self.db_synchronous = "normal"
+        self.db_cache_size_kib = 65536
+        self.db_mmap_size_mib = 256
+        self.db_busy_timeout_ms = 5000
+
+        # write-ahead log checkpoints are run by a background thread every
+        # db_checkpoint_interval_ms instead of by the writer thread, 0 leaves
+        # checkpoints to the writer thread
+        self.db_checkpoint_interval_ms = 10000
+
+        # results are stored in one database file per db_partition period
+        # (year, month or day) named after sqlite3_db, or all in sqlite3_db
+        # with none, partitions older than db_partition_retention periods are
+        # deleted, or moved to db_partition_archive_dir if set, 0 keeps all
+        self.db_partition = "none"
+        self.db_partition_retention = 0
+        self.db_partition_archive_dir = ""
+
+        # a result with the plan, build, job and test name of a stored result
+        # is ignored or replaces the stored result, messages are identified by
+        # their upload id and stored only once, the bloom filter answering
+        # most duplicate checks is sized for db_dedup_filter_capacity results
+        self.db_duplicates = "ignore"
+        self.db_dedup_filter_capacity = 1000000
+
+        # chunks of a chunked upload are staged until the final chunk arrived,
+        # uploads without a chunk for db_staging_timeout_s are discarded
+        self.db_staging_timeout_s = 3600
+
+        # database writer thread, rows of several messages are committed in a
+        # single transaction once db_batch_size rows are pending or
+        # db_flush_interval_ms passed since the first pending message, the
+        # queue holds at most db_queue_size messages
+        self.db_batch_size = 500
+        self.db_flush_interval_ms = 100
+        self.db_queue_size = 64
+
+        # number of worker processes decoding, authenticating and validating
+        # received messages, 0 processes messages in the main thread
+        self.ingest_workers = 0
+
+        # main loop, poller serves all sockets in a blocking loop, asyncio in
+        # concurrent tasks next to a housekeeping task
+        self.server_loop = "poller"
+
+        # prometheus metrics served over http on metrics_address, 0 disables
+        # the metrics http server
+        self.metrics_address = "127.0.0.1"
+        self.metrics_port = 0
+
+        # durations of the processing stages of received messages are logged
+        # as a summary every stage_timers_interval_s
+        self.stage_timers = False
+        self.stage_timers_interval_s = 60
+
+        # main loop profile statistics file, written on SIGUSR1 and on exit
+        self.profile_file = ""
+
 
 class ClientConfig(Config):
     def __init__(self):
         self.default_variables()
-        self.bool_vars(["verbose", "debug"])
-        self.int_vars(["server_port", "connection_timeout"])
+        self.bool_vars(["verbose", "debug", "flush_spool"])
+        self.int_vars(
+            [
+                "server_port",
+                "server_query_port",
+                "connection_timeout",
+                "message_version",
+                "message_chunk_size",
+                "server_ack_port",
+                "socket_sndhwm",
+                "socket_linger_ms",
+                "junit_workers",
+                "spool_max_mb",
+            ]
+        )
         self.no_overwrite_vars(["default_config_file", "server_address_type"])
         self.no_show_vars(["auth_key"])
 
@@ -192,15 +329,51 @@ class ClientConfig(Config):
         self.server_address_type = ""
         self.server_address = "127.0.0.1"
         self.server_port = 5678
+        self.server_query_port = 5679
         self.socket_address_str = ""
         self.connection_timeout = 15
         self.sender_id = ""
 
+        # delivery mode, ack waits up to connection_timeout for the server to
+        # confirm every message once its results are committed, push sends to
+        # server_port without confirmation for older servers
+        self.delivery = "ack"
+        self.server_ack_port = 5680
+
+        # high-water mark of the upload socket in messages, sending blocks up
+        # to connection_timeout once reached, with delivery ack unsent messages
+        # are dropped socket_linger_ms after closing the socket, with delivery
+        # push the upload watchdog fails the client if they are not delivered
+        # within connection_timeout
+        self.socket_sndhwm = 1000
+        self.socket_linger_ms = 10000
+
+        # message version and payload encoding, version 1 sends uncompressed
+        # single frame messages understood by older servers, zstd needs the
+        # zstandard module on the client and the server
+        self.message_version = 2
+        self.message_encoding = "zlib"
+
+        # version 2 uploads of more than message_chunk_size results are sent in
+        # chunks of that many results, 0 sends all results in one message
+        self.message_chunk_size = 10000
+
         # authentication
         self.auth_key = ""
 
-        # junit xml
+        # junit xml files, globs and directories separated by newlines, more
+        # than one file is read by junit_workers processes, 0 reads all files
+        # in the client process
         self.junit_xml = ""
+        self.junit_workers = 4
+
+        # uploads the server could not be reached for are spooled to spool_dir
+        # and resent by the next client run, the oldest spooled uploads are
+        # evicted beyond spool_max_mb, an empty spool_dir disables the spool,
+        # flush_spool only resends the spooled uploads
+        self.spool_dir = ""
+        self.spool_max_mb = 100
+        self.flush_spool = False
 
 
 def read_config_file(config_file, conf, log):
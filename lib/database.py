@@ -0,0 +1,956 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Database
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import time
+import sqlite3
+import threading
+from queue import Queue, Empty, Full
+
+from lib.topostat import TOPOSTAT_RESULTS
+from lib.bloom import BloomFilter
+from lib.ack import ack_reply, TOPOSTAT_ACK_INCOMPLETE
+
+
+# results schema version written by the server, version 1 is the original
+# table storing every value as text
+TOPOSTAT_DB_SCHEMA_VERSION = 2
+
+# dimension tables, the names of test, host, plan and job values are stored
+# once per table and referenced by integer id from the results table
+TOPOSTAT_DB_DIMENSIONS = ["tests", "hosts", "plans", "jobs"]
+
+# handling of a result with the plan, build, job and test of a stored result
+TOPOSTAT_DB_DUPLICATES = ["ignore", "replace"]
+
+# values of the sqlite3 journal_mode and synchronous pragmas
+TOPOSTAT_DB_JOURNAL_MODES = ["delete", "truncate", "persist", "memory", "wal", "off"]
+TOPOSTAT_DB_SYNCHRONOUS = ["off", "normal", "full", "extra"]
+
+
+# determine the schema version of a results table, 0 if it does not exist
+def results_schema_version(conn, table):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info({})".format(table))]
+    if not columns:
+        return 0
+    if "test_id" in columns:
+        return 2
+    return 1
+
+
+# create the results table with its dimension tables and a view presenting the
+# results with the values of the original version 1 table, bulk loads may
+# create the indexes afterwards
+def create_results_tables(conn, table, indexes=True):
+    for dim in TOPOSTAT_DB_DIMENSIONS:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS {}_{} (".format(table, dim)
+            + "id INTEGER PRIMARY KEY"
+            + ", name TEXT NOT NULL UNIQUE"
+            + ")"
+        )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS {} (".format(table)
+        + "id INTEGER PRIMARY KEY AUTOINCREMENT"
+        + ", test_id INTEGER NOT NULL REFERENCES {}_tests(id)".format(table)
+        + ", result INTEGER NOT NULL"
+        + ", duration REAL NOT NULL"
+        + ", host_id INTEGER NOT NULL REFERENCES {}_hosts(id)".format(table)
+        + ", timestamp INTEGER NOT NULL"
+        + ", plan_id INTEGER NOT NULL REFERENCES {}_plans(id)".format(table)
+        + ", build INTEGER NOT NULL"
+        + ", job_id INTEGER NOT NULL REFERENCES {}_jobs(id)".format(table)
+        + ")"
+    )
+    conn.execute(
+        "CREATE VIEW IF NOT EXISTS {}_view AS SELECT".format(table)
+        + " r.id AS id"
+        + ", t.name AS name"
+        + ", CASE r.result"
+        + "".join(
+            " WHEN {} THEN '{}'".format(i, val)
+            for i, val in enumerate(TOPOSTAT_RESULTS)
+        )
+        + " END AS result"
+        + ", r.duration AS time"
+        + ", h.name AS host"
+        + ", datetime(r.timestamp, 'unixepoch') AS timestamp"
+        + ", p.name AS plan"
+        + ", r.build AS build"
+        + ", j.name AS job"
+        + " FROM {} r".format(table)
+        + " JOIN {}_tests t ON t.id = r.test_id".format(table)
+        + " JOIN {}_hosts h ON h.id = r.host_id".format(table)
+        + " JOIN {}_plans p ON p.id = r.plan_id".format(table)
+        + " JOIN {}_jobs j ON j.id = r.job_id".format(table)
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS {}_stats (".format(table)
+        + "test_id INTEGER NOT NULL"
+        + ", plan_id INTEGER NOT NULL"
+        + "".join(
+            ", {} INTEGER NOT NULL DEFAULT 0".format(val) for val in TOPOSTAT_RESULTS
+        )
+        + ", total_duration REAL NOT NULL DEFAULT 0"
+        + ", mean_duration REAL NOT NULL DEFAULT 0"
+        + ", last_result INTEGER"
+        + ", last_build INTEGER"
+        + ", last_failure_build INTEGER"
+        + ", PRIMARY KEY (test_id, plan_id)"
+        + ") WITHOUT ROWID"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS {}_uploads (".format(table)
+        + "upload_id TEXT PRIMARY KEY"
+        + ", received INTEGER NOT NULL"
+        + ", results INTEGER NOT NULL"
+        + ") WITHOUT ROWID"
+    )
+    # typed rows of chunked uploads waiting for their final chunk
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS {}_staging (".format(table)
+        + "upload_id TEXT NOT NULL"
+        + ", chunk INTEGER NOT NULL"
+        + ", name TEXT NOT NULL"
+        + ", result INTEGER NOT NULL"
+        + ", duration REAL NOT NULL"
+        + ", host TEXT NOT NULL"
+        + ", timestamp INTEGER NOT NULL"
+        + ", plan TEXT NOT NULL"
+        + ", build INTEGER NOT NULL"
+        + ", job TEXT NOT NULL"
+        + ")"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS {0}_staging_idx ON {0}_staging (".format(table)
+        + "upload_id, chunk"
+        + ")"
+    )
+    conn.commit()
+    if indexes:
+        create_results_indexes(conn, table)
+
+
+# create the unique index on the result key, plan, build, job and test, and the
+# covering indexes used by the canned queries of lib.query, per test history,
+# per build summaries and failure lists, creating the unique index fails with
+# sqlite3.IntegrityError if the table holds duplicate results
+def create_results_indexes(conn, table):
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS {0}_key_idx ON {0} (".format(table)
+        + "plan_id, build, job_id, test_id"
+        + ")"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS {0}_test_idx ON {0} (".format(table)
+        + "test_id, plan_id, build, result, duration, timestamp, host_id, job_id"
+        + ")"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS {0}_build_idx ON {0} (".format(table)
+        + "plan_id, build, job_id, result, duration, test_id"
+        + ")"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS {0}_timestamp_idx ON {0} (".format(table)
+        + "timestamp, result, plan_id, build, job_id, test_id, host_id, duration"
+        + ")"
+    )
+    conn.commit()
+
+
+# check if a table exists
+def table_exists(conn, table):
+    row = conn.execute(
+        "SELECT count(name) FROM sqlite_master WHERE type='table' AND name=?",
+        (table,),
+    ).fetchone()
+    return row[0] > 0
+
+
+# delete all but the last inserted result of every plan, build, job and test,
+# returns the number of deleted results
+def delete_duplicate_results(conn, table):
+    count = conn.execute(
+        "DELETE FROM {} WHERE id NOT IN (".format(table)
+        + "SELECT max(id) FROM {} GROUP BY plan_id, build, job_id, test_id".format(
+            table
+        )
+        + ")"
+    ).rowcount
+    conn.commit()
+    return count
+
+
+# recompute the per test and plan aggregates from all stored results
+def rebuild_results_stats(conn, table):
+    counts = ", ".join(
+        "sum(result = {}) AS {}".format(i, val)
+        for i, val in enumerate(TOPOSTAT_RESULTS)
+    )
+    conn.execute("DELETE FROM {}_stats".format(table))
+    # the bare result and build columns are taken from the row with max(id)
+    conn.execute(
+        "INSERT INTO {}_stats (".format(table)
+        + "test_id, plan_id, {}".format(", ".join(TOPOSTAT_RESULTS))
+        + ", total_duration, mean_duration, last_result, last_build"
+        + ") SELECT test_id, plan_id, {}".format(", ".join(TOPOSTAT_RESULTS))
+        + ", total_duration, mean_duration, result, build FROM ("
+        + "SELECT test_id, plan_id, {}".format(counts)
+        + ", sum(duration) AS total_duration, avg(duration) AS mean_duration"
+        + ", result, build, max(id)"
+        + " FROM {} GROUP BY test_id, plan_id".format(table)
+        + ")"
+    )
+    conn.execute(
+        "UPDATE {0}_stats SET last_failure_build = (".format(table)
+        + "SELECT build FROM {} r".format(table)
+        + " WHERE r.test_id = {}_stats.test_id".format(table)
+        + " AND r.plan_id = {}_stats.plan_id".format(table)
+        + " AND r.result = {}".format(TOPOSTAT_RESULTS.index("failed"))
+        + " ORDER BY r.id DESC LIMIT 1"
+        + ")"
+    )
+    conn.commit()
+
+
+# apply the configured storage profile to a connection and return the journal
+# mode in effect, which differs from the configured one if sqlite3 is unable to
+# switch, e.g. to wal on an in-memory database, automatic checkpoints are only
+# disabled on connections whose checkpoints are run by a DatabaseCheckpointer
+def configure_connection(conn, conf, autocheckpoint=True):
+    configure_read_connection(conn, conf)
+    journal_mode = conn.execute(
+        "PRAGMA journal_mode = {}".format(conf.db_journal_mode)
+    ).fetchone()[0]
+    conn.execute("PRAGMA synchronous = {}".format(conf.db_synchronous))
+    if not autocheckpoint:
+        conn.execute("PRAGMA wal_autocheckpoint = 0")
+    return journal_mode
+
+
+# apply the settings of the storage profile that do not write to the database,
+# a read-only connection fails to switch the journal mode
+def configure_read_connection(conn, conf):
+    conn.execute("PRAGMA busy_timeout = {}".format(conf.db_busy_timeout_ms))
+    conn.execute("PRAGMA cache_size = {}".format(-conf.db_cache_size_kib))
+    conn.execute("PRAGMA mmap_size = {}".format(conf.db_mmap_size_mib * 1024 * 1024))
+
+
+class ResultStore:
+    """
+    Inserts typed rows as returned by TopotestResult.to_row() into a version 2
+    results table. The ids of dimension values are cached, new values are
+    inserted into the dimension tables within the current transaction, and so
+    are the updates of the per test and plan aggregates, unless stats is False.
+
+    With duplicates set to ignore or replace, a row with the plan, build, job
+    and test of a stored row is dropped or replaces the stored row. A bloom
+    filter seeded with the keys of the stored rows answers most checks, only
+    keys it reports as possibly stored are looked up in the unique key index.
+    """
+
+    def __init__(self, conn, table, stats=True, duplicates=None, filter_capacity=0):
+        self.conn = conn
+        self.table = table
+        self.stats = stats
+        self.duplicates = duplicates
+        self.filter_capacity = filter_capacity
+        self.filter = None
+        # set once staged rows of uploads of a previous server run are removed
+        self.staging_purged = False
+        self.cache = {}
+        for dim in TOPOSTAT_DB_DIMENSIONS:
+            self.cache[dim] = {}
+        self.insert_sql = (
+            "INSERT INTO {} (".format(table)
+            + "test_id, result, duration, host_id, timestamp, plan_id, build, job_id"
+            + ") VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+        )
+        self.insert_id_sql = (
+            "INSERT INTO {} (".format(table)
+            + "id, test_id, result, duration, host_id, timestamp, plan_id, build"
+            + ", job_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        )
+        self.stats_sql = (
+            "INSERT INTO {}_stats (".format(table)
+            + "test_id, plan_id, {}".format(", ".join(TOPOSTAT_RESULTS))
+            + ", total_duration, mean_duration, last_result, last_build"
+            + ", last_failure_build) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            + " ON CONFLICT (test_id, plan_id) DO UPDATE SET "
+            + "".join(
+                "{0} = {0} + excluded.{0}, ".format(val) for val in TOPOSTAT_RESULTS
+            )
+            + "total_duration = total_duration + excluded.total_duration"
+            + ", mean_duration = (total_duration + excluded.total_duration) / ("
+            + " + ".join(TOPOSTAT_RESULTS)
+            + " + "
+            + " + ".join("excluded." + val for val in TOPOSTAT_RESULTS)
+            + "), last_result = excluded.last_result"
+            + ", last_build = excluded.last_build"
+            + ", last_failure_build = "
+            + "coalesce(excluded.last_failure_build, last_failure_build)"
+        )
+        self.key_sql = (
+            "SELECT id, result, duration FROM {}".format(table)
+            + " WHERE plan_id = ? AND build = ? AND job_id = ? AND test_id = ?"
+        )
+        self.delete_sql = "DELETE FROM {} WHERE id = ?".format(table)
+        self.failure_sql = (
+            "UPDATE {}_stats SET last_failure_build = (".format(table)
+            + "SELECT build FROM {} r".format(table)
+            + " WHERE r.test_id = ? AND r.plan_id = ?"
+            + " AND r.result = {}".format(TOPOSTAT_RESULTS.index("failed"))
+            + " ORDER BY r.id DESC LIMIT 1"
+            + ") WHERE test_id = ? AND plan_id = ?"
+        )
+        if duplicates is not None:
+            self.seed_filter()
+
+    # bloom filter key of plan, build, job and test ids
+    def filter_key(self, key):
+        return "{}:{}:{}:{}".format(*key).encode()
+
+    # fill a new bloom filter with the keys of all stored rows, it is sized for
+    # at least twice the number of stored rows
+    def seed_filter(self):
+        count = self.conn.execute("SELECT count(*) FROM {}".format(self.table))
+        self.filter = BloomFilter(max(self.filter_capacity, 2 * count.fetchone()[0]))
+        for key in self.conn.execute(
+            "SELECT plan_id, build, job_id, test_id FROM {}".format(self.table)
+        ):
+            self.filter.add(self.filter_key(key))
+
+    # drop duplicate rows, returns the rows to insert, the stored rows they
+    # replace as (id, test_id, result, duration, plan_id) and the number of
+    # duplicates, of rows sharing a key within the batch the first is kept when
+    # ignoring and the last when replacing duplicates
+    def deduplicate(self, rows):
+        batch = {}
+        for row in rows:
+            key = (row[5], row[6], row[7], row[0])
+            if self.duplicates == "replace" or not key in batch:
+                batch[key] = row
+        duplicates = len(rows) - len(batch)
+        rows = []
+        replaced = []
+        for key, row in batch.items():
+            if self.filter_key(key) in self.filter:
+                stored = self.conn.execute(self.key_sql, key).fetchone()
+                if stored is not None:
+                    duplicates += 1
+                    if self.duplicates == "ignore":
+                        continue
+                    replaced.append((stored[0], row[0], stored[1], stored[2], row[5]))
+            rows.append(row)
+        return rows, replaced, duplicates
+
+    # get the id of a dimension value, insert the value if it is unknown
+    def dimension_id(self, dim, name):
+        cache = self.cache[dim]
+        try:
+            return cache[name]
+        except KeyError:
+            pass
+        row = self.conn.execute(
+            "SELECT id FROM {}_{} WHERE name = ?".format(self.table, dim), (name,)
+        ).fetchone()
+        if row is None:
+            dim_id = self.conn.execute(
+                "INSERT INTO {}_{} (name) VALUES (?)".format(self.table, dim), (name,)
+            ).lastrowid
+        else:
+            dim_id = row[0]
+        cache[name] = dim_id
+        return dim_id
+
+    # replace the dimension values of a typed row by their ids
+    def normalize(self, row):
+        name, result, duration, host, timestamp, plan, build, job = row
+        return (
+            self.dimension_id("tests", name),
+            result,
+            duration,
+            self.dimension_id("hosts", host),
+            timestamp,
+            self.dimension_id("plans", plan),
+            build,
+            self.dimension_id("jobs", job),
+        )
+
+    # insert a list of typed rows, committing the transaction is left to the
+    # caller, returns the number of ignored or replaced duplicates
+    def insert_many(self, rows):
+        rows = [self.normalize(row) for row in rows]
+        if self.duplicates is None:
+            self.conn.executemany(self.insert_sql, rows)
+            if self.stats:
+                self.update_stats(rows)
+            return 0
+
+        # replaced rows are deleted, their replacements are the newest rows
+        rows, replaced, duplicates = self.deduplicate(rows)
+        self.conn.executemany(self.delete_sql, [row[:1] for row in replaced])
+        self.conn.executemany(self.insert_sql, rows)
+        if self.stats:
+            self.update_stats(rows, replaced)
+        for row in rows:
+            self.filter.add(self.filter_key((row[5], row[6], row[7], row[0])))
+        if self.filter.count > self.filter.capacity:
+            self.seed_filter()
+        return duplicates
+
+    # insert a list of (id, typed row) tuples keeping the given ids
+    def insert_many_with_ids(self, rows):
+        rows = [(row_id,) + self.normalize(row) for row_id, row in rows]
+        self.conn.executemany(self.insert_id_sql, rows)
+        if self.stats:
+            self.update_stats([row[1:] for row in rows])
+
+    # add normalized rows to the per test and plan aggregates and subtract
+    # replaced rows, rows are combined per test and plan first so every
+    # aggregate is updated once, the last failed build of an aggregate losing a
+    # failed row is looked up again
+    def update_stats(self, rows, replaced=[]):
+        failed = TOPOSTAT_RESULTS.index("failed")
+        aggregates = {}
+        for test_id, result, duration, _, _, plan_id, build, _ in rows:
+            key = (test_id, plan_id)
+            agg = aggregates.get(key)
+            if agg is None:
+                agg = [0] * len(TOPOSTAT_RESULTS) + [0.0, None, None, None]
+                aggregates[key] = agg
+            agg[result] += 1
+            agg[-4] += duration
+            agg[-3] = result
+            agg[-2] = build
+            if result == failed:
+                agg[-1] = build
+        failures = []
+        for _, test_id, result, duration, plan_id in replaced:
+            agg = aggregates[(test_id, plan_id)]
+            agg[result] -= 1
+            agg[-4] -= duration
+            if result == failed:
+                failures.append((test_id, plan_id, test_id, plan_id))
+        stats = []
+        for (test_id, plan_id), agg in aggregates.items():
+            count = sum(agg[: len(TOPOSTAT_RESULTS)])
+            stats.append(
+                (test_id, plan_id)
+                + tuple(agg[: len(TOPOSTAT_RESULTS)])
+                + (agg[-4], agg[-4] / count if count else 0.0)
+                + (agg[-3], agg[-2], agg[-1])
+            )
+        self.conn.executemany(self.stats_sql, stats)
+        self.conn.executemany(self.failure_sql, failures)
+
+    # stage the typed rows of a chunk, replacing a previously received copy
+    def stage(self, upload_id, chunk, rows):
+        self.conn.execute(
+            "DELETE FROM {}_staging WHERE upload_id = ? AND chunk = ?".format(
+                self.table
+            ),
+            (upload_id, chunk),
+        )
+        self.conn.executemany(
+            "INSERT INTO {}_staging (".format(self.table)
+            + "upload_id, chunk, name, result, duration, host, timestamp, plan"
+            + ", build, job) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(upload_id, chunk) + tuple(row) for row in rows],
+        )
+
+    # typed rows of the staged chunks of an upload, one list per chunk
+    def staged(self, upload_id):
+        chunks = self.conn.execute(
+            "SELECT DISTINCT chunk FROM {}_staging WHERE upload_id = ?".format(
+                self.table
+            )
+            + " ORDER BY chunk",
+            (upload_id,),
+        ).fetchall()
+        for (chunk,) in chunks:
+            yield self.conn.execute(
+                "SELECT name, result, duration, host, timestamp, plan, build, job"
+                + " FROM {}_staging WHERE upload_id = ? AND chunk = ?".format(
+                    self.table
+                )
+                + " ORDER BY rowid",
+                (upload_id, chunk),
+            ).fetchall()
+
+    def discard_staged(self, upload_id):
+        self.conn.execute(
+            "DELETE FROM {}_staging WHERE upload_id = ?".format(self.table),
+            (upload_id,),
+        )
+
+    # remove the staged rows of all uploads but the given ones, returns the
+    # number of removed uploads
+    def purge_staged(self, keep):
+        uploads = self.conn.execute(
+            "SELECT DISTINCT upload_id FROM {}_staging".format(self.table)
+        ).fetchall()
+        purged = 0
+        for (upload_id,) in uploads:
+            if not upload_id in keep:
+                self.discard_staged(upload_id)
+                purged += 1
+        return purged
+
+    # check if an upload id is stored
+    def upload_exists(self, upload_id):
+        row = self.conn.execute(
+            "SELECT 1 FROM {}_uploads WHERE upload_id = ?".format(self.table),
+            (upload_id,),
+        ).fetchone()
+        return row is not None
+
+    # store an upload id with the number of its results
+    def add_upload(self, upload_id, results):
+        self.conn.execute(
+            "INSERT INTO {}_uploads (upload_id, received, results)".format(self.table)
+            + " VALUES (?, ?, ?)",
+            (upload_id, int(time.time()), results),
+        )
+
+    # cached ids of dimension values inserted in a rolled back transaction are
+    # invalid, forget all of them
+    def rollback(self):
+        self.conn.rollback()
+        for dim in TOPOSTAT_DB_DIMENSIONS:
+            self.cache[dim] = {}
+
+
+class DatabaseWriter:
+    """
+    Single database writer thread. Validated rows of received messages are
+    passed in through a bounded queue, and rows of several messages are group
+    committed in one transaction. A full queue blocks the receiving thread,
+    which in turn lets the ZeroMQ socket buffers apply backpressure. With a
+    PartitionSet the rows are written to the partitions of their timestamps,
+    one transaction per partition, and conn is not used. Chunks of chunked
+    uploads are staged in the <table>_staging table and moved to the results
+    table in the transaction of the final chunk. Acknowledged messages are
+    replied to through the AckQueue acks once all their rows are committed.
+    Stored results and commit latencies are counted in the ServerMetrics
+    metrics, insert and commit durations are added to the StageTimers timers.
+    """
+
+    def __init__(
+        self, conn, conf, log, partitions=None, acks=None, metrics=None, timers=None
+    ):
+        self.conn = conn
+        self.conf = conf
+        self.log = log
+        self.partitions = partitions
+        self.acks = acks
+        self.metrics = metrics
+        self.timers = timers
+        self.store = None
+        if partitions is None:
+            self.store = ResultStore(
+                conn,
+                conf.results_table,
+                duplicates=conf.db_duplicates,
+                filter_capacity=conf.db_dedup_filter_capacity,
+            )
+        # state of chunked uploads by upload id
+        self.uploads = {}
+        self.buffer = Queue(maxsize=conf.db_queue_size)
+        self.worker = threading.Thread(target=self.worker_thread)
+
+    def worker_thread(self):
+        stop = False
+        while not stop:
+            item = self.buffer.get()
+            if item is None:
+                self.buffer.task_done()
+                break
+            items = [item]
+            rows = len(item[1])
+
+            # gather further messages until the batch size is reached or the
+            # flush interval expired
+            deadline = time.monotonic() + self.conf.db_flush_interval_ms / 1000
+            while rows < self.conf.db_batch_size:
+                try:
+                    timeout = deadline - time.monotonic()
+                    if timeout > 0:
+                        item = self.buffer.get(timeout=timeout)
+                    else:
+                        item = self.buffer.get_nowait()
+                except Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                items.append(item)
+                rows += len(item[1])
+
+            self.write(items)
+            for item in items:
+                self.buffer.task_done()
+            if stop:
+                self.buffer.task_done()
+
+    # split the rows of a message by partition, all rows belong to the key
+    # None of an unpartitioned database
+    def route(self, rows):
+        if self.partitions is None:
+            return {None: rows} if rows else {}
+        return self.partitions.route(rows)
+
+    # write the rows of the messages to the results table or, if the database
+    # is partitioned, to the partitions of their timestamps, chunks of chunked
+    # uploads are staged and stored once the final chunk arrived, replies to
+    # acknowledged messages are sent once all partitions are written
+    def write(self, items):
+        now = time.monotonic()
+        parts = {}
+        done = []
+        for kind, rows, agent, upload, ack in items:
+            # chunks resent after their upload was completed are ignored
+            if kind == "chunk" and upload[0] in done:
+                continue
+            keys = self.route(rows)
+            for key, part_rows in keys.items():
+                parts.setdefault(key, []).append([kind, part_rows, agent, upload, ack])
+            if kind != "chunk":
+                continue
+
+            # track the received chunks of an upload and the partitions they
+            # were staged in, complete uploads are committed in every partition
+            upload_id, chunk, chunks = upload
+            state = self.uploads.get(upload_id)
+            if state is None:
+                state = {"chunks": set(), "total": 0, "keys": set(), "failed": False}
+                self.uploads[upload_id] = state
+            state["chunks"].add(chunk)
+            state["keys"].update(keys)
+            state["updated"] = now
+            if chunks > 0:
+                state["total"] = chunks
+            if state["total"] > 0 and len(state["chunks"]) >= state["total"]:
+                for key in state["keys"]:
+                    parts.setdefault(key, []).append(
+                        ["commit", [], agent, [upload_id, 0, state["total"]], ack]
+                    )
+                done.append(upload_id)
+            elif chunks > 0 and ack is not None:
+                # an acknowledged chunk is only sent once the previous one is
+                # confirmed, chunks missing at the final chunk were lost by a
+                # server restart or expired and the client sends them again
+                for key in state["keys"]:
+                    parts.setdefault(key, []).append(
+                        ["discard", [], None, [upload_id, 0, 0], None]
+                    )
+                done.append(upload_id)
+                self.fail_ack(ack, TOPOSTAT_ACK_INCOMPLETE)
+                self.log.warn(
+                    "discarded incomplete upload {} from agent {} with {} of {} chunks".format(
+                        upload_id, agent, len(state["chunks"]), chunks
+                    )
+                )
+
+        # discard uploads without a chunk for db_staging_timeout_s
+        for upload_id, state in self.uploads.items():
+            if upload_id in done:
+                continue
+            if now - state["updated"] > self.conf.db_staging_timeout_s:
+                for key in state["keys"]:
+                    parts.setdefault(key, []).append(
+                        ["discard", [], None, [upload_id, 0, 0], None]
+                    )
+                done.append(upload_id)
+                self.log.warn(
+                    "discarded incomplete upload {} after {} chunks".format(
+                        upload_id, len(state["chunks"])
+                    )
+                )
+
+        for key, part_items in parts.items():
+            if key is None:
+                self.write_store(self.store, part_items, self.conf.sqlite3_db)
+                continue
+            if self.partitions.expired(key):
+                # results of expired partitions are not stored but confirmed
+                self.log.warn(
+                    "discarded {} results of expired partition {}".format(
+                        sum(len(item[1]) for item in part_items), key
+                    )
+                )
+                for item in part_items:
+                    if item[0] in ["rows", "commit"] and item[4] is not None:
+                        item[4][1]["committed"] = True
+                continue
+            try:
+                store = self.partitions.store(key)
+            except:
+                self.log.err(
+                    "failed to open partition {} of database {}".format(
+                        key, self.conf.sqlite3_db
+                    )
+                )
+                for item in part_items:
+                    self.fail_ack(item[4], "failed to open partition")
+                continue
+            self.write_store(
+                store, part_items, "{} partition {}".format(self.conf.sqlite3_db, key)
+            )
+        for upload_id in done:
+            del self.uploads[upload_id]
+        for item in items:
+            if item[4] is not None:
+                self.ack(*item[4])
+
+    # insert the rows of all messages in a single transaction, if this fails
+    # retry message by message to not lose the rows of valid messages, the
+    # counts of acknowledged messages are added once committed
+    def write_store(self, store, items, db):
+        counts = []
+        start = time.perf_counter()
+        try:
+            # staged rows of a previous server run are never completed
+            if not store.staging_purged:
+                purged = store.purge_staged(self.uploads)
+                store.staging_purged = True
+                if purged > 0:
+                    self.log.info(
+                        "discarded {} incomplete uploads in database {}".format(
+                            purged, db
+                        )
+                    )
+            for item in items:
+                counts.append(self.insert(store, item))
+            inserted = time.perf_counter()
+            store.conn.commit()
+            if self.timers is not None:
+                self.timers.add("insert", inserted - start)
+                self.timers.add("commit", time.perf_counter() - inserted)
+            if self.metrics is not None:
+                self.metrics.commit_seconds.observe(time.perf_counter() - start)
+                for count in counts:
+                    self.metrics.stored.inc(count.get("stored", 0))
+                    self.metrics.duplicates.inc(count.get("duplicates", 0))
+            for item, count in zip(items, counts):
+                if item[4] is not None:
+                    reply = item[4][1]
+                    for var, val in count.items():
+                        if var in ["stored", "duplicates", "staged"]:
+                            reply[var] += val
+                        else:
+                            reply[var] = val
+            self.log.debug(
+                "committed {} messages to table {}".format(
+                    len(items), self.conf.results_table
+                )
+            )
+            return
+        except:
+            store.rollback()
+            store.staging_purged = False
+        if len(items) > 1:
+            for item in items:
+                self.write_store(store, [item], db)
+            return
+        # a chunked upload missing a chunk is discarded once complete
+        kind, rows, agent, upload, ack = items[0]
+        if kind == "chunk" and upload[0] in self.uploads:
+            self.uploads[upload[0]]["failed"] = True
+        self.fail_ack(ack, "failed to insert results")
+        self.log.err(
+            "failed to insert {} results from agent {} into table {} in database {}".format(
+                len(rows),
+                agent,
+                self.conf.results_table,
+                db,
+            )
+        )
+
+    # insert rows of a message in batches of at most conf.db_batch_size rows,
+    # a message with the upload id of a stored upload is ignored, returns the
+    # counts and status updates of the reply to the message
+    def insert(self, store, item):
+        kind, rows, agent, upload, ack = item
+        upload_id = upload[0]
+        if kind == "chunk":
+            store.stage(upload_id, upload[1], rows)
+            return {"staged": len(rows)}
+        if kind == "discard":
+            store.discard_staged(upload_id)
+            return {}
+        if upload_id and store.upload_exists(upload_id):
+            self.log.info(
+                "ignored duplicate upload {} from agent {}".format(upload_id, agent)
+            )
+            if kind == "commit":
+                store.discard_staged(upload_id)
+            return {"duplicate": True, "committed": True}
+
+        # rows of a complete chunked upload are read back chunk by chunk
+        if kind == "commit":
+            if self.uploads[upload_id]["failed"]:
+                store.discard_staged(upload_id)
+                self.log.err(
+                    "discarded upload {} from agent {} with a failed chunk".format(
+                        upload_id, agent
+                    )
+                )
+                return {"status": "error", "error": "failed to stage a chunk"}
+            chunks = store.staged(upload_id)
+        else:
+            chunks = [rows]
+        results = 0
+        duplicates = 0
+        for rows in chunks:
+            results += len(rows)
+            for i in range(0, len(rows), self.conf.db_batch_size):
+                duplicates += store.insert_many(rows[i : i + self.conf.db_batch_size])
+        if kind == "commit":
+            store.discard_staged(upload_id)
+            self.log.info(
+                "stored upload {} of {} chunks with {} results from agent {}".format(
+                    upload_id, upload[2], results, agent
+                )
+            )
+        if upload_id:
+            store.add_upload(upload_id, results)
+        if duplicates > 0:
+            self.log.info(
+                "{} {} duplicate results from agent {}".format(
+                    "replaced" if self.conf.db_duplicates == "replace" else "ignored",
+                    duplicates,
+                    agent,
+                )
+            )
+        # replaced duplicates are stored, ignored duplicates are not
+        if self.conf.db_duplicates == "replace":
+            return {"stored": results, "duplicates": duplicates, "committed": True}
+        return {
+            "stored": results - duplicates,
+            "duplicates": duplicates,
+            "committed": True,
+        }
+
+    def start(self):
+        self.worker.start()
+
+    # write all queued rows and stop the writer thread
+    def stop(self):
+        self.buffer.put(None)
+        self.worker.join()
+
+    # queue the valid rows of a message, or of a chunk of a chunked upload,
+    # blocks while the queue is full, the client of route is replied to once
+    # the rows are committed
+    def put(self, rows, agent, upload, route=None):
+        ack = None
+        if route is not None and self.acks is not None:
+            ack = [route, ack_reply(upload)]
+        if upload[1] == 0 and upload[2] == 1:
+            self.buffer.put(["rows", rows, agent, upload, ack])
+        else:
+            self.buffer.put(["chunk", rows, agent, upload, ack])
+
+    # queue an empty message to discard uploads without a chunk for
+    # db_staging_timeout_s while no messages arrive, a full queue is written
+    # anyway
+    def expire_uploads(self):
+        try:
+            self.buffer.put_nowait(["expire", [], None, None, None])
+        except Full:
+            pass
+
+    # reply to the client of route, messages without route were not sent to an
+    # acknowledgement socket
+    def ack(self, route, reply):
+        if route is not None and self.acks is not None:
+            self.acks.put(route, reply)
+
+    def fail_ack(self, ack, err):
+        if ack is not None:
+            ack[1]["status"] = "error"
+            ack[1]["error"] = err
+
+
+class DatabaseCheckpointer:
+    """
+    Background thread checkpointing the write-ahead log every
+    db_checkpoint_interval_ms on its own connection, the writer connection runs
+    without automatic checkpoints and never stalls copying the log back into
+    the database. Passive checkpoints do not wait for readers or the writer,
+    the final checkpoint on stop truncates the log file.
+    """
+
+    def __init__(self, conf, log):
+        self.conf = conf
+        self.log = log
+        self.conn = None
+        self.last = None
+        self.stopped = threading.Event()
+        self.worker = threading.Thread(target=self.worker_thread)
+
+    def checkpoint(self, mode):
+        busy, frames, checkpointed = self.conn.execute(
+            "PRAGMA wal_checkpoint({})".format(mode)
+        ).fetchone()
+        # the log keeps its frames until the writer restarts it, only log
+        # checkpoints that made progress
+        if [frames, checkpointed] == self.last:
+            return
+        self.last = [frames, checkpointed]
+        self.log.debug(
+            "checkpointed {} of {} wal frames of database {}{}".format(
+                checkpointed,
+                frames,
+                self.conf.sqlite3_db,
+                " (busy)" if busy else "",
+            )
+        )
+
+    def worker_thread(self):
+        while not self.stopped.wait(self.conf.db_checkpoint_interval_ms / 1000):
+            try:
+                self.checkpoint("PASSIVE")
+            except:
+                self.log.err(
+                    "failed to checkpoint database {}".format(self.conf.sqlite3_db)
+                )
+
+    def start(self):
+        self.conn = sqlite3.connect(self.conf.sqlite3_db, check_same_thread=False)
+        configure_connection(self.conn, self.conf)
+        self.worker.start()
+
+    # stop the checkpoint thread and checkpoint the complete log, call after
+    # the database writer is stopped
+    def stop(self):
+        self.stopped.set()
+        self.worker.join()
+        try:
+            self.checkpoint("TRUNCATE")
+        except:
+            self.log.err(
+                "failed to checkpoint database {}".format(self.conf.sqlite3_db)
+            )
+        self.conn.close()
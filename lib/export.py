@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Columnar Export
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import io
+import os
+import shutil
+import zipfile
+import tempfile
+
+from lib.topostat import TOPOSTAT_RESULTS
+
+
+# pyarrow writes parquet and arrow ipc files, numpy the npz fallback, both are
+# optional
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# export file formats and the file extensions selecting them
+EXPORT_FORMATS = ["parquet", "arrow", "npz"]
+EXPORT_EXTENSIONS = {".parquet": "parquet", ".arrow": "arrow", ".npz": "npz"}
+
+# exported columns in file order
+EXPORT_COLUMNS = [
+    "id",
+    "name",
+    "result",
+    "time",
+    "host",
+    "timestamp",
+    "plan",
+    "build",
+    "job",
+]
+
+# dictionary encoded columns and the dimension tables holding their values
+EXPORT_DIMENSIONS = {"name": "tests", "host": "hosts", "plan": "plans", "job": "jobs"}
+
+
+# check if the optional dependency of a format is installed
+def export_format_available(fmt):
+    if fmt == "npz":
+        return numpy is not None
+    return pyarrow is not None
+
+
+# format selected by the file extension of path, or the best available format
+def default_export_format(path):
+    fmt = EXPORT_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if fmt is not None:
+        return fmt
+    for fmt in EXPORT_FORMATS:
+        if export_format_available(fmt):
+            return fmt
+    return None
+
+
+# read the dimension tables of all databases and merge them into one sorted
+# dictionary per column, returns the dictionaries and per database a mapping of
+# dimension ids to dictionary codes
+def read_dictionaries(conns, table):
+    names = {}
+    for col, dim in EXPORT_DIMENSIONS.items():
+        names[col] = []
+        for conn in conns:
+            names[col].append(
+                conn.execute("SELECT id, name FROM {}_{}".format(table, dim)).fetchall()
+            )
+
+    dictionaries = {"result": list(TOPOSTAT_RESULTS)}
+    codes = [{} for conn in conns]
+    for col in EXPORT_DIMENSIONS:
+        dictionary = sorted(set(name for rows in names[col] for _, name in rows))
+        code = {name: i for i, name in enumerate(dictionary)}
+        dictionaries[col] = dictionary
+        for i, rows in enumerate(names[col]):
+            codes[i][col] = {dim_id: code[name] for dim_id, name in rows}
+    return dictionaries, codes
+
+
+# number of the rows last_id < id <= max_id with a build that is not an
+# integer, stored before the server validated builds, they are not exported
+def count_text_builds(conn, table, last_id, max_id):
+    return conn.execute(
+        "SELECT count(*) FROM {}".format(table)
+        + " WHERE id > ? AND id <= ? AND typeof(build) != 'integer'",
+        (last_id, max_id),
+    ).fetchone()[0]
+
+
+# read the rows last_id < id <= max_id with an integer build in chunks of
+# chunk_size rows, yields the columns of a chunk as lists with dictionary codes
+# in place of dimension ids
+def read_chunks(conn, table, codes, last_id, max_id, chunk_size):
+    name_codes = codes["name"]
+    host_codes = codes["host"]
+    plan_codes = codes["plan"]
+    job_codes = codes["job"]
+    while last_id < max_id:
+        rows = conn.execute(
+            "SELECT id, test_id, result, duration, host_id, timestamp, plan_id"
+            + ", build, job_id FROM {}".format(table)
+            + " WHERE id > ? AND id <= ? AND typeof(build) = 'integer'"
+            + " ORDER BY id LIMIT ?",
+            (last_id, max_id, chunk_size),
+        ).fetchall()
+        if not rows:
+            break
+        ids, tests, results, durations, hosts, timestamps, plans, builds, jobs = zip(
+            *rows
+        )
+        last_id = ids[-1]
+        yield {
+            "id": ids,
+            "name": [name_codes[i] for i in tests],
+            "result": results,
+            "time": durations,
+            "host": [host_codes[i] for i in hosts],
+            "timestamp": timestamps,
+            "plan": [plan_codes[i] for i in plans],
+            "build": builds,
+            "job": [job_codes[i] for i in jobs],
+        }
+
+
+class ArrowExport:
+    """
+    Writes chunks as record batches to an arrow ipc file, or as row groups to a
+    parquet file. String columns are dictionary encoded with dictionaries
+    shared by all batches, durations are float64 and timestamps UTC seconds.
+    """
+
+    def __init__(self, path, fmt, dictionaries):
+        self.dictionaries = {}
+        fields = []
+        for col in EXPORT_COLUMNS:
+            if col in dictionaries:
+                index_type = pyarrow.int8() if col == "result" else pyarrow.int32()
+                self.dictionaries[col] = pyarrow.array(
+                    dictionaries[col], pyarrow.string()
+                )
+                col_type = pyarrow.dictionary(index_type, pyarrow.string())
+            elif col == "time":
+                col_type = pyarrow.float64()
+            elif col == "timestamp":
+                col_type = pyarrow.timestamp("s", tz="UTC")
+            else:
+                col_type = pyarrow.int64()
+            fields.append(pyarrow.field(col, col_type, nullable=False))
+        self.schema = pyarrow.schema(fields)
+        self.fmt = fmt
+        if fmt == "parquet":
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        else:
+            self.sink = pyarrow.OSFile(path, "wb")
+            self.writer = pyarrow.ipc.new_file(self.sink, self.schema)
+
+    def write(self, columns):
+        arrays = []
+        for field in self.schema:
+            if field.name in self.dictionaries:
+                arrays.append(
+                    pyarrow.DictionaryArray.from_arrays(
+                        pyarrow.array(columns[field.name], field.type.index_type),
+                        self.dictionaries[field.name],
+                    )
+                )
+            else:
+                arrays.append(pyarrow.array(columns[field.name], field.type))
+        batch = pyarrow.record_batch(arrays, schema=self.schema)
+        if self.fmt == "parquet":
+            self.writer.write_table(pyarrow.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+
+    def close(self):
+        self.writer.close()
+        if self.fmt != "parquet":
+            self.sink.close()
+
+
+class NpzExport:
+    """
+    Streams chunks as typed numpy arrays into a compressed npz file. The values
+    of every column are appended to a temporary file as they are written and
+    copied into the npz file on close, so only one chunk is held in memory.
+    Dictionary encoded columns are stored as integer codes, and their values
+    as <column>_dictionary. Timestamps are datetime64[s] in UTC.
+    """
+
+    def __init__(self, path, dictionaries):
+        self.path = path
+        self.dictionaries = dictionaries
+        self.dtypes = {}
+        for col in EXPORT_COLUMNS:
+            if col == "result":
+                self.dtypes[col] = numpy.dtype("int8")
+            elif col in dictionaries:
+                self.dtypes[col] = numpy.dtype("int32")
+            elif col == "time":
+                self.dtypes[col] = numpy.dtype("float64")
+            elif col == "timestamp":
+                self.dtypes[col] = numpy.dtype("datetime64[s]")
+            else:
+                self.dtypes[col] = numpy.dtype("int64")
+        self.rows = 0
+        # column files next to the export file, on the same file system
+        self.files = {
+            col: tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path)))
+            for col in EXPORT_COLUMNS
+        }
+
+    def write(self, columns):
+        for col in EXPORT_COLUMNS:
+            self.files[col].write(numpy.array(columns[col], self.dtypes[col]).tobytes())
+        self.rows += len(columns["id"])
+
+    # write a column as the npy file of an array of the given length
+    def write_member(self, npz, col, dtype, length, data):
+        header = {
+            "descr": numpy.lib.format.dtype_to_descr(dtype),
+            "fortran_order": False,
+            "shape": (length,),
+        }
+        with npz.open(col + ".npy", "w", force_zip64=True) as f:
+            numpy.lib.format.write_array_header_2_0(f, header)
+            shutil.copyfileobj(data, f)
+
+    def close(self):
+        try:
+            with zipfile.ZipFile(
+                self.path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True
+            ) as npz:
+                for col in EXPORT_COLUMNS:
+                    self.files[col].seek(0)
+                    self.write_member(
+                        npz, col, self.dtypes[col], self.rows, self.files[col]
+                    )
+                    if col in self.dictionaries:
+                        dictionary = numpy.array(self.dictionaries[col], str)
+                        self.write_member(
+                            npz,
+                            col + "_dictionary",
+                            dictionary.dtype,
+                            len(dictionary),
+                            io.BytesIO(dictionary.tobytes()),
+                        )
+        finally:
+            for f in self.files.values():
+                f.close()
+
+
+# open an export file writer for a format
+def open_export(path, fmt, dictionaries):
+    if fmt == "npz":
+        return NpzExport(path, dictionaries)
+    return ArrowExport(path, fmt, dictionaries)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Message Ingest
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import time
+import signal
+import threading
+import multiprocessing
+
+from lib.topostat import (
+    Message,
+    MessageEncodingError,
+    TopotestRun,
+)
+from lib.timing import StageTimes
+from lib.validate import validate_result_list, validate_run_columns
+
+
+# ingest status values
+INGEST_OK = "ok"
+INGEST_PARSE_FAILED = "parse"
+INGEST_ENCODING_UNSUPPORTED = "encoding"
+INGEST_AUTH_FAILED = "auth"
+INGEST_NO_LIST = "nolist"
+INGEST_INVALID_RUN = "run"
+INGEST_EMPTY = "empty"
+
+
+# authentication key of a worker process and if its stages are timed, set by
+# init_worker()
+worker_auth_key = None
+worker_stage_timers = False
+
+
+# decode, authenticate and validate the frames of a received ZeroMQ message,
+# returns a list of [status, rows, results_total, results_valid,
+# results_invalid, agent, upload, rejected], upload is [upload_id, chunk,
+# chunks] as sent by the client, rejected the number of invalid results by
+# reason, the durations of the stages are added to timers if given
+def ingest_message(frames, auth_key, timers=None):
+    msg = Message()
+    start = time.perf_counter()
+    try:
+        msg.from_frames(frames)
+        decoded = time.perf_counter()
+        if not msg.check_auth(auth_key):
+            return [INGEST_AUTH_FAILED, None, 0, 0, 0, None, None, None]
+    except MessageEncodingError:
+        return [INGEST_ENCODING_UNSUPPORTED, None, 0, 0, 0, None, None, None]
+    except:
+        return [INGEST_PARSE_FAILED, None, 0, 0, 0, None, None, None]
+    authenticated = time.perf_counter()
+    ingested = validate_results(msg.payload, [msg.upload_id, msg.chunk, msg.chunks])
+    if timers is not None:
+        timers.add("decode", decoded - start)
+        timers.add("auth", authenticated - decoded)
+        timers.add("validate", time.perf_counter() - authenticated)
+    return ingested
+
+
+# convert and validate received results, a list of results or a run, only
+# valid results are returned as database rows
+def validate_results(results, upload=None):
+    if upload is None:
+        upload = ["", 0, 1]
+
+    # version 2 clients send their results as a run
+    if isinstance(results, dict):
+        return validate_run(results, upload)
+
+    # check if received json payload is a list
+    if not isinstance(results, list):
+        return [INGEST_NO_LIST, None, 0, 0, 0, None, upload, None]
+
+    # check if received results list is empty
+    if not results:
+        return [INGEST_EMPTY, None, 0, 0, 0, None, upload, None]
+
+    # convert and validate all results in a single pass per field
+    rows, reasons = validate_result_list(results)
+    agent = rows[-1][3] if rows else None
+    return [
+        INGEST_OK,
+        rows,
+        len(results),
+        len(rows),
+        len(reasons),
+        agent,
+        upload,
+        count_reasons(reasons),
+    ]
+
+
+# convert and validate the results of a received run in a single pass over its
+# columns
+def validate_run(json_obj, upload):
+    run = TopotestRun().from_json(json_obj)
+    if run is None:
+        return [INGEST_INVALID_RUN, None, 0, 0, 0, None, upload, None]
+    if len(run) == 0:
+        return [INGEST_EMPTY, None, 0, 0, 0, None, upload, None]
+    rows, reasons = validate_run_columns(run)
+    return [
+        INGEST_OK,
+        rows,
+        len(run),
+        len(rows),
+        len(reasons),
+        run.host,
+        upload,
+        count_reasons(reasons),
+    ]
+
+
+# number of rejected results by reason
+def count_reasons(reasons):
+    counts = {}
+    for i, reason in reasons:
+        counts[reason] = counts.get(reason, 0) + 1
+    return counts
+
+
+# worker process initializer, termination signals are handled by the server
+# process which shuts down the pool after all pending messages are ingested
+def init_worker(auth_key, stage_timers):
+    global worker_auth_key, worker_stage_timers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    worker_auth_key = auth_key
+    worker_stage_timers = stage_timers
+
+
+# returns the ingested message and the durations of its stages, if timed
+def ingest_message_worker(frames):
+    if not worker_stage_timers:
+        return [ingest_message(frames, worker_auth_key), None]
+    times = StageTimes()
+    return [ingest_message(frames, worker_auth_key, times), times.stages]
+
+
+class IngestPool:
+    """
+    Pool of worker processes decoding, authenticating and validating received
+    messages. The ingested messages are passed to the callback function in the
+    order they finish. The number of messages in flight is bounded, submit()
+    blocks while all slots are taken.
+    """
+
+    def __init__(self, conf, callback, timers=None):
+        self.conf = conf
+        self.callback = callback
+        self.timers = timers
+        self.slots = threading.BoundedSemaphore(conf.ingest_workers * 4)
+        self.pool = None
+
+    def start(self):
+        # spawn workers instead of forking the threaded server process
+        self.pool = multiprocessing.get_context("spawn").Pool(
+            processes=self.conf.ingest_workers,
+            initializer=init_worker,
+            initargs=(self.conf.auth_key, self.timers is not None),
+        )
+
+    def done(self, result, route, size):
+        ingested, stages = result
+        try:
+            if stages is not None:
+                self.timers.merge(stages)
+            self.callback(ingested, route, size)
+        finally:
+            self.slots.release()
+
+    def failed(self, err, route, size):
+        self.slots.release()
+        self.callback(
+            [INGEST_PARSE_FAILED, None, 0, 0, 0, None, None, None], route, size
+        )
+
+    # route identifies the client of an acknowledged message and is passed on
+    # to the callback function with the size of the message in bytes
+    def submit(self, frames, route=None):
+        size = sum(len(frame) for frame in frames)
+        self.slots.acquire()
+        self.pool.apply_async(
+            ingest_message_worker,
+            (frames,),
+            callback=lambda ingested: self.done(ingested, route, size),
+            error_callback=lambda err: self.failed(err, route, size),
+        )
+
+    # wait for all pending messages and stop the worker processes
+    def stop(self):
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Junit XML Reader
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import os
+import glob
+import xml.etree.ElementTree as ET
+
+from lib.topostat import TopotestResult
+
+
+# results of the result elements of a test case, errors are invalid results
+JUNIT_RESULTS = {"failure": "failed", "skipped": "skipped", "error": None}
+
+
+class JunitError(Exception):
+    pass
+
+
+# duration of a test case as read by junitparser
+def junit_time(val):
+    return float(val.replace(",", "")) if val else None
+
+
+# read the results of a junit xml file one test case at a time, yields a
+# TopotestResult as TopotestResult.from_case() for every test case in the order
+# of junitparser: the test cases of a test suite followed by those of its
+# nested test suites. Every element is removed from the tree once it is read,
+# only the results of nested test suites are kept until their enclosing test
+# suite ends. Raises JunitError if the file can not be read.
+def read_junit(path, host, plan, build, job):
+    # stack of [element, suite], suite is a list of [top, cases, nested] for
+    # test suites whose test cases are read and None for other elements
+    stack = []
+    result = None
+    try:
+        for event, elem in ET.iterparse(path, events=("start", "end")):
+            if event == "start":
+                parent = stack[-1] if stack else None
+                suite = None
+                if elem.tag == "testsuite":
+                    if parent is None or (
+                        parent[0].tag == "testsuites" and len(stack) == 1
+                    ):
+                        suite = [True, [], []]
+                    elif parent[1] is not None:
+                        suite = [False, [], []]
+                elif parent is None and elem.tag != "testsuites":
+                    raise JunitError("invalid root element {}".format(elem.tag))
+                elif elem.tag == "testcase":
+                    result = "passed"
+                elif (
+                    elem.tag in JUNIT_RESULTS
+                    and result == "passed"
+                    and parent[0].tag == "testcase"
+                ):
+                    # the first result element decides as in junitparser
+                    result = JUNIT_RESULTS[elem.tag]
+                stack.append([elem, suite])
+                continue
+
+            elem, suite = stack.pop()
+            parent = stack[-1] if stack else None
+            if elem.tag == "testcase" and parent is not None and parent[1] is not None:
+                ttr = TopotestResult().from_testcase(
+                    elem.get("classname"),
+                    elem.get("name"),
+                    result,
+                    junit_time(elem.get("time")),
+                    host,
+                    plan,
+                    build,
+                    job,
+                )
+                if parent[1][0]:
+                    yield ttr
+                else:
+                    parent[1][1].append(ttr)
+            elif suite is not None:
+                if suite[0]:
+                    yield from suite[2]
+                elif parent is not None:
+                    parent[1][2] += suite[1] + suite[2]
+
+            # free the element, system-out and system-err text included
+            elem.clear()
+            if parent is not None:
+                parent[0].remove(elem)
+    except JunitError as err:
+        raise JunitError("{}: {}".format(path, err))
+    except (ET.ParseError, OSError, ValueError) as err:
+        raise JunitError("{}: {}".format(path, err))
+
+
+# valid results of read_junit(), skipped test cases are not reported, counts
+# is a list of the numbers of valid, skipped and invalid test cases updated as
+# the file is read
+def read_junit_valid(path, host, plan, build, job, counts):
+    for result in read_junit(path, host, plan, build, job):
+        if result is None or not result.check():
+            counts[2] += 1
+            continue
+        if result.skipped():
+            counts[1] += 1
+            continue
+        counts[0] += 1
+        yield result
+
+
+# read a junit xml file in a worker process, returns the counts of
+# read_junit_valid() and the valid results as tuples of name, result, time and
+# timestamp, host, plan, build and job are the same for all results
+def read_junit_file(path, host, plan, build, job):
+    counts = [0, 0, 0]
+    results = [
+        (result.name, result.result, result.time, result.timestamp)
+        for result in read_junit_valid(path, host, plan, build, job, counts)
+    ]
+    return [counts, results]
+
+
+# junit xml files of a list of files, globs and directories in the order given,
+# globs are expanded in sorted order and match in subdirectories with **, the
+# xml files of a directory are read in sorted order, raises JunitError if a
+# glob or directory has no junit xml files
+def junit_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = sorted(glob.glob(os.path.join(glob.escape(path), "*.xml")))
+        elif glob.has_magic(path):
+            matches = sorted(glob.glob(path, recursive=True))
+        else:
+            matches = [path]
+        if not matches:
+            raise JunitError("no junit xml files in {}".format(path))
+        for match in matches:
+            if not match in files:
+                files.append(match)
+    return files
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Metrics
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# upper bounds of the database commit latency histogram buckets in seconds
+TOPOSTAT_METRICS_LATENCY_BUCKETS = [
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+]
+
+
+# escape a label value of the prometheus text format
+def escape_label(val):
+    return str(val).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# format a sample value of the prometheus text format
+def format_value(val):
+    if isinstance(val, float):
+        return repr(val)
+    return str(val)
+
+
+class Counter:
+    """
+    Monotonic counter with an optional label. Every counter is updated by a
+    single thread, an update is a dictionary lookup and an addition without
+    locking, the metrics thread reads a copy of the values.
+    """
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}
+
+    def inc(self, value=1, label=None):
+        self.values[label] = self.values.get(label, 0) + value
+
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.help),
+            "# TYPE {} counter".format(self.name),
+        ]
+        values = self.values.copy()
+        if self.label is None:
+            lines.append("{} {}".format(self.name, format_value(values.get(None, 0))))
+            return lines
+        for label, value in sorted(values.items(), key=lambda item: str(item[0])):
+            lines.append(
+                '{}{{{}="{}"}} {}'.format(
+                    self.name, self.label, escape_label(label), format_value(value)
+                )
+            )
+        return lines
+
+
+class Histogram:
+    """
+    Histogram of observed values with fixed bucket upper bounds, updated by a
+    single thread like Counter.
+    """
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.help),
+            "# TYPE {} histogram".format(self.name),
+        ]
+        counts = list(self.counts)
+        total = 0
+        for bound, count in zip(self.buckets + ["+Inf"], counts):
+            total += count
+            lines.append('{}_bucket{{le="{}"}} {}'.format(self.name, bound, total))
+        lines.append("{}_sum {}".format(self.name, repr(self.sum)))
+        lines.append("{}_count {}".format(self.name, total))
+        return lines
+
+
+class Gauge:
+    """
+    Gauge read by calling func when the metrics are rendered.
+    """
+
+    def __init__(self, name, help, func):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def render(self):
+        try:
+            value = self.func()
+        except:
+            return []
+        return [
+            "# HELP {} {}".format(self.name, self.help),
+            "# TYPE {} gauge".format(self.name),
+            "{} {}".format(self.name, format_value(value)),
+        ]
+
+
+class Metrics:
+    """
+    Registry of the metrics of a process, rendered in the prometheus text
+    exposition format.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, label=None):
+        metric = Counter(name, help, label)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, buckets):
+        metric = Histogram(name, help, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, func):
+        metric = Gauge(name, help, func)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+class ServerMetrics(Metrics):
+    """
+    Metrics of the server. Received messages and results are counted by the
+    thread processing ingested messages, stored results and commit latencies by
+    the database writer thread.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.messages = self.counter(
+            "topostat_messages_total", "received messages by ingest status", "status"
+        )
+        self.results = self.counter(
+            "topostat_results_total",
+            "received results by validity, valid or invalid",
+            "validity",
+        )
+        self.agent_bytes = self.counter(
+            "topostat_agent_received_bytes_total",
+            "received message bytes by agent",
+            "agent",
+        )
+        self.stored = self.counter(
+            "topostat_results_stored_total", "results committed to the database"
+        )
+        self.duplicates = self.counter(
+            "topostat_results_duplicate_total",
+            "duplicate results ignored or replaced",
+        )
+        self.commit_seconds = self.histogram(
+            "topostat_db_commit_seconds",
+            "time to insert and commit a batch of messages",
+            TOPOSTAT_METRICS_LATENCY_BUCKETS,
+        )
+
+    # gauges of the database writer queue and staged uploads
+    def watch_writer(self, writer):
+        self.gauge(
+            "topostat_db_queue_messages",
+            "messages waiting in the database writer queue",
+            writer.buffer.qsize,
+        )
+        self.gauge(
+            "topostat_uploads_incomplete",
+            "chunked uploads waiting for chunks",
+            lambda: len(writer.uploads),
+        )
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # requests are not logged
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    """
+    HTTP server thread answering GET /metrics with the rendered metrics.
+    """
+
+    def __init__(self, address, port, metrics):
+        self.httpd = ThreadingHTTPServer((address, port), MetricsRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.metrics = metrics
+        self.worker = threading.Thread(target=self.httpd.serve_forever)
+
+    def start(self):
+        self.worker.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.worker.join()
+        self.httpd.server_close()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Database Partitions
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import os
+import re
+import time
+import sqlite3
+import calendar
+import functools
+from urllib.parse import quote
+
+from lib.database import ResultStore, create_results_tables, configure_connection
+from lib.query import QueryError
+
+
+# partition periods, none stores all results in sqlite3_db
+TOPOSTAT_DB_PARTITION_PERIODS = ["none", "year", "month", "day"]
+
+# partition key format and regular expression per period, keys of a period sort
+# in chronological order
+TOPOSTAT_DB_PARTITION_FORMATS = {
+    "year": ["%Y", r"\d{4}"],
+    "month": ["%Y-%m", r"\d{4}-\d{2}"],
+    "day": ["%Y-%m-%d", r"\d{4}-\d{2}-\d{2}"],
+}
+
+# number of partitions the database writer keeps open
+TOPOSTAT_DB_PARTITIONS_OPEN = 2
+
+
+# key of the partition storing results with the given unix epoch timestamp,
+# rows of a message mostly share their timestamp
+@functools.lru_cache(maxsize=4096)
+def partition_key(period, epoch):
+    return time.strftime(TOPOSTAT_DB_PARTITION_FORMATS[period][0], time.gmtime(epoch))
+
+
+# first unix epoch second of a partition and of the following partition
+def partition_range(period, key):
+    start = calendar.timegm(
+        time.strptime(key, TOPOSTAT_DB_PARTITION_FORMATS[period][0])
+    )
+    if period == "day":
+        return start, start + 86400
+    year, month = time.gmtime(start)[:2]
+    if period == "year":
+        year += 1
+    elif month == 12:
+        year += 1
+        month = 1
+    else:
+        month += 1
+    return start, calendar.timegm((year, month, 1, 0, 0, 0))
+
+
+# key of the partition preceding a partition
+def partition_key_before(period, key):
+    return partition_key(period, partition_range(period, key)[0] - 1)
+
+
+# database file of a partition, the key is inserted before the extension of the
+# sqlite3_db file name
+def partition_file(db, key):
+    root, ext = os.path.splitext(db)
+    return "{}-{}{}".format(root, key, ext)
+
+
+# keys of all partition files of a database, oldest first
+def list_partitions(db, period):
+    root, ext = os.path.splitext(db)
+    pattern = re.compile(
+        re.escape(os.path.basename(root))
+        + "-({})".format(TOPOSTAT_DB_PARTITION_FORMATS[period][1])
+        + re.escape(ext)
+        + "$"
+    )
+    keys = []
+    for name in os.listdir(os.path.dirname(db) or "."):
+        match = pattern.match(name)
+        if match:
+            keys.append(match.group(1))
+    return sorted(keys)
+
+
+class PartitionSet:
+    """
+    Results database split into one self-contained database file per period,
+    each with its own dimension and aggregate tables, named after sqlite3_db,
+    e.g. topotests-2021-04.db holds the results of April 2021. Results are
+    routed to the partition of their timestamp. Only the most recently written
+    partitions are kept open. Partitions older than db_partition_retention
+    periods are deleted, or moved to db_partition_archive_dir, one file rename
+    or unlink per partition.
+    """
+
+    def __init__(self, conf, log):
+        self.conf = conf
+        self.log = log
+        self.stores = {}
+
+    # split rows by the partition of their timestamp
+    def route(self, rows):
+        parts = {}
+        for row in rows:
+            key = partition_key(self.conf.db_partition, row[4])
+            parts.setdefault(key, []).append(row)
+        return parts
+
+    # oldest partition kept by the retention policy, None keeps all partitions
+    def oldest_key(self):
+        if self.conf.db_partition_retention == 0:
+            return None
+        key = partition_key(self.conf.db_partition, int(time.time()))
+        for i in range(self.conf.db_partition_retention - 1):
+            key = partition_key_before(self.conf.db_partition, key)
+        return key
+
+    # check if a partition is expired by the retention policy
+    def expired(self, key):
+        oldest = self.oldest_key()
+        return oldest is not None and key < oldest
+
+    # get the result store of a partition, the partition is created and
+    # expired partitions are removed when a new partition is started
+    def store(self, key):
+        store = self.stores.pop(key, None)
+        if store is None:
+            db = partition_file(self.conf.sqlite3_db, key)
+            created = not os.path.exists(db)
+            conn = sqlite3.connect(db, check_same_thread=False)
+            try:
+                configure_connection(conn, self.conf)
+                create_results_tables(conn, self.conf.results_table)
+            except:
+                conn.close()
+                raise
+            store = ResultStore(
+                conn,
+                self.conf.results_table,
+                duplicates=self.conf.db_duplicates,
+                filter_capacity=self.conf.db_dedup_filter_capacity,
+            )
+            if created:
+                self.log.info("created partition database {}".format(db))
+                self.expire()
+        # keep the most recently used stores last and close the oldest ones
+        self.stores[key] = store
+        while len(self.stores) > TOPOSTAT_DB_PARTITIONS_OPEN:
+            self.close_store(next(iter(self.stores)))
+        return store
+
+    def close_store(self, key):
+        store = self.stores.pop(key, None)
+        if store is not None:
+            store.conn.close()
+
+    # delete or archive all partitions expired by the retention policy
+    def expire(self):
+        oldest = self.oldest_key()
+        if oldest is None:
+            return
+        for key in list_partitions(self.conf.sqlite3_db, self.conf.db_partition):
+            if key >= oldest:
+                break
+            self.close_store(key)
+            db = partition_file(self.conf.sqlite3_db, key)
+            if self.conf.db_partition_archive_dir:
+                archive = os.path.join(
+                    self.conf.db_partition_archive_dir, os.path.basename(db)
+                )
+                # the log of a database not closed cleanly holds committed rows
+                if os.path.exists(db + "-wal"):
+                    os.replace(db + "-wal", archive + "-wal")
+                os.replace(db, archive)
+                self.log.info(
+                    "archived partition database {} to {}".format(db, archive)
+                )
+            else:
+                if os.path.exists(db + "-wal"):
+                    os.remove(db + "-wal")
+                os.remove(db)
+                self.log.info("deleted partition database {}".format(db))
+            if os.path.exists(db + "-shm"):
+                os.remove(db + "-shm")
+
+    def close(self):
+        for key in list(self.stores):
+            self.close_store(key)
+
+
+class PartitionReader:
+    """
+    Attaches the partitions a query needs to a query connection on an
+    in-memory database. Attached partitions are reused by later queries and
+    detached once more than the attach limit of the connection are needed or
+    their file was removed.
+    """
+
+    def __init__(self, conn, conf):
+        self.conn = conn
+        self.conf = conf
+        self.attached = {}
+
+    # schema name of an attached partition
+    def schema(self, key):
+        return "p_" + key.replace("-", "_")
+
+    def detach(self, key):
+        self.conn.execute("DETACH DATABASE {}".format(self.attached.pop(key)))
+
+    # attach the partitions overlapping the time range [since, until) and
+    # return their results tables oldest first, a query needing more
+    # partitions than the attach limit fails instead of skipping partitions
+    def tables(self, since, until):
+        period = self.conf.db_partition
+        limit = self.conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        keys = []
+        for key in list_partitions(self.conf.sqlite3_db, period):
+            start, end = partition_range(period, key)
+            if since is not None and end <= since:
+                continue
+            if until is not None and start >= until:
+                continue
+            keys.append(key)
+        if len(keys) > limit:
+            if since is None:
+                raise QueryError(
+                    "database has {} partitions, at most {} can be queried,"
+                    " missing parameter since".format(len(keys), limit)
+                )
+            raise QueryError(
+                "time range spans {} partitions, at most {} can be queried".format(
+                    len(keys), limit
+                )
+            )
+
+        # detach removed partitions, and partitions not needed by this query
+        # once the attach limit is reached
+        for key in list(self.attached):
+            if not os.path.exists(partition_file(self.conf.sqlite3_db, key)):
+                self.detach(key)
+        for key in keys:
+            if key in self.attached:
+                continue
+            if len(self.attached) >= limit:
+                self.detach(next(k for k in self.attached if not k in keys))
+            schema = self.schema(key)
+            self.conn.execute(
+                "ATTACH DATABASE ? AS {}".format(schema),
+                (
+                    "file:{}?mode=ro".format(
+                        quote(partition_file(self.conf.sqlite3_db, key))
+                    ),
+                ),
+            )
+            self.conn.execute(
+                "PRAGMA {}.cache_size = {}".format(schema, -self.conf.db_cache_size_kib)
+            )
+            self.conn.execute(
+                "PRAGMA {}.mmap_size = {}".format(
+                    schema, self.conf.db_mmap_size_mib * 1024 * 1024
+                )
+            )
+            self.attached[key] = schema
+        return [
+            "{}.{}".format(self.attached[key], self.conf.results_table) for key in keys
+        ]
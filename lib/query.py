@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Queries
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import sqlite3
+
+from lib.topostat import TOPOSTAT_RESULTS, timestamp_to_epoch
+import lib.check as check
+
+
+class QueryError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return str(self.msg)
+
+
+# sql expression converting the stored result value back to its name
+def result_name_sql(column):
+    return (
+        "CASE {}".format(column)
+        + "".join(
+            " WHEN {} THEN '{}'".format(i, val)
+            for i, val in enumerate(TOPOSTAT_RESULTS)
+        )
+        + " END"
+    )
+
+
+# get a mandatory or optional string query parameter
+def query_param(params, name, required=True):
+    val = params.get(name)
+    if val is None:
+        if required:
+            raise QueryError("missing parameter {}".format(name))
+        return None
+    if isinstance(val, int) and not isinstance(val, bool):
+        val = str(val)
+    if not check.is_str_no_empty(val):
+        raise QueryError("invalid parameter {}".format(name))
+    return val
+
+
+# get an optional timestamp query parameter as unix epoch seconds
+def query_param_epoch(params, name):
+    val = query_param(params, name, required=False)
+    if val is None:
+        return None
+    try:
+        return timestamp_to_epoch(val)
+    except:
+        raise QueryError("invalid timestamp parameter {}".format(name))
+
+
+# combine the select of every results table with UNION ALL, select returns the
+# sql and arguments for a table and its position in tables, oldest first
+def union_sql(tables, select):
+    selects = []
+    args = []
+    for part, table in enumerate(tables):
+        sql, table_args = select(part, table)
+        selects.append(sql)
+        args += table_args
+    return " UNION ALL ".join(selects), args
+
+
+# history of a single test, optionally restricted to a plan and a time range,
+# newest builds first
+def query_test_history(tables, params):
+    name = query_param(params, "name")
+    plan = query_param(params, "plan", required=False)
+    since = query_param_epoch(params, "since")
+    until = query_param_epoch(params, "until")
+
+    def select(part, table):
+        sql = (
+            "SELECT p.name AS plan, r.build AS build, j.name, h.name"
+            + ", {}".format(result_name_sql("r.result"))
+            + ", r.duration, datetime(r.timestamp, 'unixepoch')"
+            + ", {} AS part, r.id AS id".format(part)
+            + " FROM {} r".format(table)
+            + " JOIN {}_plans p ON p.id = r.plan_id".format(table)
+            + " JOIN {}_jobs j ON j.id = r.job_id".format(table)
+            + " JOIN {}_hosts h ON h.id = r.host_id".format(table)
+            + " WHERE r.test_id = (SELECT id FROM {}_tests WHERE name = ?)".format(
+                table
+            )
+        )
+        args = [name]
+        if plan is not None:
+            sql += " AND r.plan_id = (SELECT id FROM {}_plans WHERE name = ?)".format(
+                table
+            )
+            args.append(plan)
+        if since is not None:
+            sql += " AND r.timestamp >= ?"
+            args.append(since)
+        if until is not None:
+            sql += " AND r.timestamp < ?"
+            args.append(until)
+        return sql, args
+
+    sql, args = union_sql(tables, select)
+    sql += " ORDER BY plan DESC, build DESC, part DESC, id DESC"
+    columns = ["plan", "build", "job", "host", "result", "time", "timestamp"]
+    return sql, args, columns
+
+
+# result counts and total duration per job of a single build
+def query_build_summary(tables, params):
+    plan = query_param(params, "plan")
+    build = query_param(params, "build")
+
+    def select(part, table):
+        sql = (
+            "SELECT j.name AS job"
+            + "".join(
+                ", sum(r.result = {}) AS {}".format(i, val)
+                for i, val in enumerate(TOPOSTAT_RESULTS)
+            )
+            + ", count(*) AS total, sum(r.duration) AS time"
+            + " FROM {} r".format(table)
+            + " JOIN {}_jobs j ON j.id = r.job_id".format(table)
+            + " WHERE r.plan_id = (SELECT id FROM {}_plans WHERE name = ?)".format(
+                table
+            )
+            + " AND r.build = ?"
+            + " GROUP BY r.job_id"
+        )
+        return sql, [plan, build]
+
+    sql, args = union_sql(tables, select)
+    columns = ["job"] + TOPOSTAT_RESULTS + ["total", "time"]
+    sql = "SELECT {}".format(
+        ", ".join(columns[:1] + ["sum({})".format(val) for val in columns[1:]])
+    ) + " FROM ({}) GROUP BY job ORDER BY job".format(sql)
+    return sql, args, columns
+
+
+# failed tests of a build or of a time range, newest first
+def query_failures(tables, params):
+    plan = query_param(params, "plan", required=False)
+    build = query_param(params, "build", required=False)
+    since = query_param_epoch(params, "since")
+    until = query_param_epoch(params, "until")
+    if build is not None and plan is None:
+        raise QueryError("parameter build requires parameter plan")
+    if build is None and since is None:
+        raise QueryError("missing parameter build or since")
+
+    def select(part, table):
+        sql = (
+            "SELECT datetime(r.timestamp, 'unixepoch'), p.name, r.build, j.name"
+            + ", t.name, h.name, r.duration"
+            + ", r.timestamp AS epoch, {} AS part, r.id AS id".format(part)
+            + " FROM {} r".format(table)
+            + " JOIN {}_tests t ON t.id = r.test_id".format(table)
+            + " JOIN {}_plans p ON p.id = r.plan_id".format(table)
+            + " JOIN {}_jobs j ON j.id = r.job_id".format(table)
+            + " JOIN {}_hosts h ON h.id = r.host_id".format(table)
+            + " WHERE r.result = {}".format(TOPOSTAT_RESULTS.index("failed"))
+        )
+        args = []
+        if plan is not None:
+            sql += " AND r.plan_id = (SELECT id FROM {}_plans WHERE name = ?)".format(
+                table
+            )
+            args.append(plan)
+        if build is not None:
+            sql += " AND r.build = ?"
+            args.append(build)
+        if since is not None:
+            sql += " AND r.timestamp >= ?"
+            args.append(since)
+        if until is not None:
+            sql += " AND r.timestamp < ?"
+            args.append(until)
+        return sql, args
+
+    sql, args = union_sql(tables, select)
+    sql += " ORDER BY epoch DESC, part DESC, id DESC"
+    columns = ["timestamp", "plan", "build", "job", "name", "host", "time"]
+    return sql, args, columns
+
+
+# aggregated results of a test per plan, answered from the aggregate tables,
+# the last result and build are those of the newest table, build numbers of a
+# plan only increase
+def query_test_stats(tables, params):
+    name = query_param(params, "name")
+    plan = query_param(params, "plan", required=False)
+
+    def select(part, table):
+        sql = (
+            "SELECT p.name AS plan"
+            + ", {}".format(", ".join("s." + val for val in TOPOSTAT_RESULTS))
+            + ", s.total_duration, s.last_result, s.last_build"
+            + ", s.last_failure_build, {} AS part".format(part)
+            + " FROM {}_stats s".format(table)
+            + " JOIN {}_plans p ON p.id = s.plan_id".format(table)
+            + " WHERE s.test_id = (SELECT id FROM {}_tests WHERE name = ?)".format(
+                table
+            )
+        )
+        args = [name]
+        if plan is not None:
+            sql += " AND s.plan_id = (SELECT id FROM {}_plans WHERE name = ?)".format(
+                table
+            )
+            args.append(plan)
+        return sql, args
+
+    sql, args = union_sql(tables, select)
+    # the bare last_result and last_build columns are taken from the row with
+    # max(part)
+    sql = (
+        "WITH stats AS ({}) SELECT plan".format(sql)
+        + ", {}".format(", ".join("sum({})".format(val) for val in TOPOSTAT_RESULTS))
+        + ", sum(total_duration), sum(total_duration) / ({})".format(
+            " + ".join("sum({})".format(val) for val in TOPOSTAT_RESULTS)
+        )
+        + ", {}, last_build".format(result_name_sql("last_result"))
+        + ", (SELECT max(f.last_failure_build) FROM stats f WHERE f.plan = stats.plan)"
+        + ", max(part)"
+        + " FROM stats GROUP BY plan ORDER BY plan"
+    )
+    columns = (
+        ["plan"]
+        + TOPOSTAT_RESULTS
+        + ["time", "mean_time", "last_result", "last_build", "last_failure_build"]
+    )
+    return sql, args, columns
+
+
+TOPOSTAT_QUERIES = {
+    "test_history": query_test_history,
+    "build_summary": query_build_summary,
+    "failures": query_failures,
+    "test_stats": query_test_stats,
+}
+
+
+# run a canned query request and return the response, a request is a dict
+#   {"query": name, "params": {...}, "offset": int, "limit": int}
+# and a response contains a page of at most limit rows and the offset of the
+# next page, which is None on the last page, tables(since, until) returns the
+# results tables covering the time range of the since and until parameters
+def run_query(conn, tables, request, page_size, max_page_size):
+    try:
+        if not isinstance(request, dict):
+            raise QueryError("invalid query request")
+        name = request.get("query")
+        if name not in TOPOSTAT_QUERIES:
+            raise QueryError("unknown query {}".format(name))
+        params = request.get("params", {})
+        if not isinstance(params, dict):
+            raise QueryError("invalid query parameters")
+        offset = request.get("offset", 0)
+        limit = request.get("limit", page_size)
+        if not check.is_int_min(offset, 0):
+            raise QueryError("invalid offset")
+        if not check.is_int_range(limit, 1, max_page_size):
+            raise QueryError("invalid limit, maximum is {}".format(max_page_size))
+
+        since = query_param_epoch(params, "since")
+        until = query_param_epoch(params, "until")
+        sql, args, columns = TOPOSTAT_QUERIES[name](tables(since, until), params)
+        rows = conn.execute(
+            sql + " LIMIT ? OFFSET ?", args + [limit + 1, offset]
+        ).fetchall()
+    except QueryError as err:
+        return {"status": "error", "error": str(err)}
+    except sqlite3.Error:
+        return {"status": "error", "error": "query {} failed".format(name)}
+
+    # columns the rows are sorted by follow the returned columns
+    next_offset = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_offset = offset + limit
+    return {
+        "status": "ok",
+        "query": name,
+        "columns": columns,
+        "rows": [list(row[: len(columns)]) for row in rows],
+        "offset": offset,
+        "next_offset": next_offset,
+    }
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Client Spool
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import os
+import json
+import time
+import fcntl
+import shutil
+import struct
+
+from lib.topostat import Message
+from lib.upload import UploadError, UploadRejectedError
+
+
+# prefix of the directories of uploads being written
+SPOOL_TMP_PREFIX = ".tmp-"
+
+# lock file held while the spool is flushed or spooled uploads are evicted
+SPOOL_LOCK_FILE = ".lock"
+
+# error replied by the server for messages authenticated with another key, a
+# spooled upload it rejects with this error is kept for a later flush
+SPOOL_AUTH_ERROR = "authentication failed"
+
+# length of a message frame in a spooled message file
+SPOOL_FRAME_LENGTH = struct.Struct("!I")
+
+
+class SpoolError(Exception):
+    pass
+
+
+# write the frames of a message to a file as length prefixed frames
+def write_frames(path, frames):
+    with open(path, "wb") as f:
+        for frame in frames:
+            f.write(SPOOL_FRAME_LENGTH.pack(len(frame)))
+            f.write(frame)
+
+
+# read the frames of a message written by write_frames()
+def read_frames(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    frames = []
+    offset = 0
+    while offset < len(data):
+        (length,) = SPOOL_FRAME_LENGTH.unpack_from(data, offset)
+        offset += SPOOL_FRAME_LENGTH.size
+        if offset + length > len(data):
+            raise SpoolError("truncated message file {}".format(path))
+        frames.append(data[offset : offset + length])
+        offset += length
+    return frames
+
+
+# authenticate the frames of a spooled message anew, the payload frame of a
+# version 2 message is passed on as spooled
+def resign_frames(frames, auth_key):
+    msg = Message()
+    msg.gen_auth(auth_key)
+    header = json.loads(frames[0])
+    header["auth"] = msg.auth
+    header["timestamp"] = msg.timestamp
+    return [json.dumps(header).encode()] + frames[1:]
+
+
+# size of the files of a directory in bytes
+def directory_size(path):
+    size = 0
+    for entry in os.scandir(path):
+        if entry.is_file(follow_symlinks=False):
+            size += entry.stat(follow_symlinks=False).st_size
+    return size
+
+
+# fsync a file or directory
+def fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# whether the process of a pid is running
+def pid_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Spool:
+    """
+    Directory of uploads the server did not confirm. Every spooled upload is a
+    directory named after the time it was started holding the frames of its
+    messages, one file per message. Uploads are written to a temporary
+    directory and renamed into the spool once complete, so a spooled upload is
+    never partial. The spool is flushed oldest upload first and capped at
+    spool_max_mb, evicting the oldest uploads.
+    """
+
+    def __init__(self, conf, log):
+        self.conf = conf
+        self.log = log
+        self.path = conf.spool_dir
+        self.max_size = conf.spool_max_mb * 1024 * 1024
+        self.lock_fd = None
+        # uploads queued on a push socket, removed by confirm()
+        self.flushed = []
+
+    # create the spool directory, raises SpoolError if it is not writable
+    def open(self):
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            if not os.access(self.path, os.W_OK | os.X_OK):
+                raise SpoolError("spool directory {} is not writable".format(self.path))
+        except OSError as err:
+            raise SpoolError("failed to create spool directory {}".format(err))
+
+    # take the spool lock, False if another client holds it
+    def lock(self):
+        fd = os.open(
+            os.path.join(self.path, SPOOL_LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644
+        )
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self.lock_fd = fd
+        return True
+
+    def unlock(self):
+        if self.lock_fd is not None:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+    # paths of the spooled uploads, oldest first
+    def uploads(self):
+        names = [
+            entry.name
+            for entry in os.scandir(self.path)
+            if entry.is_dir(follow_symlinks=False)
+            and not entry.name.startswith(SPOOL_TMP_PREFIX)
+        ]
+        return [os.path.join(self.path, name) for name in sorted(names)]
+
+    # remove the temporary directories of clients that are no longer running,
+    # their uploads were never complete
+    def clean(self):
+        for entry in os.scandir(self.path):
+            if not entry.name.startswith(SPOOL_TMP_PREFIX):
+                continue
+            try:
+                pid = int(entry.name[len(SPOOL_TMP_PREFIX) :].split("-")[0])
+            except ValueError:
+                continue
+            if not pid_running(pid):
+                shutil.rmtree(entry.path, ignore_errors=True)
+                self.log.debug("removed stale spool directory {}".format(entry.path))
+
+    # evict the oldest spooled uploads until the spool is within spool_max_mb,
+    # only while no other client flushes the spool
+    def evict(self):
+        if not self.lock():
+            return
+        try:
+            uploads = [[path, directory_size(path)] for path in self.uploads()]
+            size = sum(upload[1] for upload in uploads)
+            for path, upload_size in uploads:
+                if size <= self.max_size:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                size -= upload_size
+                self.log.warn(
+                    "evicted spooled upload {} of {} bytes to stay within {} MB".format(
+                        os.path.basename(path), upload_size, self.conf.spool_max_mb
+                    )
+                )
+        finally:
+            self.unlock()
+
+    # start spooling an upload sent by sock, sending is False once the server
+    # could not be reached
+    def upload(self, sock, sending=True):
+        return SpoolUpload(self, sock, sending)
+
+    # resend the spooled uploads with sock oldest first and remove every upload
+    # confirmed by the server, uploads rejected by the server are removed as
+    # they would be rejected again unless authentication failed, flushing
+    # stops at the first upload not sent, returns the number of uploads left.
+    # With delivery push nothing is confirmed, the uploads are only queued and
+    # the spool stays locked until confirm() removes them once sock is closed
+    def flush(self, sock):
+        if not self.lock():
+            self.log.info("spool {} is flushed by another client".format(self.path))
+            return 0
+        try:
+            self.clean()
+            uploads = self.uploads()
+            if not uploads:
+                return 0
+            self.log.info(
+                "resending {} spooled uploads from {}".format(len(uploads), self.path)
+            )
+            resent = 0
+            stored = sock.stored
+            duplicates = sock.duplicates
+            for i, path in enumerate(uploads):
+                try:
+                    for name in sorted(os.listdir(path)):
+                        frames = read_frames(os.path.join(path, name))
+                        sock.send(resign_frames(frames, self.conf.auth_key))
+                    resent += 1
+                    if not sock.ack:
+                        self.flushed.append(path)
+                        continue
+                except UploadError as err:
+                    if (
+                        not isinstance(err, UploadRejectedError)
+                        or err.error == SPOOL_AUTH_ERROR
+                    ):
+                        # queued uploads were dropped with the socket
+                        left = len(uploads) - i + len(self.flushed)
+                        self.flushed = []
+                        self.log.warn("{}, {} spooled uploads left".format(err, left))
+                        return left
+                    self.log.warn(
+                        "dropped spooled upload {}: {}".format(
+                            os.path.basename(path), err
+                        )
+                    )
+                except (OSError, ValueError, SpoolError) as err:
+                    self.log.warn(
+                        "dropped unreadable spooled upload {}: {}".format(
+                            os.path.basename(path), err
+                        )
+                    )
+                shutil.rmtree(path, ignore_errors=True)
+            if self.flushed:
+                self.log.info(
+                    "queued {} spooled uploads, removed once delivered".format(
+                        len(self.flushed)
+                    )
+                )
+                return 0
+            self.log.info("resent {} spooled uploads".format(resent))
+            if sock.ack:
+                self.log.info(
+                    "server stored {} spooled topotest results ({} duplicates)".format(
+                        sock.stored - stored, sock.duplicates - duplicates
+                    )
+                )
+            return 0
+        finally:
+            if not self.flushed:
+                self.unlock()
+
+    # remove the uploads queued by flush() once sock delivered all messages on
+    # close, if the upload watchdog timer expires instead they are kept
+    def confirm(self):
+        if not self.flushed:
+            return
+        for path in self.flushed:
+            shutil.rmtree(path, ignore_errors=True)
+        self.log.info("resent {} spooled uploads".format(len(self.flushed)))
+        self.flushed = []
+        self.unlock()
+
+
+class SpoolUpload:
+    """
+    Messages of an upload written to a temporary spool directory as they are
+    sent. Once a message could not be sent the remaining messages are only
+    written to the spool, commit() moves the complete upload into the spool
+    and discard() removes it. Without sending the messages are only written,
+    with delivery push the upload is committed and flushed with the spool. Failing to write the spool does not fail the
+    upload, the upload is then just not spooled.
+    """
+
+    def __init__(self, spool, sock, sending):
+        self.spool = spool
+        self.log = spool.log
+        self.sock = sock
+        self.sending = sending
+        self.complete = False
+        self.started = time.time_ns()
+        self.messages = 0
+        self.size = 0
+        self.path = os.path.join(
+            spool.path,
+            "{}{}-{}".format(SPOOL_TMP_PREFIX, os.getpid(), self.started),
+        )
+        try:
+            os.mkdir(self.path)
+        except OSError as err:
+            self.log.warn("failed to create spool directory {}".format(err))
+            self.path = None
+
+    # write the frames of a message to the spool and send them
+    def send(self, frames):
+        self.write(frames)
+        if not self.sending:
+            return
+        try:
+            self.sock.send(frames)
+        except UploadRejectedError:
+            raise
+        except UploadError as err:
+            self.log.warn("{}, spooling upload".format(err))
+            self.sending = False
+
+    def write(self, frames):
+        if self.path is None:
+            return
+        self.size += sum(len(frame) for frame in frames)
+        if self.size > self.spool.max_size:
+            self.log.warn(
+                "upload exceeds {} MB, it is not spooled".format(
+                    self.spool.conf.spool_max_mb
+                )
+            )
+            self.discard()
+            return
+        try:
+            write_frames(
+                os.path.join(self.path, "{:08d}".format(self.messages)), frames
+            )
+            self.messages += 1
+        except OSError as err:
+            self.log.warn("failed to write spool {}".format(err))
+            self.discard()
+
+    # all messages of the upload are written, with delivery push the upload
+    # watchdog timer commits the upload before the process is killed
+    def finish(self):
+        self.complete = True
+
+    # move the upload into the spool if it is complete and was not sent, else
+    # remove it, returns whether the upload was spooled
+    def close(self):
+        if self.complete and not self.sending and self.messages > 0:
+            return self.commit()
+        self.discard()
+        return False
+
+    # move the complete upload into the spool, returns whether it was spooled
+    def commit(self):
+        if self.path is None or not self.complete or self.messages == 0:
+            return False
+        path = os.path.join(
+            self.spool.path, "{:020d}-{}".format(self.started, os.getpid())
+        )
+        try:
+            for name in os.listdir(self.path):
+                fsync_path(os.path.join(self.path, name))
+            os.rename(self.path, path)
+            fsync_path(self.spool.path)
+        except OSError as err:
+            self.log.warn("failed to spool upload {}".format(err))
+            self.discard()
+            return False
+        self.path = None
+        self.log.info(
+            "spooled upload of {} messages ({} bytes) to {}".format(
+                self.messages, self.size, path
+            )
+        )
+        self.spool.evict()
+        return True
+
+    # watchdog expiry with delivery push, nothing is known to be delivered
+    def expire(self):
+        self.sending = False
+        self.commit()
+
+    def discard(self):
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Stage Timers
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import time
+import threading
+import cProfile
+
+
+# order of the stages in summaries, stages not listed follow in the order they
+# were first timed
+TOPOSTAT_STAGES = [
+    "recv",
+    "decode",
+    "auth",
+    "validate",
+    "queue",
+    "insert",
+    "commit",
+    "query",
+]
+
+
+class StageTimes:
+    """
+    Durations of processing stages, the number of timed calls, their total and
+    maximum duration in seconds by stage name.
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        times = self.stages.get(stage)
+        if times is None:
+            self.stages[stage] = [1, seconds, seconds]
+            return
+        times[0] += 1
+        times[1] += seconds
+        if seconds > times[2]:
+            times[2] = seconds
+
+
+class StageTimers(StageTimes):
+    """
+    StageTimes shared by the server threads, and by the ingest worker processes
+    through merge(). A summary of the stages is logged and the durations are
+    reset once interval seconds passed since the last summary.
+    """
+
+    def __init__(self, log, interval):
+        super().__init__()
+        self.log = log
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            super().add(stage, seconds)
+        self.check_report()
+
+    # add the stages of a StageTimes of an ingest worker process
+    def merge(self, stages):
+        with self.lock:
+            for stage, [count, total, maximum] in stages.items():
+                times = self.stages.get(stage)
+                if times is None:
+                    self.stages[stage] = [count, total, maximum]
+                    continue
+                times[0] += count
+                times[1] += total
+                if maximum > times[2]:
+                    times[2] = maximum
+        self.check_report()
+
+    def check_report(self):
+        if time.monotonic() - self.started >= self.interval:
+            self.report()
+
+    # log a summary line of all stages and reset the durations
+    def report(self):
+        with self.lock:
+            stages = self.stages
+            elapsed = time.monotonic() - self.started
+            self.stages = {}
+            self.started = time.monotonic()
+        if not stages:
+            return
+        names = [stage for stage in TOPOSTAT_STAGES if stage in stages]
+        names += [stage for stage in stages if not stage in TOPOSTAT_STAGES]
+        summary = []
+        for stage in names:
+            count, total, maximum = stages[stage]
+            summary.append(
+                "{} {}x avg {:.3f}ms max {:.3f}ms total {:.0f}ms".format(
+                    stage,
+                    count,
+                    total / count * 1000,
+                    maximum * 1000,
+                    total * 1000,
+                )
+            )
+        self.log.info("stage times of {:.0f}s: {}".format(elapsed, ", ".join(summary)))
+
+
+class LoopProfiler:
+    """
+    cProfile profiler of the server main loop. The statistics collected so far
+    are written to file on dump() while profiling continues, they can be read
+    with the pstats module.
+    """
+
+    def __init__(self, file, log):
+        self.file = file
+        self.log = log
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def dump(self):
+        self.profile.disable()
+        try:
+            self.profile.dump_stats(self.file)
+            self.log.info("dumped profile statistics to {}".format(self.file))
+        except:
+            self.log.err("failed to dump profile statistics to {}".format(self.file))
+        self.profile.enable()
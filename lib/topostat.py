@@ -23,8 +23,13 @@
 
 import sys
 import os
-from datetime import datetime
+import time
+import calendar
+import functools
+from datetime import datetime, timezone
 import json
+import zlib
+import uuid
 import hashlib
 import threading
 import re
@@ -37,12 +42,94 @@ from lib.config import ServerConfig, ClientConfig
 import lib.check as check
 
 
-TOPOSTAT_MESSAGE_VERSION = 1
+# zstandard compresses message payloads, it is optional
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# version 1 messages are a single json frame, version 2 messages a json header
+# frame followed by the json payload frame, compressed with one of the
+# TOPOSTAT_MESSAGE_ENCODINGS
+TOPOSTAT_MESSAGE_VERSION = 2
+TOPOSTAT_MESSAGE_VERSIONS = [1, 2]
+TOPOSTAT_MESSAGE_ENCODINGS = ["none", "zlib", "zstd"]
 TOPOSTAT_TTR_VERSION = 1
 
+# upper limit of the decompressed payload size of a message
+TOPOSTAT_MESSAGE_MAX_PAYLOAD = 256 * 1024 * 1024
+
+# test result values, the list index is the value stored in the database
+TOPOSTAT_RESULTS = ["passed", "failed", "skipped"]
+
+
+class MessageEncodingError(Exception):
+    pass
+
+
+# check if a payload encoding is supported, zstd needs the optional zstandard
+# module
+def message_encoding_available(encoding):
+    if encoding == "zstd":
+        return zstandard is not None
+    return encoding in TOPOSTAT_MESSAGE_ENCODINGS
+
+
+# compress a payload frame
+def encode_payload(data, encoding):
+    if encoding == "zlib":
+        return zlib.compress(data, 6)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return data
+
+
+# decompress a payload frame, raises MessageEncodingError for unsupported
+# encodings and ValueError for payloads larger than TOPOSTAT_MESSAGE_MAX_PAYLOAD
+def decode_payload(data, encoding):
+    if not message_encoding_available(encoding):
+        raise MessageEncodingError(encoding)
+    if encoding == "zlib":
+        decomp = zlib.decompressobj()
+        data = decomp.decompress(data, TOPOSTAT_MESSAGE_MAX_PAYLOAD)
+        if decomp.unconsumed_tail or not decomp.eof:
+            raise ValueError("invalid or oversized zlib payload")
+    elif encoding == "zstd":
+        # the output is only capped for frames without a content size
+        try:
+            params = zstandard.get_frame_parameters(data)
+            if params.content_size > TOPOSTAT_MESSAGE_MAX_PAYLOAD:
+                raise ValueError("oversized zstd payload")
+            data = zstandard.ZstdDecompressor().decompress(
+                data, max_output_size=TOPOSTAT_MESSAGE_MAX_PAYLOAD
+            )
+        except zstandard.ZstdError:
+            raise ValueError("invalid or oversized zstd payload")
+    elif len(data) > TOPOSTAT_MESSAGE_MAX_PAYLOAD:
+        raise ValueError("oversized payload")
+    return data
+
 
 class Message:
-    def __init__(self, version=None, auth=None, timestamp=None, payload=None):
+    """
+    Message of the topostat protocol. The payload is neither copied when added
+    nor when serialized, it must not be changed until the message is sent.
+    """
+
+    __slots__ = [
+        "version",
+        "auth",
+        "timestamp",
+        "payload",
+        "upload_id",
+        "chunk",
+        "chunks",
+    ]
+
+    def __init__(
+        self, version=None, auth=None, timestamp=None, payload=None, upload_id=""
+    ):
         if version is None or not isinstance(version, int):
             self.version = TOPOSTAT_MESSAGE_VERSION
         else:
@@ -50,17 +137,76 @@ class Message:
         self.auth = auth
         self.timestamp = timestamp
         self.payload = payload
+        self.upload_id = upload_id
+        # chunk index within a chunked upload of version 2 messages, chunks is
+        # 0 until the final chunk carries the number of chunks of the upload
+        self.chunk = 0
+        self.chunks = 1
 
     def from_json(self, json_obj):
         self.version = json_obj["version"]
         self.auth = json_obj["auth"]
         self.timestamp = json_obj["timestamp"]
         self.payload = json_obj["payload"]
+        # messages of older clients have no upload id
+        self.upload_id = json_obj.get("upload_id", "")
 
+    # version 1 json object, chunks are not part of version 1 messages
     def to_json(self):
         if not self.check():
             return None
-        return json.loads(json.dumps(self.__dict__))
+        return {
+            "version": self.version,
+            "auth": self.auth,
+            "timestamp": self.timestamp,
+            "payload": self.payload,
+            "upload_id": self.upload_id,
+        }
+
+    # ZeroMQ frames of the message, a version 2 message carries the payload
+    # encoding in its header frame
+    def to_frames(self, encoding="zlib"):
+        if not self.check():
+            return None
+        if self.version == 1:
+            return [json.dumps(self.to_json()).encode()]
+        header = {
+            "version": self.version,
+            "auth": self.auth,
+            "timestamp": self.timestamp,
+            "upload_id": self.upload_id,
+            "chunk": self.chunk,
+            "chunks": self.chunks,
+            "encoding": encoding,
+        }
+        return [
+            json.dumps(header).encode(),
+            encode_payload(json.dumps(self.payload).encode(), encoding),
+        ]
+
+    # read a message of any supported version from its ZeroMQ frames
+    def from_frames(self, frames):
+        if len(frames) == 1:
+            self.from_json(json.loads(frames[0]))
+            return
+        if len(frames) != 2:
+            raise ValueError("invalid number of message frames")
+        header = json.loads(frames[0])
+        self.version = header["version"]
+        self.auth = header["auth"]
+        self.timestamp = header["timestamp"]
+        self.upload_id = header["upload_id"]
+        self.chunk = header.get("chunk", 0)
+        self.chunks = header.get("chunks", 1)
+        if self.version != 2:
+            raise ValueError("invalid multipart message version")
+        self.payload = json.loads(decode_payload(frames[1], header["encoding"]))
+
+    # generate a unique id of the upload, the server ignores a resent message
+    # with the id of an already stored upload
+    def gen_upload_id(self):
+        self.upload_id = str(uuid.uuid4())
+        return True
 
     def gen_auth(self, auth_key):
         if auth_key is None or not isinstance(auth_key, str):
@@ -84,25 +230,60 @@ class Message:
         return False
 
     def check(self):
-        for var in self.__dict__.values():
+        for var in (
+            self.version,
+            self.auth,
+            self.timestamp,
+            self.payload,
+            self.upload_id,
+            self.chunk,
+            self.chunks,
+        ):
             if var is None:
                 return False
         if (
             not isinstance(self.version, int)
-            or self.version != TOPOSTAT_MESSAGE_VERSION
+            or not self.version in TOPOSTAT_MESSAGE_VERSIONS
         ):
             return False
+        if not isinstance(self.upload_id, str):
+            return False
+        if not check.is_int_min(self.chunk, 0) or not check.is_int_min(self.chunks, 0):
+            return False
+        if self.chunks != 1 or self.chunk != 0:
+            # chunked uploads are version 2 messages identified by upload id
+            if self.version == 1 or not self.upload_id:
+                return False
+            if self.chunks > 0 and self.chunk >= self.chunks:
+                return False
         return True
 
-    # add a json payload
+    # add a json payload, the payload is serialized by to_frames()
     def add_payload(self, payload):
         if payload is None:
             return False
-        self.payload = json.loads(json.dumps(payload))
+        self.payload = payload
         return True
 
 
 class TopotestResult:
+    """
+    Result of a single topotest. The slots are in the order of the keys of the
+    json object, a client keeps every result of an unchunked upload in memory.
+    """
+
+    __slots__ = [
+        "version",
+        "name",
+        "result",
+        "time",
+        "host",
+        "timestamp",
+        "plan",
+        "build",
+        "job",
+    ]
+
     def __init__(
         self,
         name=None,
@@ -128,48 +309,40 @@ class TopotestResult:
         self.build = build
         self.job = job
 
-    def create_table(self, conn, table):
-        conn.cursor().execute(
-            "CREATE TABLE {} (".format(table)
-            + "id INTEGER PRIMARY KEY AUTOINCREMENT"
-            + ", name text"
-            + ", result text"
-            + ", time text"
-            + ", host text"
-            + ", timestamp text"
-            + ", plan text"
-            + ", build text"
-            + ", job text"
-            + ")"
-        )
-        conn.commit()
-
-    def insert_into(self, conn, table):
-        conn.cursor().execute(
-            "INSERT INTO {} (".format(table)
-            + "name, result, time, host, timestamp, plan, build, job"
-            + ") VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-            (
-                str(self.name),
-                str(self.result),
-                str(self.time),
-                str(self.host),
-                str(self.timestamp),
-                str(self.plan),
-                str(self.build),
-                str(self.job),
-            ),
+    # database row with typed values as stored by lib.database.ResultStore,
+    # raises ValueError if the duration, timestamp or build can not be
+    # converted
+    def to_row(self):
+        return (
+            self.name,
+            TOPOSTAT_RESULTS.index(self.result),
+            float(self.time),
+            self.host,
+            timestamp_to_epoch(self.timestamp),
+            self.plan,
+            build_to_int(self.build),
+            self.job,
         )
-        conn.commit()
 
     def to_json(self):
         if not self.check():
             return None
-        return json.loads(json.dumps(self.__dict__))
+        return {
+            "version": self.version,
+            "name": self.name,
+            "result": self.result,
+            "time": self.time,
+            "host": self.host,
+            "timestamp": self.timestamp,
+            "plan": self.plan,
+            "build": self.build,
+            "job": self.job,
+        }
 
     def from_json(self, json_dict):
         try:
-            if json_dict["version"] != TOPOSTAT_TTR_VERSION:
+            version = json_dict["version"]
+            if type(version) is not int or version != TOPOSTAT_TTR_VERSION:
                 return None
             self.name = json_dict["name"]
             self.result = json_dict["result"]
@@ -188,41 +361,62 @@ class TopotestResult:
     def from_case(self, case, host, plan, build, job):
         if case is None or not isinstance(case, TestCase):
             return None
-        if not (
-            check.is_str_no_empty(host)
-            and check.is_str_no_empty(plan)
-            and check.is_str_no_empty(build)
-            and check.is_str_no_empty(job)
-        ):
-            return None
-        self.version = TOPOSTAT_TTR_VERSION
-        self.name = str(case.classname) + "." + str(case.name)
+        result = None
         if case.result:
             # junit parser version switch
             if isinstance(case.result, list):
                 # junitparser v2.X
                 if isinstance(case.result[0], Failure):
-                    self.result = "failed"
+                    result = "failed"
                 elif isinstance(case.result[0], Skipped):
-                    self.result = "skipped"
+                    result = "skipped"
             else:
                 # junitparser v1.X
                 if isinstance(case.result, Failure):
-                    self.result = "failed"
+                    result = "failed"
                 elif isinstance(case.result, Skipped):
-                    self.result = "skipped"
+                    result = "skipped"
         else:
-            self.result = "passed"
-        self.time = str(case.time)
+            result = "passed"
+        return self.from_testcase(
+            case.classname, case.name, result, case.time, host, plan, build, job
+        )
+
+    # result of a junit test case by its attributes as read by junitparser,
+    # result is passed, failed, skipped or None for errors, used by from_case()
+    # and lib.junit.read_junit()
+    def from_testcase(self, classname, name, result, time, host, plan, build, job):
+        if not (
+            check.is_str_no_empty(host)
+            and check.is_str_no_empty(plan)
+            and check.is_str_no_empty(build)
+            and check.is_str_no_empty(job)
+        ):
+            return None
+        self.version = TOPOSTAT_TTR_VERSION
+        self.name = str(classname) + "." + str(name)
+        self.result = result
+        self.time = str(time)
         self.host = host
-        self.timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+        # timestamps are UTC as the server stores them as unix epoch seconds
+        self.timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")
         self.plan = plan
         self.build = build
         self.job = job
         return self
 
     def check(self):
-        for var in list(self.__dict__.values()):
+        for var in (
+            self.version,
+            self.name,
+            self.result,
+            self.time,
+            self.host,
+            self.timestamp,
+            self.plan,
+            self.build,
+            self.job,
+        ):
             if var is None:
                 return False
             elif isinstance(var, int):
@@ -233,10 +427,12 @@ class TopotestResult:
                 continue
             else:
                 return False
-        if not isinstance(self.version, int):
+        if type(self.version) is not int:
             return False
         if self.version != TOPOSTAT_TTR_VERSION:
             return False
+        if self.result not in TOPOSTAT_RESULTS:
+            return False
         return True
 
     def passed(self):
@@ -270,6 +466,136 @@ class TopotestResult:
             return True
 
 
+class TopotestRun:
+    """
+    Results of a client run in columns. Host, plan, build and job are shared by
+    all results and sent once, names, results, durations and timestamps as
+    parallel lists. Version 2 messages carry a run instead of a list of
+    TopotestResult objects.
+    """
+
+    def __init__(self, host=None, plan=None, build=None, job=None, version=None):
+        if version is None or not isinstance(version, int):
+            self.version = TOPOSTAT_TTR_VERSION
+        else:
+            self.version = version
+        self.host = host
+        self.plan = plan
+        self.build = build
+        self.job = job
+        self.name = []
+        self.result = []
+        self.time = []
+        self.timestamp = []
+
+    # append a result of this run
+    def add(self, result):
+        if (
+            result.host != self.host
+            or result.plan != self.plan
+            or result.build != self.build
+            or result.job != self.job
+        ):
+            return False
+        self.name.append(result.name)
+        self.result.append(result.result)
+        self.time.append(result.time)
+        self.timestamp.append(result.timestamp)
+        return True
+
+    # json object sharing the columns of the run
+    def to_json(self):
+        if not self.check():
+            return None
+        return {
+            "version": self.version,
+            "host": self.host,
+            "plan": self.plan,
+            "build": self.build,
+            "job": self.job,
+            "name": self.name,
+            "result": self.result,
+            "time": self.time,
+            "timestamp": self.timestamp,
+        }
+
+    def from_json(self, json_dict):
+        try:
+            version = json_dict["version"]
+            if type(version) is not int or version != TOPOSTAT_TTR_VERSION:
+                return None
+            self.host = json_dict["host"]
+            self.plan = json_dict["plan"]
+            self.build = json_dict["build"]
+            self.job = json_dict["job"]
+            self.name = json_dict["name"]
+            self.result = json_dict["result"]
+            self.time = json_dict["time"]
+            self.timestamp = json_dict["timestamp"]
+        except:
+            return None
+        if not self.check():
+            return None
+        return self
+
+    # check the shared values the way TopotestResult.check() does, and that
+    # the columns are lists of the same length, column values are checked by
+    # to_rows()
+    def check(self):
+        if type(self.version) is not int or self.version != TOPOSTAT_TTR_VERSION:
+            return False
+        for var in [self.host, self.plan, self.build, self.job]:
+            if not ttr_value_valid(var):
+                return False
+        columns = [self.name, self.result, self.time, self.timestamp]
+        for column in columns:
+            if not isinstance(column, list) or len(column) != len(self.name):
+                return False
+        return True
+
+    # database rows of the valid results as returned by TopotestResult.to_row()
+    # and the number of invalid results, without a TopotestResult per row
+    def to_rows(self):
+        try:
+            build = build_to_int(self.build)
+        except ValueError:
+            return [], len(self.name)
+        results = {val: i for i, val in enumerate(TOPOSTAT_RESULTS)}
+        rows = []
+        invalid = 0
+        for name, result, duration, timestamp in zip(
+            self.name, self.result, self.time, self.timestamp
+        ):
+            if not (
+                ttr_value_valid(name)
+                and ttr_value_valid(duration)
+                and ttr_value_valid(timestamp)
+                and isinstance(result, str)
+                and result in results
+            ):
+                invalid += 1
+                continue
+            try:
+                rows.append(
+                    (
+                        name,
+                        results[result],
+                        float(duration),
+                        self.host,
+                        timestamp_to_epoch(timestamp),
+                        self.plan,
+                        build,
+                        self.job,
+                    )
+                )
+            except:
+                invalid += 1
+        return rows, invalid
+
+    def __len__(self):
+        return len(self.name)
+
+
 class Logger:
     def __init__(self, conf):
         self.run = True
@@ -367,8 +693,11 @@ class Logger:
             pass
 
 
-def compose_zmq_client_address_str(conf, log):
+# compose the ZeroMQ address of the server port, server_port by default
+def compose_zmq_client_address_str(conf, log, port=None):
     server_address_types = ["IPV4", "IPV6", "DNS"]
+    if port is None:
+        port = conf.server_port
 
     if not check.is_str_no_empty(conf.server_address_type):
         if ":" in conf.server_address:
@@ -381,13 +710,9 @@ def compose_zmq_client_address_str(conf, log):
 
     if conf.server_address_type in server_address_types:
         if conf.server_address_type == "IPV6":
-            conf.socket_address_str = "tcp://[{}]:{}".format(
-                conf.server_address, conf.server_port
-            )
+            conf.socket_address_str = "tcp://[{}]:{}".format(conf.server_address, port)
         elif conf.server_address_type == "IPV4":
-            conf.socket_address_str = "tcp://{}:{}".format(
-                conf.server_address, conf.server_port
-            )
+            conf.socket_address_str = "tcp://{}:{}".format(conf.server_address, port)
         else:
             dns_addr = conf.server_address
             try:
@@ -407,7 +732,7 @@ def compose_zmq_client_address_str(conf, log):
                     dns_addr, conf.server_address
                 )
             )
-            return compose_zmq_client_address_str(conf, log)
+            return compose_zmq_client_address_str(conf, log, port)
     else:
         log.err("invalid server address type {}".format(conf.server_address_type))
         return None
@@ -437,3 +762,36 @@ def determine_client_sender_id(conf):
     # socket.gethostname() fails
     conf.sender_id = None
     return False
+
+
+# check a value of a TopotestResult, only integers and strings other than ""
+# and "None" are valid
+def ttr_value_valid(var):
+    if isinstance(var, int):
+        return True
+    return isinstance(var, str) and var != "" and var != "None"
+
+
+# convert a build number, an int or a string of decimal digits as set by bamboo,
+# to the int stored in the database, raises ValueError for other values
+def build_to_int(build):
+    if type(build) is int and build >= 0:
+        return build
+    if isinstance(build, str) and build.isascii() and build.isdigit():
+        return int(build)
+    raise ValueError("invalid build {}".format(build))
+
+
+# convert a "%Y-%m-%d %H:%M:%S.%f" UTC timestamp to integer unix epoch seconds,
+# fractions of a second are truncated as the database stores whole seconds
+def timestamp_to_epoch(timestamp):
+    seconds, _, fraction = timestamp.partition(".")
+    if fraction and not fraction.isdigit():
+        raise ValueError("invalid timestamp {}".format(timestamp))
+    return timestamp_seconds_to_epoch(seconds)
+
+
+# results of a run share few distinct seconds, cache the expensive parsing
+@functools.lru_cache(maxsize=4096)
+def timestamp_seconds_to_epoch(seconds):
+    return calendar.timegm(time.strptime(seconds, "%Y-%m-%d %H:%M:%S"))
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Client Upload
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import json
+from threading import Timer
+
+import zmq
+
+from lib.topostat import Message, TopotestRun
+from lib.ack import TOPOSTAT_ACK_INCOMPLETE
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadRejectedError(UploadError):
+    def __init__(self, error):
+        super().__init__("server failed to store message: {}".format(error))
+        self.error = error
+
+
+# upload watchdog handler to terminate non-responsive ZeroMQ connect and send
+# threads, expire is called before the process is killed
+def watchdog_handler(log, expire):
+    if expire is not None:
+        try:
+            expire()
+        except:
+            pass
+    log.kill("upload watchdog timer expired")
+
+
+class UploadSocket:
+    """
+    ZeroMQ socket connected to the server on the first message. With delivery
+    ack a DEALER socket sends every message to the acknowledgement port and
+    waits up to connection_timeout for the reply of the server, which is sent
+    once the results are committed, a message completing an upload is only
+    confirmed by a reply reporting the upload as committed. With delivery push a PUSH socket queues
+    the messages without confirmation, the upload watchdog timer is restarted
+    with every message and on close(), which waits without limit until all
+    messages are delivered, so unsent messages are never silently dropped.
+    Sending raises UploadError if the server can not be reached or discarded
+    an incomplete upload, which is sent again, and UploadRejectedError if the
+    server failed to store a message.
+    """
+
+    def __init__(self, conf, log, expire=None):
+        self.conf = conf
+        self.log = log
+        self.ack = conf.delivery == "ack"
+        self.expire = expire
+        self.context = None
+        self.sock = None
+        self.watchdog = None
+        self.sent = 0
+        self.stored = 0
+        self.duplicates = 0
+
+    def start_watchdog(self):
+        if self.watchdog is not None:
+            self.watchdog.cancel()
+        self.watchdog = Timer(
+            self.conf.connection_timeout, watchdog_handler, [self.log, self.expire]
+        )
+        self.watchdog.start()
+
+    def connect(self):
+        # create ZeroMQ context and socket, sending blocks once socket_sndhwm
+        # messages are queued
+        name = "DEALER" if self.ack else "PUSH"
+        self.context = zmq.Context()
+        self.sock = self.context.socket(zmq.DEALER if self.ack else zmq.PUSH)
+        self.sock.setsockopt(zmq.SNDHWM, self.conf.socket_sndhwm)
+        if self.ack:
+            self.sock.setsockopt(zmq.LINGER, self.conf.socket_linger_ms)
+        else:
+            self.sock.setsockopt(zmq.LINGER, -1)
+        if self.conf.server_address_type in ["IPV6", "DNS"]:
+            self.sock.setsockopt(zmq.IPV6, True)
+
+        # sends and replies of acknowledged messages time out on their own,
+        # unacknowledged messages are guarded by the upload watchdog timer
+        if self.ack:
+            self.sock.setsockopt(zmq.SNDTIMEO, self.conf.connection_timeout * 1000)
+        else:
+            self.start_watchdog()
+            self.log.info(
+                "started upload watchdog timer with interval of {}s".format(
+                    self.conf.connection_timeout
+                )
+            )
+
+        # establish connection to ZeroMQ server
+        try:
+            self.sock.connect(self.conf.socket_address_str)
+            self.log.info(
+                "connected ZeroMQ {} socket to address {}".format(
+                    name, self.conf.socket_address_str
+                )
+            )
+        except:
+            if self.watchdog is not None:
+                self.watchdog.cancel()
+            self.sock.close()
+            self.context.term()
+            self.log.abort(
+                "failed to connect ZeroMQ {} socket to address {}".format(
+                    name, self.conf.socket_address_str
+                )
+            )
+
+    # send the frames of a message, waits for the reply of the server with
+    # delivery ack
+    def send(self, frames):
+        if self.sock is None:
+            self.connect()
+        elif not self.ack:
+            self.start_watchdog()
+        try:
+            self.sock.send_multipart(frames)
+        except zmq.ZMQError:
+            self.drop()
+            raise UploadError("failed to send topotest results to server")
+        self.sent += 1
+        if self.ack:
+            self.wait_reply()
+
+    # wait for the reply to the last sent message, raises UploadError if the
+    # server does not confirm that the message was stored
+    def wait_reply(self):
+        try:
+            if not self.sock.poll(self.conf.connection_timeout * 1000):
+                raise UploadError(
+                    "no reply from server within {}s".format(
+                        self.conf.connection_timeout
+                    )
+                )
+            reply = json.loads(self.sock.recv(zmq.NOBLOCK))
+            status = reply["status"]
+        except UploadError:
+            # a late reply must not be taken for the reply to the next message
+            self.drop()
+            raise
+        except zmq.ZMQError:
+            self.drop()
+            raise UploadError("failed to receive reply from server")
+        except:
+            self.drop()
+            raise UploadError("failed to parse reply from server")
+        if status != "ok":
+            if reply.get("error") == TOPOSTAT_ACK_INCOMPLETE:
+                raise UploadError(
+                    "server discarded incomplete upload {}".format(
+                        reply.get("upload_id")
+                    )
+                )
+            raise UploadRejectedError(reply.get("error"))
+        # the reply to a final chunk confirms the upload once it is stored
+        if reply.get("chunks", 1) > 0 and not reply.get("committed"):
+            raise UploadError(
+                "server did not store upload {}".format(reply.get("upload_id"))
+            )
+        self.stored += reply.get("stored", 0)
+        self.duplicates += reply.get("duplicates", 0)
+        if reply.get("duplicate"):
+            self.log.info(
+                "server already stored upload {}".format(reply.get("upload_id"))
+            )
+        self.log.debug(
+            "server stored {} results of chunk {} of upload {}".format(
+                reply.get("stored", 0), reply.get("chunk"), reply.get("upload_id")
+            )
+        )
+
+    # drop queued messages and close the socket, the next message connects a
+    # new socket
+    def drop(self):
+        if self.watchdog is not None:
+            self.watchdog.cancel()
+            self.watchdog = None
+        if self.sock is not None:
+            self.sock.close(linger=0)
+            self.context.term()
+            self.sock = None
+            self.context = None
+
+    # drop queued messages and abort, also before the first message
+    def fail(self, err):
+        self.drop()
+        self.log.abort(err)
+
+    # deliver all queued messages and close the socket, with delivery push the
+    # upload watchdog timer limits the time to deliver the queued messages
+    def close(self):
+        if self.sock is None:
+            return
+        name = "DEALER" if self.ack else "PUSH"
+        if not self.ack:
+            self.start_watchdog()
+        try:
+            self.sock.close()
+            self.context.term()
+            self.log.info(
+                "closed ZeroMQ {} socket connected to address {}".format(
+                    name, self.conf.socket_address_str
+                )
+            )
+        finally:
+            # stop upload watchdog timer
+            if self.watchdog is not None:
+                self.watchdog.cancel()
+                self.log.info("stopped upload watchdog timer")
+
+
+class Upload:
+    """
+    Composes the messages of an upload from results added one by one. With
+    message_chunk_size set, version 2 messages of at most that many results are
+    passed to send() while results are still added, all sharing the upload id,
+    and the final chunk carries the number of chunks. Only the chunk being
+    filled and the previous chunk are kept in memory, the server stores the
+    results of a chunked upload once the final chunk arrived.
+    """
+
+    def __init__(self, conf, log, plan, build, job, send):
+        self.conf = conf
+        self.log = log
+        self.plan = plan
+        self.build = build
+        self.job = job
+        self.send = send
+        self.upload_id = None
+        self.chunk_size = 0
+        if conf.message_version > 1:
+            self.chunk_size = conf.message_chunk_size
+        self.chunks = 0
+        self.results = 0
+        self.pending = []
+        self.current = []
+
+    # add a valid result, sends the previous chunk once the current chunk is
+    # full, the last chunk is held back to mark it as final
+    def add(self, result):
+        self.current.append(result)
+        self.results += 1
+        if self.chunk_size > 0 and len(self.current) >= self.chunk_size:
+            if self.pending:
+                self.send_chunk(self.pending, False)
+            self.pending = self.current
+            self.current = []
+
+    # send the remaining results, returns the number of sent messages
+    def finish(self):
+        chunks = [chunk for chunk in [self.pending, self.current] if chunk]
+        for i, chunk in enumerate(chunks):
+            self.send_chunk(chunk, i == len(chunks) - 1)
+        self.pending = []
+        self.current = []
+        return self.chunks
+
+    # compose and send a message with the results of a chunk
+    def send_chunk(self, results, final):
+        msg = Message(version=self.conf.message_version)
+        try:
+            # version 2 messages send the results as a run, sharing the host,
+            # plan, build and job of all results
+            if msg.version > 1:
+                run = TopotestRun(self.conf.sender_id, self.plan, self.build, self.job)
+                for result in results:
+                    run.add(result)
+                msg.add_payload(run.to_json())
+            else:
+                msg.add_payload([result.to_json() for result in results])
+            if self.upload_id is None:
+                msg.gen_upload_id()
+                self.upload_id = msg.upload_id
+            msg.upload_id = self.upload_id
+            msg.chunk = self.chunks
+            msg.chunks = self.chunks + 1 if final else 0
+            msg.gen_auth(self.conf.auth_key)
+            frames = msg.to_frames(self.conf.message_encoding)
+        except:
+            self.log.abort("failed to compose topostat message")
+        if frames is None:
+            self.log.abort("check of composed topostat message failed")
+        if self.chunks == 0:
+            self.log.info(
+                "composed topostat message version {} with upload id {}".format(
+                    msg.version, msg.upload_id
+                )
+            )
+        if msg.version > 1:
+            self.log.debug(
+                "encoded chunk {} of {} results with {} to {} bytes".format(
+                    msg.chunk, len(results), self.conf.message_encoding, len(frames[-1])
+                )
+            )
+        self.send(frames)
+        self.chunks += 1
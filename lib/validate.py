@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Batch Validation
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+from itertools import compress, repeat
+from operator import itemgetter
+
+from lib.topostat import (
+    TOPOSTAT_RESULTS,
+    TOPOSTAT_TTR_VERSION,
+    build_to_int,
+    timestamp_to_epoch,
+    ttr_value_valid,
+)
+
+
+# numpy combines the masks of rejected results, it is optional
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# fields of a result in the order they are checked, a rejected result is
+# reported with its first invalid field as reason
+VALIDATE_FIELDS = [
+    "version",
+    "name",
+    "result",
+    "time",
+    "host",
+    "timestamp",
+    "plan",
+    "build",
+    "job",
+]
+
+# reason of a result that is not a json object with all fields
+VALIDATE_MALFORMED = "malformed"
+
+# database value of the result of a result
+VALIDATE_RESULT_INDEX = {val: i for i, val in enumerate(TOPOSTAT_RESULTS)}
+
+VALIDATE_FIELDS_GETTER = itemgetter(*VALIDATE_FIELDS)
+
+
+# database row value of a field as converted by TopotestResult.to_row(), None
+# if the value does not pass TopotestResult.check() or can not be converted
+def convert_value(field, val):
+    if field == "version":
+        # the version is an int as checked by TopotestResult.from_json(), 1.0
+        # and True compare equal to 1
+        return val if type(val) is int and val == TOPOSTAT_TTR_VERSION else None
+    if not ttr_value_valid(val):
+        return None
+    try:
+        if field == "result":
+            return VALIDATE_RESULT_INDEX.get(val) if isinstance(val, str) else None
+        elif field == "time":
+            return float(val)
+        elif field == "timestamp":
+            return timestamp_to_epoch(val)
+        elif field == "build":
+            return build_to_int(val)
+    except:
+        return None
+    return val
+
+
+# database row values of a column converted in C loops over the column or its
+# distinct values, None if the column has values of another type than sent by
+# clients or any invalid value
+def convert_column_fast(field, column):
+    if field == "version":
+        try:
+            versions = set(column)
+        except TypeError:
+            # unhashable values
+            return None
+        if versions == {TOPOSTAT_TTR_VERSION} and set(map(type, column)) == {int}:
+            return column
+        return None
+    if set(map(type, column)) != {str}:
+        return None
+    try:
+        if field == "result":
+            return list(map(VALIDATE_RESULT_INDEX.__getitem__, column))
+        elif field == "time":
+            return list(map(float, column))
+        elif field == "timestamp":
+            return list(map(timestamp_to_epoch, column))
+        elif field == "build":
+            return list(map(build_to_int, column))
+    except:
+        return None
+    distinct = set(column)
+    if "" in distinct or "None" in distinct:
+        return None
+    return column
+
+
+# database row values of a column and the indices of its invalid values
+def convert_column(field, column):
+    values = convert_column_fast(field, column)
+    if values is not None:
+        return values, []
+    values = [convert_value(field, val) for val in column]
+    return values, [i for i, val in enumerate(values) if val is None]
+
+
+# combine the invalid indices of the fields into the first invalid field of
+# every rejected result and a mask of the accepted results
+def combine_invalid(count, invalid):
+    if numpy is None:
+        reasons = {}
+        for field, indices in invalid:
+            for i in indices:
+                if not i in reasons:
+                    reasons[i] = field
+        accepted = [True] * count
+        for i in reasons:
+            accepted[i] = False
+        return sorted(reasons.items()), accepted
+
+    rejected = numpy.zeros(count, dtype=bool)
+    reasons = []
+    for field, indices in invalid:
+        mask = numpy.zeros(count, dtype=bool)
+        mask[indices] = True
+        reasons += [[i, field] for i in numpy.flatnonzero(mask & ~rejected).tolist()]
+        rejected |= mask
+    reasons.sort()
+    return [tuple(reason) for reason in reasons], (~rejected).tolist()
+
+
+# validate results given by field as columns of count values or as a value
+# shared by all results in a single pass per column, returns the database rows
+# of the valid results as TopotestResult.to_row() and a list of (index,
+# reason) of the rejected results, invalid lists indices of results already
+# rejected with a reason
+def validate_columns(count, columns, invalid=None):
+    if invalid is None:
+        invalid = []
+    values = {}
+    for field in VALIDATE_FIELDS:
+        column = columns[field]
+        if isinstance(column, list):
+            values[field], indices = convert_column(field, column)
+        else:
+            val = convert_value(field, column)
+            values[field] = repeat(val, count)
+            indices = range(count) if val is None else []
+        if indices:
+            invalid.append([field, indices])
+    rows = list(
+        zip(
+            values["name"],
+            values["result"],
+            values["time"],
+            values["host"],
+            values["timestamp"],
+            values["plan"],
+            values["build"],
+            values["job"],
+        )
+    )
+    if not invalid:
+        return rows, []
+    reasons, accepted = combine_invalid(count, invalid)
+    return list(compress(rows, accepted)), reasons
+
+
+# validate a list of json result objects as sent by version 1 clients, with
+# the same accept or reject decision as TopotestResult.from_json(), check()
+# and to_row() per result
+def validate_result_list(results):
+    if not results:
+        return [], []
+    try:
+        columns = list(zip(*map(VALIDATE_FIELDS_GETTER, results)))
+        malformed = []
+    except:
+        # results not being json objects with all fields are rejected, their
+        # fields are checked as None
+        fields = []
+        malformed = []
+        for i, result in enumerate(results):
+            try:
+                fields.append(VALIDATE_FIELDS_GETTER(result))
+            except:
+                fields.append((None,) * len(VALIDATE_FIELDS))
+                malformed.append(i)
+        columns = list(zip(*fields))
+    columns = {field: list(column) for field, column in zip(VALIDATE_FIELDS, columns)}
+    invalid = [[VALIDATE_MALFORMED, malformed]] if malformed else []
+    return validate_columns(len(results), columns, invalid)
+
+
+# validate the results of a TopotestRun, host, plan, build and job are shared
+# by all results
+def validate_run_columns(run):
+    return validate_columns(
+        len(run),
+        {
+            "version": run.version,
+            "name": run.name,
+            "result": run.result,
+            "time": run.time,
+            "host": run.host,
+            "timestamp": run.timestamp,
+            "plan": run.plan,
+            "build": run.build,
+            "job": run.job,
+        },
+    )
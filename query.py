@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Query Client
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import os
+import sys
+import argparse
+
+import zmq
+
+from lib.topostat import (
+    Logger,
+    Message,
+    compose_zmq_client_address_str,
+)
+from lib.config import ClientConfig, read_config_file
+from lib.query import TOPOSTAT_QUERIES
+import lib.check as check
+
+
+# parse cli arguments
+def parse_cli_arguments(conf, log):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("query", help="query name", choices=list(TOPOSTAT_QUERIES))
+    ap.add_argument("params", help="query parameters", nargs="*", metavar="NAME=VALUE")
+    ap.add_argument("-v", "--verbose", help="verbose output", action="store_true")
+    ap.add_argument("-d", "--debug", help="debug messages", action="store_true")
+    ap.add_argument("-c", "--config", help="configuration file")
+    ap.add_argument("-a", "--address", help="server address")
+    ap.add_argument("-p", "--port", help="server query tcp port", type=int)
+    ap.add_argument("-k", "--key", help="authentication key")
+    ap.add_argument("-l", "--log", help="log file")
+    ap.add_argument("-o", "--offset", help="offset of first row", type=int, default=0)
+    ap.add_argument("-n", "--limit", help="rows per page", type=int)
+    ap.add_argument("--all", help="fetch all pages", action="store_true")
+    try:
+        args = vars(ap.parse_args())
+        conf_to_args = {
+            "verbose": "verbose",
+            "debug": "debug",
+            "server_address": "address",
+            "server_query_port": "port",
+            "auth_key": "key",
+            "log_file": "log",
+        }
+        for conf_var, arg_val in conf_to_args.items():
+            if not args[arg_val] is None:
+                if conf_var in conf.config_bools:
+                    if args[arg_val]:
+                        conf.__dict__[conf_var] = True
+                elif conf_var in conf.config_ints:
+                    conf.__dict__[conf_var] = args[arg_val]
+                elif check.is_str_no_empty(args[arg_val]):
+                    conf.__dict__[conf_var] = args[arg_val]
+                if not conf_var in conf.config_no_show:
+                    log.debug(
+                        "conf.{} = args[{}] = {}".format(
+                            conf_var, arg_val, args[arg_val]
+                        )
+                    )
+        params = {}
+        for param in args["params"]:
+            name, val = param.split("=", 1)
+            params[name] = val
+        args["params"] = params
+    except:
+        log.abort("failed to parse arguments")
+    return args
+
+
+def main():
+    # initialize config
+    conf = ClientConfig()
+    conf.progname = "topostat-query"
+    conf.progname_long = "NetDEF FRR Topotest Results Statistics Tool Query Client"
+
+    # initialize logger
+    log = Logger(conf)
+
+    # read config file
+    for arg in sys.argv:
+        if sys.argv.index(arg) + 1 == len(sys.argv):
+            break
+        if arg in ("-c", "--config"):
+            conf.config_file = sys.argv[sys.argv.index(arg) + 1]
+    if check.is_str_no_empty(conf.config_file):
+        read_config_file(conf.config_file, conf, log)
+    elif os.path.isfile(conf.default_config_file):
+        read_config_file(conf.default_config_file, conf, log)
+
+    # parse cli arguments
+    args = parse_cli_arguments(conf, log)
+
+    # start log buffer output
+    log.start()
+
+    # do a configuration check
+    if not conf.check():
+        log.abort("configuration check failed")
+
+    # compose ZeroMQ server address string for the query port
+    if compose_zmq_client_address_str(conf, log, conf.server_query_port) is None:
+        log.abort("failed to compose ZeroMQ server address string")
+
+    # create ZeroMQ context and socket, a request without response is abandoned
+    # after the connection timeout
+    context = zmq.Context()
+    sock = context.socket(zmq.REQ)
+    sock.setsockopt(zmq.LINGER, 0)
+    sock.setsockopt(zmq.RCVTIMEO, conf.connection_timeout * 1000)
+    if conf.server_address_type in ["IPV6", "DNS"]:
+        sock.setsockopt(zmq.IPV6, True)
+    try:
+        sock.connect(conf.socket_address_str)
+        log.debug("connected ZeroMQ REQ socket to {}".format(conf.socket_address_str))
+    except:
+        sock.close()
+        context.term()
+        log.abort("failed to connect to {}".format(conf.socket_address_str))
+
+    # request pages and print rows tab separated
+    request = {"query": args["query"], "params": args["params"]}
+    request["offset"] = args["offset"]
+    if args["limit"] is not None:
+        request["limit"] = args["limit"]
+    header = True
+    ok = True
+    while True:
+        msg = Message(version=1)
+        msg.add_payload(request)
+        msg.gen_auth(conf.auth_key)
+        try:
+            sock.send_json(msg.to_json())
+            response = sock.recv_json()
+        except:
+            log.err("no response from server {}".format(conf.socket_address_str))
+            ok = False
+            break
+        if response.get("status") != "ok":
+            log.err("query failed: {}".format(response.get("error")))
+            ok = False
+            break
+        if header:
+            print("\t".join(response["columns"]))
+            header = False
+        for row in response["rows"]:
+            print("\t".join(str(val) for val in row))
+        if not args["all"] or response["next_offset"] is None:
+            break
+        request["offset"] = response["next_offset"]
+
+    sock.close()
+    context.term()
+
+    # exit
+    if not ok:
+        log.abort("query {} failed".format(args["query"]))
+    log.stop()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
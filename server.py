@@ -25,74 +25,462 @@ import os
 import sys
 import signal
 import argparse
+import json
 import sqlite3
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 import zmq
+import zmq.asyncio
 
-from lib.topostat import Logger, Message, TopotestResult
+from lib.topostat import Logger, Message
 from lib.config import ServerConfig, read_config_file
+from lib.database import (
+    DatabaseWriter,
+    DatabaseCheckpointer,
+    TOPOSTAT_DB_SCHEMA_VERSION,
+    TOPOSTAT_DB_JOURNAL_MODES,
+    TOPOSTAT_DB_SYNCHRONOUS,
+    TOPOSTAT_DB_DUPLICATES,
+    configure_connection,
+    results_schema_version,
+    create_results_tables,
+    rebuild_results_stats,
+    table_exists,
+)
+from lib.ingest import (
+    IngestPool,
+    ingest_message,
+    INGEST_PARSE_FAILED,
+    INGEST_ENCODING_UNSUPPORTED,
+    INGEST_AUTH_FAILED,
+    INGEST_NO_LIST,
+    INGEST_INVALID_RUN,
+    INGEST_EMPTY,
+)
+from lib.partition import (
+    PartitionSet,
+    PartitionReader,
+    TOPOSTAT_DB_PARTITION_PERIODS,
+)
+from lib.query import run_query
+from lib.ack import AckQueue, ack_reply
+from lib.metrics import ServerMetrics, MetricsServer
+from lib.timing import StageTimers, LoopProfiler
 import lib.check as check
 
 
-# process received results and store results in database
-def process_received_results(results, conn, conf, log):
+# server main loops, a blocking loop around a ZeroMQ poller or asyncio tasks
+TOPOSTAT_SERVER_LOOPS = ["poller", "asyncio"]
 
-    # check if received json payload is a list
-    if not isinstance(results, list):
+# interval of the housekeeping of the server loops in seconds, at most the
+# staging timeout
+TOPOSTAT_HOUSEKEEPING_INTERVAL_S = 60
+
+
+# housekeeping interval of the server loops in seconds
+def housekeeping_interval(conf):
+    return min(TOPOSTAT_HOUSEKEEPING_INTERVAL_S, conf.db_staging_timeout_s)
+
+
+# log the outcome of an ingested message of size bytes and queue valid results
+# for the database writer, the client of route is replied to once the results
+# are committed or the message is rejected
+def process_ingested_message(ingested, writer, log, route=None, size=0):
+    (
+        status,
+        rows,
+        results_total,
+        results_valid,
+        results_invalid,
+        agent,
+        upload,
+        rejected,
+    ) = ingested
+
+    # update the metrics before the message is passed on
+    metrics = writer.metrics
+    if metrics is not None:
+        metrics.messages.inc(1, status)
+        metrics.agent_bytes.inc(size, agent or "")
+        if results_total > 0:
+            metrics.results.inc(results_valid, "valid")
+            metrics.results.inc(results_invalid, "invalid")
+
+    if status == INGEST_PARSE_FAILED:
+        log.warn("failed to parse ZeroMQ message")
+        writer.ack(route, ack_reply(upload, "invalid message"))
+        return
+    if status == INGEST_ENCODING_UNSUPPORTED:
+        log.warn("received ZeroMQ message with unsupported payload encoding")
+        writer.ack(route, ack_reply(upload, "unsupported payload encoding"))
+        return
+    if status == INGEST_AUTH_FAILED:
+        log.warn("failed to authenticate ZeroMQ message")
+        writer.ack(route, ack_reply(upload, "authentication failed"))
+        return
+    if status == INGEST_NO_LIST:
         log.warn("received json payload does not contain a list")
+        writer.ack(route, ack_reply(upload, "invalid payload"))
         return
-
-    # check if received results list is empty
-    if not results:
-        log.warn("received empty list of test results")
+    if status == INGEST_INVALID_RUN:
+        log.warn("received json payload contains an invalid run")
+        writer.ack(route, ack_reply(upload, "invalid run"))
         return
+    if status == INGEST_EMPTY:
+        log.warn("received empty list of test results")
+        # an empty chunk still counts towards the chunks of its upload
+        if upload[1] == 0 and upload[2] == 1:
+            writer.ack(route, ack_reply(upload, committed=True))
+            return
+
+    # pass valid results on to the database writer thread, chunks of a chunked
+    # upload are passed on even without valid results to complete the upload
+    if rows or upload[2] != 1:
+        start = time.perf_counter()
+        writer.put(rows or [], agent, upload, route)
+        if writer.timers is not None:
+            writer.timers.add("queue", time.perf_counter() - start)
+        if upload[2] != 1:
+            log.debug(
+                "received chunk {} of upload {} from agent {}".format(
+                    upload[1], upload[0], agent
+                )
+            )
+    else:
+        writer.ack(route, ack_reply(upload, committed=True))
+
+    # invalid results are counted by their first invalid field
+    counts = "{} valid, {} invalid".format(results_valid, results_invalid)
+    if rejected:
+        counts += ": " + ", ".join(
+            "{} {}".format(count, reason) for reason, count in sorted(rejected.items())
+        )
+    if results_valid > 0:
+        log.info(
+            "received {} test results ({}) from agent {}".format(
+                results_total, counts, agent
+            )
+        )
+    else:
+        log.info("received {} test results ({})".format(results_total, counts))
 
-    # go through received list, convert and validate results
-    results_valid = 0
-    results_invalid = 0
-    results_total = 0
-    for json_obj in results:
-        results_total += 1
 
-        # convert to TopotestResult object
+# parse, authenticate and validate the frames of a received ZeroMQ message,
+# either in the ingest worker processes or in the main thread
+def process_received_message(frames, pool, writer, conf, log, route=None):
+    if pool is not None:
+        pool.submit(frames, route)
+    else:
+        process_ingested_message(
+            ingest_message(frames, conf.auth_key, writer.timers),
+            writer,
+            log,
+            route,
+            sum(len(frame) for frame in frames),
+        )
+
+
+# send the queued replies to acknowledged messages, a reply to a disconnected
+# client or beyond the high-water mark is dropped
+def send_ack_replies(acks, ack_socks, log):
+    for route, reply in acks.drain():
+        sock_index, identity = route
         try:
-            result = TopotestResult().from_json(json_obj)
+            ack_socks[sock_index].send_multipart(
+                [identity, json.dumps(reply).encode()], zmq.NOBLOCK
+            )
         except:
-            results_invalid += 1
-            continue
-        if result is None:
-            results_invalid += 1
-            continue
-
-        # check integrity of converted object
-        if result.check():
-            results_valid += 1
-            agent = result.host
-
-            # insert result into database
+            log.warn("failed to send ZeroMQ acknowledgement")
+
+
+# parse and authenticate a received query message and send the response
+def process_query_message(frame, sock, conn, tables, conf, log, timers=None):
+    response = answer_query_message(frame, conn, tables, conf, log, timers)
+    try:
+        sock.send_json(response)
+    except:
+        log.warn("failed to send ZeroMQ query response")
+        return
+    log_query_response(response, log)
+
+
+# parse and authenticate a received query message and run the query, returns
+# the response, the query duration is added to timers if given
+def answer_query_message(frame, conn, tables, conf, log, timers=None):
+    start = time.perf_counter()
+    msg = Message()
+    try:
+        msg.from_json(json.loads(frame))
+        if msg.check_auth(conf.auth_key):
+            response = run_query(
+                conn,
+                tables,
+                msg.payload,
+                conf.query_page_size,
+                conf.query_max_page_size,
+            )
+        else:
+            log.warn("failed to authenticate ZeroMQ query message")
+            response = {"status": "error", "error": "authentication failed"}
+    except:
+        log.warn("failed to process ZeroMQ query message")
+        response = {"status": "error", "error": "invalid query message"}
+    if timers is not None:
+        timers.add("query", time.perf_counter() - start)
+    return response
+
+
+def log_query_response(response, log):
+    if response["status"] == "ok":
+        log.info(
+            "answered query {} with {} rows".format(
+                response["query"], len(response["rows"])
+            )
+        )
+
+
+# asyncio server loop, every socket is served by its own task and the replies
+# to acknowledged messages by another, blocking ingest and query calls run in
+# executor threads, the loop runs until SIGINT or SIGTERM is received
+async def serve_asyncio(
+    sockets, ingest_socks, ack_socks, query_socks, pool, writer, acks, query, conf, log
+):
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+
+    # loop signal handlers, the tasks are cancelled between two messages
+    def signal_handler(name):
+        log.info("received signal {}".format(name))
+        conf.run = False
+        stop.set()
+
+    loop.add_signal_handler(signal.SIGINT, signal_handler, "SIGINT")
+    loop.add_signal_handler(signal.SIGTERM, signal_handler, "SIGTERM")
+
+    # messages are ingested and queued for the database writer one at a time
+    # as in the poller loop, a full writer queue stops all ingest tasks, the
+    # query connection is only used by the query thread
+    ingest_executor = ThreadPoolExecutor(max_workers=1)
+    query_executor = ThreadPoolExecutor(max_workers=1)
+
+    # asyncio sockets sharing the sockets bound by main()
+    shadows = {}
+    for sock, name, address in sockets:
+        shadows[sock] = zmq.asyncio.Socket.shadow(sock.underlying)
+
+    async def ingest_task(sock, name):
+        while True:
             try:
-                result.insert_into(conn, conf.results_table)
+                frames = await shadows[sock].recv_multipart()
+            except asyncio.CancelledError:
+                raise
             except:
-                log.err(
-                    "failed to insert results into table {} in database {}".format(
-                        conf.results_table, conf.sqlite3_db
-                    )
-                )
+                log.warn("failed to receive ZeroMQ message on {} socket".format(name))
+                continue
+            route = None
+            if sock in ack_socks:
+                # the ROUTER socket prepends the identity of the client
+                route = [ack_socks.index(sock), frames[0]]
+                frames = frames[1:]
+            await loop.run_in_executor(
+                ingest_executor,
+                process_received_message,
+                frames,
+                pool,
+                writer,
+                conf,
+                log,
+                route,
+            )
+
+    async def query_task(sock, name):
+        conn, tables = query
+        while True:
+            try:
+                frames = await shadows[sock].recv_multipart()
+            except asyncio.CancelledError:
+                raise
+            except:
+                log.warn("failed to receive ZeroMQ message on {} socket".format(name))
+                continue
+            response = await loop.run_in_executor(
+                query_executor,
+                answer_query_message,
+                frames[0],
+                conn,
+                tables,
+                conf,
+                log,
+                writer.timers,
+            )
+            try:
+                await shadows[sock].send_json(response)
+            except asyncio.CancelledError:
+                raise
+            except:
+                log.warn("failed to send ZeroMQ query response")
+                continue
+            log_query_response(response, log)
+
+    # the ack queue pipe wakes up the task sending the replies
+    async def ack_task():
+        ready = asyncio.Event()
+        loop.add_reader(acks.fileno(), ready.set)
+        try:
+            while True:
+                await ready.wait()
+                ready.clear()
+                for route, reply in acks.drain():
+                    sock_index, identity = route
+                    try:
+                        await shadows[ack_socks[sock_index]].send_multipart(
+                            [identity, json.dumps(reply).encode()]
+                        )
+                    except asyncio.CancelledError:
+                        raise
+                    except:
+                        log.warn("failed to send ZeroMQ acknowledgement")
+        finally:
+            loop.remove_reader(acks.fileno())
+
+    # discard chunked uploads abandoned by their clients while no messages
+    # arrive
+    async def housekeeping_task():
+        while True:
+            await asyncio.sleep(housekeeping_interval(conf))
+            writer.expire_uploads()
+
+    tasks = []
+    for sock, name, address in sockets:
+        if sock in query_socks:
+            tasks.append(asyncio.create_task(query_task(sock, name)))
         else:
-            results_invalid += 1
+            tasks.append(asyncio.create_task(ingest_task(sock, name)))
+    if acks is not None:
+        tasks.append(asyncio.create_task(ack_task()))
+    tasks.append(asyncio.create_task(housekeeping_task()))
+    log.info("started {} asyncio server tasks".format(len(tasks)))
 
-    if results_valid > 0:
-        log.info(
-            "received {} test results ({} valid, {} invalid) from agent {}".format(
-                results_total, results_valid, results_invalid, agent
+    # wait for a termination signal or a failed task
+    stopped = asyncio.create_task(stop.wait())
+    await asyncio.wait(tasks + [stopped], return_when=asyncio.FIRST_COMPLETED)
+    for task in tasks + [stopped]:
+        task.cancel()
+    for task in tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except:
+            log.err("asyncio server task failed")
+
+    # wait for the message being ingested before the writer is stopped
+    ingest_executor.shutdown()
+    query_executor.shutdown()
+    loop.remove_signal_handler(signal.SIGINT)
+    loop.remove_signal_handler(signal.SIGTERM)
+
+
+# connect to the results database, apply the storage profile and create or
+# update the results tables, returns the connection and its journal mode
+def open_database(conf, log):
+    # connect to sqlite3 db
+    try:
+        conn = sqlite3.connect(conf.sqlite3_db, check_same_thread=False)
+    except:
+        log.abort("failed to connect to database {}".format(conf.sqlite3_db))
+
+    # apply the storage profile, automatic checkpoints of the writer connection
+    # are replaced by the checkpoint thread
+    try:
+        journal_mode = configure_connection(
+            conn, conf, autocheckpoint=conf.db_checkpoint_interval_ms == 0
+        )
+    except:
+        conn.close()
+        log.abort("failed to configure database {}".format(conf.sqlite3_db))
+    if journal_mode != conf.db_journal_mode:
+        log.warn(
+            "database {} uses journal mode {} instead of {}".format(
+                conf.sqlite3_db, journal_mode, conf.db_journal_mode
             )
         )
+    log.info(
+        "database {} uses journal mode {} and synchronous {}".format(
+            conf.sqlite3_db, journal_mode, conf.db_synchronous
+        )
+    )
+
+    # check the results schema version, create results tables if they do not
+    # exist
+    try:
+        schema_version = results_schema_version(conn, conf.results_table)
+    except:
+        log.abort(
+            "unable to query if table {} exists in database {}".format(
+                conf.results_table, conf.sqlite3_db
+            )
+        )
+    if schema_version == 0:
+        try:
+            create_results_tables(conn, conf.results_table)
+            log.info(
+                "created table {} in database {}".format(
+                    conf.results_table, conf.sqlite3_db
+                )
+            )
+        except:
+            conn.close()
+            log.abort(
+                "failed to create table {} in database {}".format(
+                    conf.results_table, conf.sqlite3_db
+                )
+            )
+    elif schema_version == TOPOSTAT_DB_SCHEMA_VERSION:
+        try:
+            stats_exist = table_exists(conn, conf.results_table + "_stats")
+            create_results_tables(conn, conf.results_table)
+            if not stats_exist:
+                log.info(
+                    "building aggregates of table {} in database {}".format(
+                        conf.results_table, conf.sqlite3_db
+                    )
+                )
+                rebuild_results_stats(conn, conf.results_table)
+        except sqlite3.IntegrityError:
+            conn.close()
+            log.abort(
+                "table {} in database {} contains duplicate results, remove them "
+                "with dbtool.py dedup".format(conf.results_table, conf.sqlite3_db)
+            )
+        except:
+            conn.close()
+            log.abort(
+                "failed to update tables of table {} in database {}".format(
+                    conf.results_table, conf.sqlite3_db
+                )
+            )
     else:
-        log.info(
-            "received {} test results ({} valid, {} invalid)".format(
-                results_total, results_valid, results_invalid
+        conn.close()
+        log.abort(
+            "table {} in database {} uses schema version {}, migrate it with dbtool.py migrate".format(
+                conf.results_table, conf.sqlite3_db, schema_version
             )
         )
+    log.info(
+        "using table {} in database {}".format(conf.results_table, conf.sqlite3_db)
+    )
+    return conn, journal_mode
+
+
+# close the results database connection or the open partitions
+def close_database(conn, partitions):
+    if partitions is not None:
+        partitions.close()
+    else:
+        conn.close()
 
 
 def parse_cli_arguments(conf, log):
@@ -110,9 +498,16 @@ def parse_cli_arguments(conf, log):
     )
     ap.add_argument("-a4", "--ipv4-address", help="server ipv4 address")
     ap.add_argument("-p4", "--ipv4-port", help="server ipv4 tcp port")
+    ap.add_argument(
+        "-nq", "--no-query", help="no query service sockets", action="store_true"
+    )
+    ap.add_argument(
+        "-na", "--no-ack", help="no acknowledgement sockets", action="store_true"
+    )
     ap.add_argument("-k", "--key", help="authentication key")
     ap.add_argument("-b", "--database", help="sqlite3 database file")
     ap.add_argument("-l", "--log", help="log file")
+    ap.add_argument("--profile", help="profile the main loop into file")
 
     try:
         args = vars(ap.parse_args())
@@ -126,9 +521,12 @@ def parse_cli_arguments(conf, log):
             "server_no_ipv4": "no_ipv4",
             "server_address_ipv4": "ipv4_address",
             "server_port_ipv4": "ipv4_port",
+            "server_no_query": "no_query",
+            "server_no_ack": "no_ack",
             "auth_key": "key",
             "sqlite3_db": "database",
             "log_file": "log",
+            "profile_file": "profile",
         }
         for conf_var, arg_val in conf_to_args.items():
             if not conf_var in conf.config_no_overwrite:
@@ -191,25 +589,11 @@ def main():
     # initialize logger
     log = Logger(conf)
 
-    # Custom exception to terminate server
-    class TerminationSignalReceived(Exception):
-        def __init__(self, sig):
-            self.sig = sig
-
-        def __str__(self):
-            return repr(self.sig)
-
-    # SIGINT signal handler
-    def signal_handler_sigint(sig, frame):
-        log.info("received signal SIGINT")
-        conf.run = False
-        raise (TerminationSignalReceived("SIGINT"))
-
-    # SIGTERM signal handler
-    def signal_handler_sigterm(sig, frame):
-        log.info("received signal SIGTERM")
+    # SIGINT and SIGTERM signal handler, the main loop stops between two
+    # messages, the signal wake up pipe interrupts the poller
+    def signal_handler(sig, frame):
+        log.info("received signal {}".format(signal.Signals(sig).name))
         conf.run = False
-        raise (TerminationSignalReceived("SIGTERM"))
 
     # log start entry
     log.info("started {}".format(conf.progname_long))
@@ -240,6 +624,103 @@ def main():
     else:
         log.info("passed configuration check")
 
+    # make sure database writer values are in a valid range
+    if not check.is_int_min(conf.db_batch_size, 1):
+        log.debug("conf.db_batch_size = {}".format(conf.db_batch_size))
+        log.abort("database insert batch size value is invalid")
+    if not check.is_int_min(conf.db_flush_interval_ms, 0):
+        log.debug("conf.db_flush_interval_ms = {}".format(conf.db_flush_interval_ms))
+        log.abort("database flush interval value is invalid")
+    if not check.is_int_min(conf.db_queue_size, 1):
+        log.debug("conf.db_queue_size = {}".format(conf.db_queue_size))
+        log.abort("database writer queue size value is invalid")
+
+    # make sure the database storage profile values are valid
+    conf.db_journal_mode = conf.db_journal_mode.lower()
+    if not conf.db_journal_mode in TOPOSTAT_DB_JOURNAL_MODES:
+        log.debug("conf.db_journal_mode = {}".format(conf.db_journal_mode))
+        log.abort("database journal mode value is invalid")
+    conf.db_synchronous = conf.db_synchronous.lower()
+    if not conf.db_synchronous in TOPOSTAT_DB_SYNCHRONOUS:
+        log.debug("conf.db_synchronous = {}".format(conf.db_synchronous))
+        log.abort("database synchronous value is invalid")
+    for var in [
+        "db_cache_size_kib",
+        "db_mmap_size_mib",
+        "db_busy_timeout_ms",
+        "db_checkpoint_interval_ms",
+    ]:
+        if not check.is_int_min(conf.__dict__[var], 0):
+            log.debug("conf.{} = {}".format(var, conf.__dict__[var]))
+            log.abort("database {} value is invalid".format(var[3:]))
+
+    # make sure the duplicate results values are valid
+    conf.db_duplicates = conf.db_duplicates.lower()
+    if not conf.db_duplicates in TOPOSTAT_DB_DUPLICATES:
+        log.debug("conf.db_duplicates = {}".format(conf.db_duplicates))
+        log.abort("database duplicates value is invalid")
+    if not check.is_int_min(conf.db_dedup_filter_capacity, 1):
+        log.debug(
+            "conf.db_dedup_filter_capacity = {}".format(conf.db_dedup_filter_capacity)
+        )
+        log.abort("database dedup filter capacity value is invalid")
+    if not check.is_int_min(conf.db_staging_timeout_s, 1):
+        log.debug("conf.db_staging_timeout_s = {}".format(conf.db_staging_timeout_s))
+        log.abort("database staging timeout value is invalid")
+
+    # make sure the database partition values are valid
+    conf.db_partition = conf.db_partition.lower()
+    if not conf.db_partition in TOPOSTAT_DB_PARTITION_PERIODS:
+        log.debug("conf.db_partition = {}".format(conf.db_partition))
+        log.abort("database partition period value is invalid")
+    if not check.is_int_min(conf.db_partition_retention, 0):
+        log.debug(
+            "conf.db_partition_retention = {}".format(conf.db_partition_retention)
+        )
+        log.abort("database partition retention value is invalid")
+    if conf.db_partition_archive_dir and not os.path.isdir(
+        conf.db_partition_archive_dir
+    ):
+        log.abort(
+            "database partition archive directory {} does not exist".format(
+                conf.db_partition_archive_dir
+            )
+        )
+
+    # make sure the metrics port is valid, 0 disables the metrics http server
+    if not check.is_int_range(conf.metrics_port, 0, 65535):
+        log.debug("conf.metrics_port = {}".format(conf.metrics_port))
+        log.abort("metrics port value is invalid")
+
+    # make sure the stage timers interval is a positive non-zero value
+    if not check.is_int_min(conf.stage_timers_interval_s, 1):
+        log.debug(
+            "conf.stage_timers_interval_s = {}".format(conf.stage_timers_interval_s)
+        )
+        log.abort("stage timers interval value is invalid")
+
+    # make sure the server loop is known
+    conf.server_loop = conf.server_loop.lower()
+    if not conf.server_loop in TOPOSTAT_SERVER_LOOPS:
+        log.debug("conf.server_loop = {}".format(conf.server_loop))
+        log.abort("server loop value is invalid")
+
+    # make sure number of ingest worker processes is not negative
+    if not check.is_int_min(conf.ingest_workers, 0):
+        log.debug("conf.ingest_workers = {}".format(conf.ingest_workers))
+        log.abort("number of ingest worker processes is invalid")
+
+    # make sure query page sizes are positive non-zero values
+    if not check.is_int_range(conf.query_page_size, 1, conf.query_max_page_size):
+        log.debug("conf.query_page_size = {}".format(conf.query_page_size))
+        log.abort("query page size value is invalid")
+
+    # make sure the socket high-water marks and linger time are not negative
+    for var in ["server_rcvhwm", "server_sndhwm", "server_linger_ms"]:
+        if not check.is_int_min(conf.__dict__[var], 0):
+            log.debug("conf.{} = {}".format(var, conf.__dict__[var]))
+            log.abort("server socket {} value is invalid".format(var[7:]))
+
     # compose ZeroMQ server socket address strings
     if conf.server_no_ipv4 and conf.server_no_ipv6:
         log.abort("neither using ipv4 or ipv6")
@@ -258,150 +739,374 @@ def main():
             log.debug(
                 "conf.socket_address_ipv6_str = {}".format(conf.socket_address_ipv6_str)
             )
+        if not conf.server_no_query and not conf.server_no_ipv4:
+            conf.socket_address_query_ipv4_str = "tcp://{}:{}".format(
+                conf.server_address_ipv4, conf.server_query_port_ipv4
+            )
+            log.debug(
+                "conf.socket_address_query_ipv4_str = {}".format(
+                    conf.socket_address_query_ipv4_str
+                )
+            )
+        if not conf.server_no_query and not conf.server_no_ipv6:
+            conf.socket_address_query_ipv6_str = "tcp://[{}]:{}".format(
+                conf.server_address_ipv6, conf.server_query_port_ipv6
+            )
+            log.debug(
+                "conf.socket_address_query_ipv6_str = {}".format(
+                    conf.socket_address_query_ipv6_str
+                )
+            )
+        if not conf.server_no_ack and not conf.server_no_ipv4:
+            conf.socket_address_ack_ipv4_str = "tcp://{}:{}".format(
+                conf.server_address_ipv4, conf.server_ack_port_ipv4
+            )
+            log.debug(
+                "conf.socket_address_ack_ipv4_str = {}".format(
+                    conf.socket_address_ack_ipv4_str
+                )
+            )
+        if not conf.server_no_ack and not conf.server_no_ipv6:
+            conf.socket_address_ack_ipv6_str = "tcp://[{}]:{}".format(
+                conf.server_address_ipv6, conf.server_ack_port_ipv6
+            )
+            log.debug(
+                "conf.socket_address_ack_ipv6_str = {}".format(
+                    conf.socket_address_ack_ipv6_str
+                )
+            )
 
-    # connect to sqlite3 db
-    try:
-        conn = sqlite3.connect(conf.sqlite3_db)
-        db = conn.cursor()
-    except:
-        log.abort("failed to connect to database {}".format(conf.sqlite3_db))
-
-    # create results table if it does not exist
-    try:
-        db.execute(
-            "SELECT count(name) FROM sqlite_master WHERE type='table' AND name='{}'".format(
-                conf.results_table
+    # open the results database, or the partitions of a partitioned database
+    conn = None
+    partitions = None
+    journal_mode = None
+    if conf.db_partition == "none":
+        conn, journal_mode = open_database(conf, log)
+    else:
+        partitions = PartitionSet(conf, log)
+        try:
+            partitions.expire()
+        except:
+            log.abort(
+                "failed to expire partitions of database {}".format(conf.sqlite3_db)
             )
-        )
-    except:
-        log.abort(
-            "unable to query if table {} exists in database {}".format(
-                conf.results_table, conf.sqlite3_db
+        log.info(
+            "using table {} in database {} partitioned per {}".format(
+                conf.results_table, conf.sqlite3_db, conf.db_partition
             )
         )
-    if db.fetchone()[0] == 0:
+
+    # open a separate read-only connection for queries, partitions are attached
+    # to an in-memory database as queries need them
+    if not conf.server_no_query:
         try:
-            TopotestResult().create_table(conn, conf.results_table)
-            log.info(
-                "created table {} in database {}".format(
-                    conf.results_table, conf.sqlite3_db
+            if partitions is None:
+                query_conn = sqlite3.connect(conf.sqlite3_db, check_same_thread=False)
+                configure_connection(query_conn, conf)
+                query_tables = lambda since, until: [conf.results_table]
+            else:
+                query_conn = sqlite3.connect(
+                    ":memory:", uri=True, check_same_thread=False
                 )
-            )
+                query_tables = PartitionReader(query_conn, conf).tables
+            query_conn.execute("PRAGMA query_only = ON")
         except:
-            conn.close()
+            close_database(conn, partitions)
             log.abort(
-                "failed to create table {} in database {}".format(
-                    conf.results_table, conf.sqlite3_db
-                )
+                "failed to open query connection to database {}".format(conf.sqlite3_db)
             )
-    log.info(
-        "using table {} in database {}".format(conf.results_table, conf.sqlite3_db)
-    )
 
-    # create ZeroMQ contexts and bind to sockets
+    # create ZeroMQ context and bind to sockets
+    context = zmq.Context()
+    poller = zmq.Poller()
+    ingest_socks = []
+    query_socks = []
+    ack_socks = []
+    binds = []
     if not conf.server_no_ipv6:
-        context_ipv6 = zmq.Context()
-        sock_ipv6 = context_ipv6.socket(zmq.PULL)
-        sock_ipv6.setsockopt(zmq.RCVTIMEO, conf.socket_recv_timeout_ms)
-        sock_ipv6.setsockopt(zmq.IPV6, True)
-        try:
-            sock_ipv6.bind(conf.socket_address_ipv6_str)
-            log.info(
-                "bound ZeroMQ PULL ipv6 socket to address {}".format(
-                    conf.socket_address_ipv6_str
-                )
+        binds.append(
+            [zmq.PULL, "PULL ipv6", conf.socket_address_ipv6_str, True, ingest_socks]
+        )
+        if not conf.server_no_ack:
+            binds.append(
+                [
+                    zmq.ROUTER,
+                    "ROUTER ipv6 ack",
+                    conf.socket_address_ack_ipv6_str,
+                    True,
+                    ack_socks,
+                ]
+            )
+        if not conf.server_no_query:
+            binds.append(
+                [
+                    zmq.REP,
+                    "REP ipv6 query",
+                    conf.socket_address_query_ipv6_str,
+                    True,
+                    query_socks,
+                ]
+            )
+    if not conf.server_no_ipv4:
+        binds.append(
+            [zmq.PULL, "PULL ipv4", conf.socket_address_ipv4_str, False, ingest_socks]
+        )
+        if not conf.server_no_ack:
+            binds.append(
+                [
+                    zmq.ROUTER,
+                    "ROUTER ipv4 ack",
+                    conf.socket_address_ack_ipv4_str,
+                    False,
+                    ack_socks,
+                ]
+            )
+        if not conf.server_no_query:
+            binds.append(
+                [
+                    zmq.REP,
+                    "REP ipv4 query",
+                    conf.socket_address_query_ipv4_str,
+                    False,
+                    query_socks,
+                ]
             )
+    sockets = []
+    for sock_type, name, address, ipv6, socks in binds:
+        sock = context.socket(sock_type)
+        sock.setsockopt(zmq.RCVHWM, conf.server_rcvhwm)
+        sock.setsockopt(zmq.SNDHWM, conf.server_sndhwm)
+        sock.setsockopt(zmq.LINGER, conf.server_linger_ms)
+        if ipv6:
+            sock.setsockopt(zmq.IPV6, True)
+        try:
+            sock.bind(address)
+            log.info("bound ZeroMQ {} socket to address {}".format(name, address))
         except:
-            conn.close()
+            close_database(conn, partitions)
             log.abort(
-                "failed to bind ZeroMQ PULL ipv6 socket to address {}".format(
-                    conf.socket_address_ipv6_str
-                )
+                "failed to bind ZeroMQ {} socket to address {}".format(name, address)
             )
-    if not conf.server_no_ipv4:
-        context_ipv4 = zmq.Context()
-        sock_ipv4 = context_ipv4.socket(zmq.PULL)
-        sock_ipv4.setsockopt(zmq.RCVTIMEO, conf.socket_recv_timeout_ms)
+        sockets.append([sock, name, address])
+        socks.append(sock)
+        poller.register(sock, zmq.POLLIN)
+
+    # start wal checkpoint thread, without it the writer connection falls back
+    # to automatic checkpoints
+    checkpointer = None
+    if journal_mode == "wal" and conf.db_checkpoint_interval_ms > 0:
+        checkpointer = DatabaseCheckpointer(conf, log)
+        try:
+            checkpointer.start()
+            log.info("started database checkpoint thread")
+        except:
+            checkpointer = None
+            conn.execute("PRAGMA wal_autocheckpoint = 1000")
+            log.warn("failed to start database checkpoint thread")
+
+    # replies to acknowledged messages are queued by the writer and ingest
+    # threads and sent by the main loop
+    acks = None
+    if ack_socks:
+        acks = AckQueue()
+        poller.register(acks.fileno(), zmq.POLLIN)
+
+    # start database writer thread, the connection is only used by the writer
+    # thread from here on
+    metrics = ServerMetrics()
+    timers = None
+    if conf.stage_timers:
+        timers = StageTimers(log, conf.stage_timers_interval_s)
+    writer = DatabaseWriter(conn, conf, log, partitions, acks, metrics, timers)
+    metrics.watch_writer(writer)
+    writer.start()
+    log.info("started database writer thread")
+
+    # start metrics http server
+    metrics_server = None
+    if conf.metrics_port > 0:
         try:
-            sock_ipv4.bind(conf.socket_address_ipv4_str)
+            metrics_server = MetricsServer(
+                conf.metrics_address, conf.metrics_port, metrics
+            )
+            metrics_server.start()
             log.info(
-                "bound ZeroMQ PULL ipv4 socket to address {}".format(
-                    conf.socket_address_ipv4_str
+                "serving metrics on http://{}:{}/metrics".format(
+                    conf.metrics_address, conf.metrics_port
                 )
             )
         except:
-            conn.close()
-            log.abort(
-                "failed to bind ZeroMQ PULL ipv4 socket to address {}".format(
-                    conf.socket_address_ipv4_str
+            metrics_server = None
+            log.err(
+                "failed to serve metrics on {} port {}".format(
+                    conf.metrics_address, conf.metrics_port
                 )
             )
 
-    # signal handling
-    signal.signal(signal.SIGINT, signal_handler_sigint)
-    signal.signal(signal.SIGTERM, signal_handler_sigterm)
+    # start ingest worker processes
+    pool = None
+    if conf.ingest_workers > 0:
+        pool = IngestPool(
+            conf,
+            lambda ingested, route, size: process_ingested_message(
+                ingested, writer, log, route, size
+            ),
+            timers,
+        )
+        try:
+            pool.start()
+        except:
+            writer.stop()
+            if checkpointer is not None:
+                checkpointer.stop()
+            close_database(conn, partitions)
+            for sock, name, address in sockets:
+                sock.close()
+            log.abort("failed to start ingest worker processes")
+        log.info("started {} ingest worker processes".format(conf.ingest_workers))
+
+    # profile the main loop, SIGUSR1 writes the statistics collected so far
+    profiler = None
+    if conf.profile_file:
+        profiler = LoopProfiler(conf.profile_file, log)
+        signal.signal(signal.SIGUSR1, lambda sig, frame: profiler.dump())
+        profiler.start()
+        log.info(
+            "profiling main loop, statistics are written to {} on SIGUSR1".format(
+                conf.profile_file
+            )
+        )
+
+    # asyncio main loop
+    if conf.server_loop == "asyncio":
+        query = None
+        if not conf.server_no_query:
+            query = [query_conn, query_tables]
+        asyncio.run(
+            serve_asyncio(
+                sockets,
+                ingest_socks,
+                ack_socks,
+                query_socks,
+                pool,
+                writer,
+                acks,
+                query,
+                conf,
+                log,
+            )
+        )
+        conf.run = False
+
+    # signal handling, every signal received writes to the wake up pipe
+    else:
+        wakeup_rfd, wakeup_wfd = os.pipe()
+        os.set_blocking(wakeup_rfd, False)
+        os.set_blocking(wakeup_wfd, False)
+        signal.set_wakeup_fd(wakeup_wfd)
+        poller.register(wakeup_rfd, zmq.POLLIN)
+        signal.signal(signal.SIGINT, signal_handler)
+        signal.signal(signal.SIGTERM, signal_handler)
 
-    # main loop, process incoming topotest results
+    # main loop, wait until at least one socket is readable and drain all ready
+    # sockets in turns before polling again, chunked uploads abandoned by their
+    # clients are discarded every housekeeping interval while no messages arrive
+    interval = housekeeping_interval(conf)
+    housekeeping = time.monotonic() + interval
     while conf.run:
-        # receive json object with test results
-        while conf.run:
-            if not conf.server_no_ipv6:
-                json_msg = None
-                try:
-                    json_msg = sock_ipv6.recv_json()
-                    break
-                except TerminationSignalReceived:
+        ready = dict(poller.poll(interval * 1000))
+        if time.monotonic() >= housekeeping:
+            writer.expire_uploads()
+            housekeeping = time.monotonic() + interval
+        while ready and conf.run:
+            for sock in list(ready):
+                if sock == wakeup_rfd:
+                    try:
+                        while os.read(wakeup_rfd, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    del ready[sock]
+                    continue
+                if acks is not None and sock == acks.fileno():
+                    send_ack_replies(acks, ack_socks, log)
+                    del ready[sock]
+                    continue
+                if not conf.run:
                     break
-                except:
-                    pass
-            if not conf.server_no_ipv4:
-                json_msg = None
                 try:
-                    json_msg = sock_ipv4.recv_json()
-                    break
-                except TerminationSignalReceived:
-                    break
+                    start = time.perf_counter()
+                    frames = sock.recv_multipart(zmq.NOBLOCK)
+                    if timers is not None:
+                        timers.add("recv", time.perf_counter() - start)
+                except zmq.Again:
+                    del ready[sock]
+                    continue
                 except:
-                    pass
+                    log.warn("failed to receive ZeroMQ message")
+                    del ready[sock]
+                    continue
+                if sock in query_socks:
+                    process_query_message(
+                        frames[0],
+                        sock,
+                        query_conn,
+                        query_tables,
+                        conf,
+                        log,
+                        timers,
+                    )
+                elif sock in ack_socks:
+                    # the ROUTER socket prepends the identity of the client
+                    route = [ack_socks.index(sock), frames[0]]
+                    process_received_message(frames[1:], pool, writer, conf, log, route)
+                else:
+                    process_received_message(frames, pool, writer, conf, log)
+    if conf.server_loop != "asyncio":
+        signal.set_wakeup_fd(-1)
+        os.close(wakeup_rfd)
+        os.close(wakeup_wfd)
 
-        if json_msg is None:
-            log.warn("failed to receive ZeroMQ message")
-            continue
+    # write the final profile statistics
+    if profiler is not None:
+        profiler.dump()
+        profiler.stop()
 
-        # parse received message
-        msg = Message()
-        try:
-            msg.from_json(json_msg)
-            if not msg.check_auth(conf.auth_key):
-                log.warn("failed to authenticate ZeroMQ message")
-                continue
-        except:
-            log.warn("failed to parse ZeroMQ message")
-            continue
+    # ingest pending messages and stop ingest worker processes
+    if pool is not None:
+        pool.stop()
+        log.info("stopped ingest worker processes")
 
-        # process received test results
-        process_received_results(msg.payload, conn, conf, log)
+    # write remaining queued results and stop database writer thread
+    writer.stop()
+    log.info("stopped database writer thread")
+    if timers is not None:
+        timers.report()
 
-    # closing sockets and terminating ZeroMQ contexts
-    if not conf.server_no_ipv6:
-        sock_ipv6.close()
-        context_ipv6.term()
-        log.info(
-            "closed ZeroMQ PULL ipv6 socket bound to address {}".format(
-                conf.socket_address_ipv6_str
-            )
-        )
-    if not conf.server_no_ipv4:
-        sock_ipv4.close()
-        context_ipv4.term()
-        log.info(
-            "closed ZeroMQ PULL ipv4 socket bound to address {}".format(
-                conf.socket_address_ipv4_str
-            )
-        )
+    # reply to the acknowledged messages written on shutdown, the replies are
+    # delivered within the linger time of the sockets
+    if acks is not None:
+        send_ack_replies(acks, ack_socks, log)
+        acks.close()
+
+    # closing sockets and terminating ZeroMQ context
+    for sock, name, address in sockets:
+        sock.close()
+        log.info("closed ZeroMQ {} socket bound to address {}".format(name, address))
+    context.term()
+
+    # stop metrics http server
+    if metrics_server is not None:
+        metrics_server.stop()
+        log.info("stopped metrics http server")
 
-    # closing database connection
-    conn.close()
+    # closing database connections
+    if not conf.server_no_query:
+        query_conn.close()
+    if checkpointer is not None:
+        checkpointer.stop()
+        log.info("stopped database checkpoint thread")
+    close_database(conn, partitions)
     log.info("closed connection to database {}".format(conf.sqlite3_db))
 
     # exit
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Bloom Filter Tests
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import sqlite3
+import unittest
+
+from lib.bloom import BloomFilter
+from lib.database import ResultStore, create_results_tables
+
+
+class BloomFilterTest(unittest.TestCase):
+    def test_added_keys_contained(self):
+        bloom = BloomFilter(1000)
+        keys = ["key-{}".format(i).encode() for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        for key in keys:
+            self.assertIn(key, bloom)
+        self.assertEqual(bloom.count, 1000)
+
+    def test_error_rate(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add("key-{}".format(i).encode())
+        false = sum("other-{}".format(i).encode() in bloom for i in range(10000))
+        self.assertLess(false, 300)
+
+    def test_zero_capacity(self):
+        bloom = BloomFilter(0)
+        self.assertEqual(bloom.capacity, 1)
+        self.assertNotIn(b"key", bloom)
+        bloom.add(b"key")
+        self.assertIn(b"key", bloom)
+
+
+class ResultStoreFilterTest(unittest.TestCase):
+    def test_empty_table_zero_capacity(self):
+        conn = sqlite3.connect(":memory:")
+        create_results_tables(conn, "testresults")
+        store = ResultStore(conn, "testresults", duplicates="ignore", filter_capacity=0)
+        self.assertIsNotNone(store.filter)
+        conn.close()
+
+
+# typed row of a test result in a build
+def row(name, result=0, build=1, duration=1.0):
+    return (name, result, duration, "agent", 1609849000, "PLAN", build, "JOB")
+
+
+class ResultStoreDuplicatesTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        create_results_tables(self.conn, "testresults")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def store(self, duplicates):
+        return ResultStore(self.conn, "testresults", duplicates=duplicates)
+
+    # stored results and durations by test name
+    def stored(self):
+        return self.conn.execute(
+            "SELECT t.name, r.result, r.duration FROM testresults r"
+            " JOIN testresults_tests t ON t.id = r.test_id ORDER BY r.id"
+        ).fetchall()
+
+    def test_ignore(self):
+        store = self.store("ignore")
+        self.assertEqual(store.insert_many([row("a", 0), row("b", 0)]), 0)
+        self.assertEqual(store.insert_many([row("a", 1), row("c", 0)]), 1)
+        self.assertEqual(self.stored(), [("a", 0, 1.0), ("b", 0, 1.0), ("c", 0, 1.0)])
+
+    def test_ignore_batch(self):
+        store = self.store("ignore")
+        self.assertEqual(store.insert_many([row("a", 0), row("a", 1)]), 1)
+        self.assertEqual(self.stored(), [("a", 0, 1.0)])
+
+    def test_replace(self):
+        store = self.store("replace")
+        store.insert_many([row("a", 0), row("b", 0)])
+        self.assertEqual(store.insert_many([row("a", 1, duration=2.0)]), 1)
+        self.assertEqual(self.stored(), [("b", 0, 1.0), ("a", 1, 2.0)])
+
+    def test_replace_batch(self):
+        store = self.store("replace")
+        self.assertEqual(store.insert_many([row("a", 0), row("a", 1)]), 1)
+        self.assertEqual(self.stored(), [("a", 1, 1.0)])
+
+    # results of another build or job are not duplicates
+    def test_other_key(self):
+        store = self.store("ignore")
+        store.insert_many([row("a", 0, build=1)])
+        other = ("a", 0, 1.0, "agent", 1609849000, "PLAN", 1, "OTHER")
+        self.assertEqual(store.insert_many([row("a", 0, build=2), other]), 0)
+        self.assertEqual(len(self.stored()), 3)
+
+    # the filter of a new store is seeded with the stored rows
+    def test_seeded_filter(self):
+        self.store(None).insert_many([row("a", 0), row("b", 0)])
+        store = self.store("ignore")
+        self.assertEqual(store.filter.count, 2)
+        self.assertEqual(store.insert_many([row("a", 1)]), 1)
+        self.assertEqual(len(self.stored()), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Client Tests
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import os
+import sys
+import tempfile
+import unittest
+import subprocess
+
+from tests.test_server import TEST_AUTH_KEY, free_port
+
+
+class ClientTestCase(unittest.TestCase):
+    """
+    Runs the client with the example junit xml file against a loopback port
+    without a server, client_options are added to the client section.
+    """
+
+    client_options = {}
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.log_file = os.path.join(self.directory.name, "client.log")
+        self.config = os.path.join(self.directory.name, "topostat.conf")
+        self.port = free_port()
+        self.ack_port = free_port()
+        options = {
+            "log_file": self.log_file,
+            "server_address": "127.0.0.1",
+            "server_port": self.port,
+            "server_ack_port": self.ack_port,
+            "connection_timeout": 2,
+            "auth_key": TEST_AUTH_KEY,
+            "junit_xml": os.path.join("examples", "junit.xml"),
+        }
+        options.update(self.client_options)
+        with open(self.config, "w") as f:
+            f.write("[client]\n")
+            for var, val in options.items():
+                f.write("{} = {}\n".format(var, val))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # run the client, returns the completed process
+    def run_client(self, *args):
+        env = dict(os.environ)
+        env.update(
+            {
+                "bamboo_planKey": "PLAN",
+                "bamboo_buildNumber": "1",
+                "bamboo_shortJobName": "JOB",
+            }
+        )
+        return subprocess.run(
+            [sys.executable, "client.py", "-c", self.config] + list(args),
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=60,
+            universal_newlines=True,
+        )
+
+    def log(self):
+        with open(self.log_file) as f:
+            return f.read()
+
+
+class ServerDownAckTest(ClientTestCase):
+    client_options = {"delivery": "ack"}
+
+    def test_fails(self):
+        proc = self.run_client()
+        self.assertNotEqual(proc.returncode, 0)
+        self.assertNotIn("sent", proc.stdout)
+        self.assertIn("no reply from server", self.log())
+        self.assertIn("to server port {}".format(self.ack_port), self.log())
+
+
+class ServerDownPushTest(ClientTestCase):
+    # messages are kept longer than the upload watchdog allows
+    client_options = {"delivery": "push", "socket_linger_ms": 100}
+
+    def test_fails(self):
+        proc = self.run_client()
+        self.assertNotEqual(proc.returncode, 0)
+        self.assertNotIn("sent", proc.stdout)
+        self.assertIn("upload watchdog timer expired", self.log())
+        self.assertIn("to server port {}".format(self.port), self.log())
+
+
+class ServerDownPushSpoolTest(ClientTestCase):
+    client_options = {"delivery": "push"}
+
+    def setUp(self):
+        super().setUp()
+        self.spool_dir = os.path.join(self.directory.name, "spool")
+        with open(self.config, "a") as f:
+            f.write("spool_dir = {}\n".format(self.spool_dir))
+
+    def spooled(self):
+        return [name for name in os.listdir(self.spool_dir) if name[0] != "."]
+
+    # resent uploads are not delivered and stay in the spool
+    def test_keeps_resent_uploads(self):
+        self.run_client()
+        first = self.spooled()
+        self.assertEqual(len(first), 1)
+        proc = self.run_client()
+        self.assertNotEqual(proc.returncode, 0)
+        self.assertIn("queued 2 spooled uploads", self.log())
+        spooled = self.spooled()
+        self.assertEqual(len(spooled), 2)
+        self.assertIn(first[0], spooled)
+
+    # the upload is spooled before a flush blocking at the high water mark
+    def test_blocked_flush_keeps_upload(self):
+        with open(self.config, "a") as f:
+            f.write("socket_sndhwm = 1\n")
+        for i in range(3):
+            proc = self.run_client()
+            self.assertNotEqual(proc.returncode, 0)
+            self.assertEqual(len(self.spooled()), i + 1)
+
+    def test_flush_keeps_resent_uploads(self):
+        self.run_client()
+        first = self.spooled()
+        proc = self.run_client("--flush-spool")
+        self.assertNotEqual(proc.returncode, 0)
+        self.assertEqual(self.spooled(), first)
+
+
+if __name__ == "__main__":
+    unittest.main()
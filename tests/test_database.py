@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Results Database Tests
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import random
+import sqlite3
+import unittest
+
+from lib.topostat import TOPOSTAT_RESULTS
+from lib.database import ResultStore, create_results_tables
+
+
+# aggregates of the results table per test and plan as the stats table keeps
+# them, the last result, build and failed build are those of the newest rows
+STATS_SQL = (
+    "SELECT test_id, plan_id"
+    + "".join(
+        ", sum(result = {}) AS {}".format(i, val)
+        for i, val in enumerate(TOPOSTAT_RESULTS)
+    )
+    + ", round(sum(duration), 6), round(avg(duration), 6)"
+    + ", (SELECT result FROM testresults l WHERE l.test_id = r.test_id"
+    + " AND l.plan_id = r.plan_id ORDER BY l.id DESC LIMIT 1)"
+    + ", (SELECT build FROM testresults l WHERE l.test_id = r.test_id"
+    + " AND l.plan_id = r.plan_id ORDER BY l.id DESC LIMIT 1)"
+    + ", (SELECT build FROM testresults l WHERE l.test_id = r.test_id"
+    + " AND l.plan_id = r.plan_id AND l.result = {}".format(
+        TOPOSTAT_RESULTS.index("failed")
+    )
+    + " ORDER BY l.id DESC LIMIT 1)"
+    + " FROM testresults r GROUP BY test_id, plan_id ORDER BY test_id, plan_id"
+)
+
+
+class StatsTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        create_results_tables(self.conn, "testresults")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def stats(self):
+        return self.conn.execute(
+            "SELECT test_id, plan_id"
+            + "".join(", " + val for val in TOPOSTAT_RESULTS)
+            + ", round(total_duration, 6), round(mean_duration, 6), last_result"
+            + ", last_build, last_failure_build FROM testresults_stats"
+            + " ORDER BY test_id, plan_id"
+        ).fetchall()
+
+    # batches of random results of a few tests, plans and builds, a batch
+    # holds results of one build as a client upload does
+    def batches(self, count):
+        rnd = random.Random(0)
+        for i in range(count):
+            build = rnd.randint(1, 4)
+            yield [
+                (
+                    rnd.choice(["a", "b", "c"]),
+                    rnd.randrange(len(TOPOSTAT_RESULTS)),
+                    round(rnd.uniform(0, 10), 3),
+                    "agent",
+                    1609849000,
+                    rnd.choice(["P1", "P2"]),
+                    build,
+                    "JOB",
+                )
+                for j in range(rnd.randint(1, 6))
+            ]
+
+    # the aggregates always match the stored results
+    def check_stats(self, duplicates):
+        store = ResultStore(self.conn, "testresults", duplicates=duplicates)
+        for rows in self.batches(200):
+            store.insert_many(rows)
+            self.assertEqual(self.stats(), self.conn.execute(STATS_SQL).fetchall())
+
+    def test_stats_ignore(self):
+        self.check_stats("ignore")
+
+    def test_stats_replace(self):
+        self.check_stats("replace")
+
+    # a replaced failure is no longer the last failed build
+    def test_replaced_failure(self):
+        store = ResultStore(self.conn, "testresults", duplicates="replace")
+        failed = TOPOSTAT_RESULTS.index("failed")
+        passed = TOPOSTAT_RESULTS.index("passed")
+        store.insert_many([("a", failed, 1.0, "agent", 0, "P", 1, "J")])
+        store.insert_many([("a", failed, 2.0, "agent", 0, "P", 2, "J")])
+        store.insert_many([("a", passed, 4.0, "agent", 0, "P", 2, "J")])
+        stats = self.stats()[0]
+        self.assertEqual(stats[2:5], (1, 1, 0))
+        self.assertEqual(stats[5:], (5.0, 2.5, passed, 2, 1))
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Database Tool Tests
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import os
+import sys
+import sqlite3
+import tempfile
+import unittest
+import subprocess
+
+
+# version 1 results table storing every value as text
+V1_TABLE = (
+    "CREATE TABLE testresults ("
+    + "id INTEGER PRIMARY KEY AUTOINCREMENT"
+    + ", name text, result text, time text, host text, timestamp text"
+    + ", plan text, build text, job text"
+    + ")"
+)
+
+
+class DbtoolTestCase(unittest.TestCase):
+    """
+    Runs the database tool on a database in a temporary directory.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.directory.name, "topotests.db")
+        self.log_file = os.path.join(self.directory.name, "dbtool.log")
+        self.config = os.path.join(self.directory.name, "topostat.conf")
+        with open(self.config, "w") as f:
+            f.write("[server]\n")
+            f.write("log_file = {}\n".format(self.log_file))
+            f.write("sqlite3_db = {}\n".format(self.db))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_dbtool(self, *args):
+        return subprocess.run(
+            [sys.executable, "dbtool.py", "-c", self.config] + list(args),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=60,
+            universal_newlines=True,
+        )
+
+    def log(self):
+        with open(self.log_file) as f:
+            return f.read()
+
+
+class MigrateTest(DbtoolTestCase):
+    def test_builds(self):
+        conn = sqlite3.connect(self.db)
+        conn.execute(V1_TABLE)
+        conn.executemany(
+            "INSERT INTO testresults ("
+            + "name, result, time, host, timestamp, plan, build, job"
+            + ") VALUES (?, 'passed', '1.5', 'agent', '2021-01-05 12:16:30.245931'"
+            + ", 'PLAN', ?, 'JOB')",
+            [
+                ["bgp.test_a", "4711"],
+                ["bgp.test_b", "12-rerun"],
+                ["bgp.test_c", "4712"],
+            ],
+        )
+        conn.commit()
+        conn.close()
+        proc = self.run_dbtool("migrate")
+        self.assertEqual(proc.returncode, 0, proc.stdout)
+        self.assertIn("migrated 2 results (1 invalid results skipped)", self.log())
+        conn = sqlite3.connect(self.db)
+        builds = conn.execute(
+            "SELECT typeof(build), build FROM testresults ORDER BY id"
+        ).fetchall()
+        self.assertEqual(builds, [("integer", 4711), ("integer", 4712)])
+        stats = conn.execute("SELECT typeof(last_build) FROM testresults_stats")
+        self.assertEqual(set(stats.fetchall()), {("integer",)})
+        conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Columnar Export Tests
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import os
+import sys
+import sqlite3
+import tempfile
+import unittest
+import subprocess
+import tracemalloc
+
+from lib.topostat import TopotestResult
+from lib.database import ResultStore, create_results_tables
+from lib.export import EXPORT_COLUMNS, NpzExport, numpy
+
+
+DICTIONARIES = {
+    "result": ["passed", "failed", "skipped"],
+    "name": ["bgp.test_a", "bgp.test_b"],
+    "host": ["agent-1"],
+    "plan": ["FRR-FRR"],
+    "job": ["TOPO3U20AMD64"],
+}
+
+
+# columns of a chunk of rows results starting at id first
+def chunk(first, rows):
+    ids = range(first, first + rows)
+    return {
+        "id": list(ids),
+        "name": [i % 2 for i in ids],
+        "result": [i % 3 for i in ids],
+        "time": [i * 0.5 for i in ids],
+        "host": [0] * rows,
+        "timestamp": [1600000000 + i for i in ids],
+        "plan": [0] * rows,
+        "build": [4711] * rows,
+        "job": [0] * rows,
+    }
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class NpzExportTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "export.npz")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # export chunks of rows results, returns the peak memory allocated while
+    # the chunks were written
+    def export(self, chunks, rows):
+        export = NpzExport(self.path, DICTIONARIES)
+        tracemalloc.start()
+        try:
+            for i in range(chunks):
+                export.write(chunk(i * rows, rows))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        export.close()
+        return peak
+
+    def test_columns(self):
+        self.export(3, 100)
+        with numpy.load(self.path) as npz:
+            for col in EXPORT_COLUMNS:
+                self.assertEqual(len(npz[col]), 300)
+            self.assertEqual(npz["id"].tolist(), list(range(300)))
+            self.assertEqual(npz["time"].dtype, numpy.float64)
+            self.assertEqual(npz["result"].dtype, numpy.int8)
+            self.assertEqual(npz["name"].dtype, numpy.int32)
+            self.assertEqual(npz["timestamp"][1], numpy.datetime64(1600000001, "s"))
+            self.assertEqual(npz["name_dictionary"].tolist(), DICTIONARIES["name"])
+            self.assertEqual(npz["result"][:4].tolist(), [0, 1, 2, 0])
+
+    def test_empty(self):
+        self.export(0, 100)
+        with numpy.load(self.path) as npz:
+            self.assertEqual(npz["id"].shape, (0,))
+            self.assertEqual(npz["timestamp"].dtype, numpy.dtype("datetime64[s]"))
+
+    def test_memory_bounded(self):
+        # memory does not grow with the number of exported chunks
+        few = self.export(2, 10000)
+        many = self.export(40, 10000)
+        self.assertLess(many, few * 1.5)
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class ExportToolTest(unittest.TestCase):
+    """
+    Runs the export tool on a database in a temporary directory, the
+    configuration asks for journal mode wal.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.directory.name, "topotests.db")
+        self.output = os.path.join(self.directory.name, "export.npz")
+        self.log_file = os.path.join(self.directory.name, "export.log")
+        self.config = os.path.join(self.directory.name, "topostat.conf")
+        with open(self.config, "w") as f:
+            f.write("[server]\n")
+            f.write("log_file = {}\n".format(self.log_file))
+            f.write("sqlite3_db = {}\n".format(self.db))
+            f.write("db_journal_mode = wal\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # store a result of every build
+    def store(self, builds, journal_mode="delete"):
+        conn = sqlite3.connect(self.db)
+        conn.execute("PRAGMA journal_mode = {}".format(journal_mode))
+        create_results_tables(conn, "testresults")
+        store = ResultStore(conn, "testresults")
+        store.insert_many(
+            [
+                TopotestResult(
+                    "bgp.test_a",
+                    "passed",
+                    "1.5",
+                    "agent-1",
+                    "2021-01-05 12:16:30.245931",
+                    "FRR-FRR",
+                    build,
+                    "TOPO3U20AMD64",
+                ).to_row()
+                for build in builds
+            ]
+        )
+        conn.commit()
+        conn.close()
+
+    def run_export(self):
+        return subprocess.run(
+            [sys.executable, "export.py", "-c", self.config, "-f", "npz", self.output],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            timeout=60,
+            universal_newlines=True,
+        )
+
+    # the read-only export connection does not switch the journal mode
+    def test_other_journal_mode(self):
+        self.store(["1", "2"])
+        proc = self.run_export()
+        self.assertEqual(proc.returncode, 0, proc.stdout)
+        with numpy.load(self.output) as npz:
+            self.assertEqual(npz["id"].tolist(), [1, 2])
+        conn = sqlite3.connect(self.db)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "delete")
+        conn.close()
+
+    # builds stored as text by servers not validating builds are skipped
+    def test_text_build(self):
+        self.store(["1", "2", "3"])
+        conn = sqlite3.connect(self.db)
+        conn.execute("UPDATE testresults SET build = '12-rerun' WHERE id = 2")
+        conn.commit()
+        conn.close()
+        proc = self.run_export()
+        self.assertEqual(proc.returncode, 0, proc.stdout)
+        with numpy.load(self.output) as npz:
+            self.assertEqual(npz["id"].tolist(), [1, 3])
+            self.assertEqual(npz["build"].tolist(), [1, 3])
+        with open(self.log_file) as f:
+            self.assertIn("skipped 1 results", f.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
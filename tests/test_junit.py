@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Junit Reader Tests
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import os
+import tempfile
+import unittest
+
+from junitparser import JUnitXml, TestSuite, TestCase
+
+from lib.config import ClientConfig
+from lib.junit import JunitError, junit_files, read_junit, read_junit_valid
+from lib.topostat import Logger, TopotestResult
+from bench.junit_gen import generate_cases, write_junit
+from client import read_results
+
+
+# junit xml files exercising the test case results, durations and nesting of
+# test suites, with and without a testsuites root element
+JUNIT_FILES = {
+    "results": """<?xml version="1.0" encoding="utf-8"?>
+<testsuites>
+  <testsuite name="pytest" tests="6">
+    <testcase classname="bgp.test_bgp" name="test_passed" time="1.5">
+      <system-out>output</system-out>
+    </testcase>
+    <testcase classname="bgp.test_bgp" name="test_failed" time="2,000.25">
+      <failure message="assert">trace</failure>
+    </testcase>
+    <testcase classname="bgp.test_bgp" name="test_skipped" time="0.001">
+      <skipped message="skip"/>
+    </testcase>
+    <testcase classname="bgp.test_bgp" name="test_error" time="3">
+      <error message="setup"/>
+    </testcase>
+    <testcase classname="bgp.test_bgp" name="test_skipped_failure">
+      <skipped/>
+      <failure/>
+    </testcase>
+    <testcase classname="bgp.test_bgp" name="test_no_time"/>
+  </testsuite>
+  <testsuite name="second">
+    <testcase classname="ospf.test_ospf" name="test_case" time="4"/>
+  </testsuite>
+</testsuites>
+""",
+    "nested": """<?xml version="1.0" encoding="utf-8"?>
+<testsuites>
+  <testsuite name="outer">
+    <testcase classname="outer" name="test_first" time="1"/>
+    <testsuite name="inner">
+      <testcase classname="inner" name="test_inner" time="2"/>
+      <testsuite name="innermost">
+        <testcase classname="innermost" name="test_innermost" time="3"/>
+      </testsuite>
+    </testsuite>
+    <testcase classname="outer" name="test_last" time="4">
+      <failure/>
+    </testcase>
+  </testsuite>
+</testsuites>
+""",
+    "suite": """<?xml version="1.0" encoding="utf-8"?>
+<testsuite name="pytest">
+  <testcase classname="zebra.test_zebra" name="test_a" time="1"/>
+  <testcase classname="zebra.test_zebra" name="test_b" time="2">
+    <failure/>
+  </testcase>
+</testsuite>
+""",
+}
+
+
+# results of a junit xml file as read by the client with junitparser
+def junitparser_results(path):
+    results = []
+    for suite in JUnitXml.fromfile(path):
+        if isinstance(suite, TestSuite):
+            cases = [case for case in suite]
+        else:
+            cases = [suite]
+        for case in cases:
+            results.append(TopotestResult().from_case(case, "agent", "P", "1", "J"))
+    return results
+
+
+# comparable values of results, the timestamps are the time of reading
+def values(results):
+    return [[result.name, result.result, result.time] for result in results]
+
+
+class JunitTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+
+class ReadJunitTest(JunitTestCase):
+    def assertParity(self, path):
+        results = list(read_junit(path, "agent", "P", "1", "J"))
+        self.assertEqual(values(results), values(junitparser_results(path)))
+        return results
+
+    def test_parity(self):
+        for name, text in JUNIT_FILES.items():
+            with self.subTest(name):
+                self.assertParity(self.write(name + ".xml", text))
+
+    def test_results(self):
+        path = self.write("results.xml", JUNIT_FILES["results"])
+        results = self.assertParity(path)
+        self.assertEqual(
+            [result.result for result in results],
+            ["passed", "failed", "skipped", None, "skipped", "passed", "passed"],
+        )
+        self.assertEqual(results[1].time, "2000.25")
+        self.assertEqual(results[5].time, "None")
+
+    def test_generated(self):
+        path = os.path.join(self.directory.name, "generated.xml")
+        write_junit(path, generate_cases(500, failed=0.1, skipped=0.1))
+        self.assertEqual(len(self.assertParity(path)), 500)
+
+    def test_valid(self):
+        path = self.write("results.xml", JUNIT_FILES["results"])
+        counts = [0, 0, 0]
+        results = list(read_junit_valid(path, "agent", "P", "1", "J", counts))
+        # errors and test cases without duration are invalid
+        self.assertEqual(counts, [3, 1, 3])
+        self.assertEqual(
+            [result.name for result in results],
+            [
+                "bgp.test_bgp.test_passed",
+                "bgp.test_bgp.test_failed",
+                "ospf.test_ospf.test_case",
+            ],
+        )
+
+    def test_invalid(self):
+        paths = [
+            self.write("root.xml", "<testcase/>"),
+            self.write("broken.xml", "<testsuites><testsuite>"),
+            os.path.join(self.directory.name, "missing.xml"),
+        ]
+        for path in paths:
+            with self.assertRaises(JunitError):
+                list(read_junit(path, "agent", "P", "1", "J"))
+
+
+class ResultList:
+    """
+    Upload keeping the results added by the client in a list.
+    """
+
+    def __init__(self):
+        self.results = []
+
+    def add(self, result):
+        self.results.append(result)
+
+
+class JunitFilesTest(JunitTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conf = ClientConfig()
+        self.conf.sender_id = "agent"
+        self.log = Logger(self.conf)
+        # the first files take longest to read
+        self.paths = []
+        for i, cases in enumerate([400, 300, 5, 200, 1]):
+            path = os.path.join(self.directory.name, "junit-{}.xml".format(i))
+            write_junit(path, generate_cases(cases, seed=i))
+            self.paths.append(path)
+
+    # results added to the upload in the order of their files
+    def read(self, workers):
+        self.conf.junit_workers = workers
+        upload = ResultList()
+        counts = read_results(self.paths, self.conf, self.log, "P", "1", "J", upload)
+        return counts, values(upload.results)
+
+    def test_order(self):
+        expected = []
+        counts = [0, 0, 0]
+        for path in self.paths:
+            expected += values(read_junit_valid(path, "agent", "P", "1", "J", counts))
+        self.assertEqual(self.read(0), (counts, expected))
+        self.assertEqual(self.read(3), (counts, expected))
+
+    def test_files(self):
+        os.mkdir(os.path.join(self.directory.name, "sub"))
+        sub = self.write(os.path.join("sub", "b.xml"), JUNIT_FILES["suite"])
+        glob = os.path.join(self.directory.name, "**", "*.xml")
+        files = junit_files([self.paths[3], self.directory.name, glob])
+        self.assertEqual(
+            files, [self.paths[3]] + sorted(self.paths[:3] + self.paths[4:]) + [sub]
+        )
+        with self.assertRaises(JunitError):
+            junit_files([os.path.join(self.directory.name, "*.json")])
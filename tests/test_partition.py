@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Database Partition Tests
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import os
+import time
+import sqlite3
+import tempfile
+import unittest
+
+from lib.config import ServerConfig
+from lib.database import create_results_tables
+from lib.topostat import Logger, TopotestResult
+from lib.partition import (
+    PartitionReader,
+    PartitionSet,
+    list_partitions,
+    partition_file,
+    partition_key,
+    partition_key_before,
+    partition_range,
+)
+from lib.query import QueryError
+
+
+class PartitionTestCase(unittest.TestCase):
+    """
+    Server configuration of a database partitioned per month in a temporary
+    directory.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.conf = ServerConfig()
+        self.conf.sqlite3_db = os.path.join(self.directory.name, "topotests.db")
+        self.conf.db_partition = "month"
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # create empty partitions of the given keys
+    def create_partitions(self, keys):
+        for key in keys:
+            conn = sqlite3.connect(partition_file(self.conf.sqlite3_db, key))
+            create_results_tables(conn, self.conf.results_table)
+            conn.close()
+
+
+class PartitionSetTest(PartitionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.partitions = PartitionSet(self.conf, Logger(self.conf))
+        self.current = partition_key("month", int(time.time()))
+
+    def tearDown(self):
+        self.partitions.close()
+        super().tearDown()
+
+    def exists(self, key):
+        return os.path.exists(partition_file(self.conf.sqlite3_db, key))
+
+    # rows are routed to the partition of their timestamp in UTC
+    def test_route(self):
+        rows = [
+            TopotestResult(
+                "suite.test_case",
+                "passed",
+                "1.0",
+                "agent",
+                timestamp,
+                "PLAN",
+                "1",
+                "JOB",
+            ).to_row()
+            for timestamp in [
+                "2021-01-31 23:59:59.999999",
+                "2021-02-01 00:00:00.000000",
+                "2021-02-28 12:00:00.000000",
+            ]
+        ]
+        parts = self.partitions.route(rows)
+        self.assertEqual(parts, {"2021-01": rows[:1], "2021-02": rows[1:]})
+
+    def test_keys(self):
+        self.assertEqual(partition_key_before("month", "2021-01"), "2020-12")
+        self.assertEqual(partition_key_before("day", "2021-03-01"), "2021-02-28")
+        start, end = partition_range("year", "2020")
+        self.assertEqual(end - start, 366 * 86400)
+        self.create_partitions(["2021-01", "2020-12"])
+        self.assertEqual(
+            list_partitions(self.conf.sqlite3_db, "month"), ["2020-12", "2021-01"]
+        )
+
+    def test_store(self):
+        self.partitions.store(self.current)
+        self.assertTrue(self.exists(self.current))
+        self.partitions.store("2021-01")
+        self.partitions.store("2021-02")
+        # only the most recently used partitions stay open
+        self.assertEqual(list(self.partitions.stores), ["2021-01", "2021-02"])
+
+    # partitions older than the retention are deleted once a partition is
+    # created
+    def test_retention(self):
+        self.conf.db_partition_retention = 2
+        before = partition_key_before("month", self.current)
+        expired = partition_key_before("month", before)
+        self.create_partitions(["2000-01", expired, before])
+        self.assertTrue(self.partitions.expired(expired))
+        self.assertFalse(self.partitions.expired(before))
+        self.partitions.store(self.current)
+        self.assertEqual(
+            list_partitions(self.conf.sqlite3_db, "month"), [before, self.current]
+        )
+
+    def test_retention_archive(self):
+        self.conf.db_partition_retention = 1
+        self.conf.db_partition_archive_dir = os.path.join(
+            self.directory.name, "archive"
+        )
+        os.mkdir(self.conf.db_partition_archive_dir)
+        self.create_partitions(["2000-01"])
+        self.partitions.expire()
+        self.assertFalse(self.exists("2000-01"))
+        self.assertEqual(
+            os.listdir(self.conf.db_partition_archive_dir), ["topotests-2000-01.db"]
+        )
+
+    # without retention every partition is kept
+    def test_no_retention(self):
+        self.create_partitions(["2000-01"])
+        self.partitions.expire()
+        self.assertTrue(self.exists("2000-01"))
+        self.assertFalse(self.partitions.expired("2000-01"))
+
+
+class PartitionReaderTest(PartitionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conn = sqlite3.connect(":memory:")
+        self.reader = PartitionReader(self.conn, self.conf)
+        self.limit = self.conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        self.keys = [
+            "{}-{:02d}".format(2020 + i // 12, i % 12 + 1)
+            for i in range(self.limit + 2)
+        ]
+        self.create_partitions(self.keys)
+
+    def tearDown(self):
+        self.conn.close()
+        super().tearDown()
+
+    def test_time_range(self):
+        since = partition_range("month", self.keys[2])[0]
+        until = partition_range("month", self.keys[4])[1]
+        tables = self.reader.tables(since, until)
+        self.assertEqual(
+            tables,
+            [
+                "p_{}.{}".format(key.replace("-", "_"), self.conf.results_table)
+                for key in self.keys[2:5]
+            ],
+        )
+
+    # partitions beyond the attach limit are never skipped silently
+    def test_too_many_partitions(self):
+        with self.assertRaisesRegex(QueryError, "missing parameter since"):
+            self.reader.tables(None, None)
+        with self.assertRaisesRegex(QueryError, "time range spans"):
+            self.reader.tables(0, None)
+        since = partition_range("month", self.keys[2])[0]
+        self.assertEqual(len(self.reader.tables(since, None)), self.limit)
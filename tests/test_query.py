@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Query Service Tests
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import sqlite3
+import unittest
+
+import zmq
+
+from lib.topostat import Message, TopotestResult
+from lib.database import ResultStore, create_results_tables
+from lib.query import run_query
+from tests.test_server import ServerTestCase, TEST_AUTH_KEY, free_port, results
+
+
+# history of a test in builds 1 to builds
+def history(builds):
+    return [
+        TopotestResult(
+            "suite.test_case",
+            "passed",
+            "1.0",
+            "agent",
+            "2021-01-05 12:16:30.245931",
+            "PLAN",
+            str(build),
+            "JOB",
+        )
+        for build in range(1, builds + 1)
+    ]
+
+
+class PaginationTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        create_results_tables(self.conn, "testresults")
+        store = ResultStore(self.conn, "testresults")
+        store.insert_many([result.to_row() for result in history(7)])
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def query(self, offset=None, limit=None):
+        request = {"query": "test_history", "params": {"name": "suite.test_case"}}
+        if offset is not None:
+            request["offset"] = offset
+        if limit is not None:
+            request["limit"] = limit
+        return run_query(
+            self.conn, lambda since, until: ["testresults"], request, 5, 10
+        )
+
+    def test_pages(self):
+        builds = []
+        offsets = []
+        offset = 0
+        while offset is not None:
+            response = self.query(offset, 3)
+            self.assertEqual(response["status"], "ok")
+            self.assertEqual(response["offset"], offset)
+            builds += [row[1] for row in response["rows"]]
+            offsets.append(offset)
+            offset = response["next_offset"]
+        self.assertEqual(offsets, [0, 3, 6])
+        self.assertEqual(builds, list(range(7, 0, -1)))
+
+    def test_page_size(self):
+        response = self.query()
+        self.assertEqual(len(response["rows"]), 5)
+        self.assertEqual(response["next_offset"], 5)
+        response = self.query(limit=10)
+        self.assertEqual(len(response["rows"]), 7)
+        self.assertIsNone(response["next_offset"])
+
+    def test_invalid_page(self):
+        self.assertEqual(self.query(limit=11)["error"], "invalid limit, maximum is 10")
+        self.assertEqual(self.query(limit=0)["status"], "error")
+        self.assertEqual(self.query(offset=-1)["error"], "invalid offset")
+
+
+class QueryAuthTest(ServerTestCase):
+    def setUp(self):
+        self.query_port = free_port()
+        self.server_options = {
+            "server_no_query": "no",
+            "server_query_port_ipv4": self.query_port,
+        }
+        super().setUp()
+        self.query_sock = self.context.socket(zmq.REQ)
+        self.query_sock.setsockopt(zmq.LINGER, 0)
+        self.query_sock.connect("tcp://127.0.0.1:{}".format(self.query_port))
+
+    def tearDown(self):
+        self.query_sock.close()
+        super().tearDown()
+
+    # send a query signed with key and return the response of the server
+    def send_query(self, key):
+        msg = Message(version=1)
+        msg.add_payload(
+            {"query": "test_stats", "params": {"name": "suite.test_case_0"}}
+        )
+        msg.gen_auth(key)
+        self.query_sock.send_json(msg.to_json())
+        self.assertTrue(self.query_sock.poll(10000), "no response from server")
+        return self.query_sock.recv_json()
+
+    def test_auth(self):
+        reply = self.send_chunk("upload-query", 0, 1, results(0, 1))
+        self.assertEqual(reply["stored"], 1)
+        response = self.send_query(TEST_AUTH_KEY)
+        self.assertEqual(response["status"], "ok")
+        self.assertEqual(len(response["rows"]), 1)
+        response = self.send_query("otherkey")
+        self.assertEqual(response["status"], "error")
+        self.assertEqual(response["error"], "authentication failed")
+        self.assertNotIn("rows", response)
+        self.wait_log("failed to authenticate ZeroMQ query message")
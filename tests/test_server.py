@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Server Tests
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import sqlite3
+import tempfile
+import unittest
+import subprocess
+
+import zmq
+
+from lib.topostat import Message, TopotestResult, TopotestRun
+
+
+TEST_AUTH_KEY = "testkey"
+
+
+# unused tcp port on the loopback interface
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ServerTestCase(unittest.TestCase):
+    """
+    Runs a server on the loopback interface with a database in a temporary
+    directory, server_options are added to the server section.
+    """
+
+    server_options = {}
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.log_file = os.path.join(self.directory.name, "server.log")
+        self.config = os.path.join(self.directory.name, "topostat.conf")
+        self.port = free_port()
+        self.ack_port = free_port()
+        options = {
+            "verbose": "no",
+            "log_file": self.log_file,
+            "server_no_ipv6": "yes",
+            "server_no_query": "yes",
+            "server_address_ipv4": "127.0.0.1",
+            "server_port_ipv4": self.port,
+            "server_ack_port_ipv4": self.ack_port,
+            "auth_key": TEST_AUTH_KEY,
+            "sqlite3_db": os.path.join(self.directory.name, "topotests.db"),
+        }
+        options.update(self.server_options)
+        with open(self.config, "w") as f:
+            f.write("[server]\n")
+            for var, val in options.items():
+                f.write("{} = {}\n".format(var, val))
+        self.log_offset = 0
+        self.start_server()
+        self.context = zmq.Context()
+        self.sock = self.context.socket(zmq.DEALER)
+        self.sock.setsockopt(zmq.LINGER, 0)
+        self.sock.connect("tcp://127.0.0.1:{}".format(self.ack_port))
+
+    def tearDown(self):
+        self.sock.close()
+        self.context.term()
+        self.stop_server()
+        self.directory.cleanup()
+
+    def start_server(self):
+        self.server = subprocess.Popen(
+            [sys.executable, "server.py", "-c", self.config],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        self.wait_log("started database writer thread")
+
+    def stop_server(self):
+        self.server.send_signal(signal.SIGTERM)
+        self.server.wait(timeout=30)
+
+    # restart the server, only the log of the new server is waited for
+    def restart_server(self):
+        self.stop_server()
+        with open(self.log_file) as f:
+            self.log_offset = len(f.read())
+        self.start_server()
+
+    # wait until the server logged text
+    def wait_log(self, text, timeout=10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                with open(self.log_file) as f:
+                    if text in f.read()[self.log_offset :]:
+                        return
+            except FileNotFoundError:
+                pass
+            self.assertIsNone(self.server.poll(), "server exited")
+            time.sleep(0.1)
+        self.fail("server did not log {}".format(text))
+
+    # frames of a message with a chunk of results of an upload
+    def chunk_frames(self, upload_id, chunk, chunks, results, build="1"):
+        run = TopotestRun("agent", "PLAN", build, "JOB")
+        for result in results:
+            run.add(result)
+        msg = Message()
+        msg.add_payload(run.to_json())
+        msg.upload_id = upload_id
+        msg.chunk = chunk
+        msg.chunks = chunks
+        msg.gen_auth(TEST_AUTH_KEY)
+        return msg.to_frames("zlib")
+
+    # send a chunk of results of an upload and return the reply of the server
+    def send_chunk(self, upload_id, chunk, chunks, results, build="1"):
+        self.sock.send_multipart(
+            self.chunk_frames(upload_id, chunk, chunks, results, build)
+        )
+        self.assertTrue(self.sock.poll(10000), "no reply from server")
+        return json.loads(self.sock.recv())
+
+
+# results named test_case_<first> to test_case_<first + count - 1>
+def results(first, count, build="1"):
+    return [
+        TopotestResult(
+            "suite.test_case_{}".format(i),
+            "passed",
+            "1.0",
+            "agent",
+            "2021-01-05 12:16:30.245931",
+            "PLAN",
+            build,
+            "JOB",
+        )
+        for i in range(first, first + count)
+    ]
+
+
+class ChunkedUploadTest(ServerTestCase):
+    server_options = {"db_staging_timeout_s": 1}
+
+    def test_empty_final_chunk(self):
+        reply = self.send_chunk("upload-empty", 0, 0, results(0, 5))
+        self.assertEqual(reply["status"], "ok")
+        self.assertEqual(reply["staged"], 5)
+        self.assertFalse(reply["committed"])
+        reply = self.send_chunk("upload-empty", 1, 2, [])
+        self.assertEqual(reply["status"], "ok")
+        self.assertEqual(reply["stored"], 5)
+        self.assertTrue(reply["committed"])
+
+    def test_unchunked(self):
+        reply = self.send_chunk("upload-single", 0, 1, results(0, 5))
+        self.assertEqual(reply["status"], "ok")
+        self.assertEqual(reply["stored"], 5)
+        self.assertTrue(reply["committed"])
+        # a resent upload is confirmed as stored
+        reply = self.send_chunk("upload-single", 0, 1, results(0, 5))
+        self.assertTrue(reply["duplicate"])
+        self.assertTrue(reply["committed"])
+
+    def test_expire_idle(self):
+        reply = self.send_chunk("upload-abandoned", 0, 0, results(0, 5))
+        self.assertEqual(reply["staged"], 5)
+        # no further messages arrive, the poller loop expires the upload
+        self.wait_log("discarded incomplete upload upload-abandoned", timeout=10)
+
+    def test_restart_between_chunks(self):
+        reply = self.send_chunk("upload-restart", 0, 0, results(0, 5))
+        self.assertEqual(reply["staged"], 5)
+        # the staged chunk is removed by the restarted server
+        self.restart_server()
+        reply = self.send_chunk("upload-restart", 1, 2, results(5, 5))
+        self.assertEqual(reply["status"], "error")
+        self.assertEqual(reply["error"], "incomplete upload")
+        self.assertEqual(reply["stored"], 0)
+        # the upload sent again is stored completely
+        reply = self.send_chunk("upload-restart", 0, 0, results(0, 5))
+        self.assertEqual(reply["status"], "ok")
+        reply = self.send_chunk("upload-restart", 1, 2, results(5, 5))
+        self.assertEqual(reply["status"], "ok")
+        self.assertEqual(reply["stored"], 10)
+
+    def test_expired_between_chunks(self):
+        reply = self.send_chunk("upload-late", 0, 0, results(0, 5))
+        self.assertEqual(reply["staged"], 5)
+        self.wait_log("discarded incomplete upload upload-late", timeout=10)
+        reply = self.send_chunk("upload-late", 1, 2, results(5, 5))
+        self.assertEqual(reply["status"], "error")
+        self.assertEqual(reply["error"], "incomplete upload")
+
+
+class UploadIdTest(ServerTestCase):
+    def count(self):
+        conn = sqlite3.connect(os.path.join(self.directory.name, "topotests.db"))
+        try:
+            return conn.execute("SELECT count(*) FROM testresults").fetchone()[0]
+        finally:
+            conn.close()
+
+    # a resent chunked upload is confirmed without storing it again
+    def test_resent_chunked_upload(self):
+        for i in range(2):
+            self.send_chunk("upload-twice", 0, 0, results(0, 5))
+            reply = self.send_chunk("upload-twice", 1, 2, results(5, 5))
+            self.assertEqual(reply["status"], "ok")
+            self.assertTrue(reply["committed"])
+        self.assertTrue(reply["duplicate"])
+        self.assertEqual(reply["stored"], 0)
+        self.assertEqual(self.count(), 10)
+
+    # results of another upload with the same keys are ignored
+    def test_duplicate_results(self):
+        reply = self.send_chunk("upload-first", 0, 1, results(0, 5))
+        self.assertEqual(reply["stored"], 5)
+        reply = self.send_chunk("upload-second", 0, 1, results(3, 5))
+        self.assertEqual(reply["stored"], 3)
+        self.assertEqual(reply["duplicates"], 2)
+        self.assertEqual(self.count(), 8)
+
+
+class ReplaceDuplicatesTest(UploadIdTest):
+    server_options = {"db_duplicates": "replace"}
+
+    # results of another upload with the same keys replace the stored results
+    def test_duplicate_results(self):
+        reply = self.send_chunk("upload-first", 0, 1, results(0, 5))
+        self.assertEqual(reply["stored"], 5)
+        reply = self.send_chunk("upload-second", 0, 1, results(3, 5))
+        self.assertEqual(reply["stored"], 5)
+        self.assertEqual(reply["duplicates"], 2)
+        self.assertEqual(self.count(), 8)
+
+
+class BuildTest(ServerTestCase):
+    def test_integer_build(self):
+        reply = self.send_chunk("upload-build", 0, 1, results(0, 5, "4711"), "4711")
+        self.assertEqual(reply["stored"], 5)
+
+    # builds are stored as integers, results of other builds are rejected
+    def test_text_build(self):
+        reply = self.send_chunk(
+            "upload-rerun", 0, 1, results(0, 5, "12-rerun"), "12-rerun"
+        )
+        self.assertEqual(reply["status"], "ok")
+        self.assertEqual(reply["stored"], 0)
+        self.wait_log("5 build")
+
+
+class SignalTest(ServerTestCase):
+    # the server terminates between two messages and writes every message
+    # received before it exits
+    def test_terminate_while_ingesting(self):
+        for i in range(200):
+            self.sock.send_multipart(
+                self.chunk_frames("upload-{}".format(i), 0, 1, results(i * 20, 20))
+            )
+        replies = []
+        while self.sock.poll(5000):
+            replies.append(json.loads(self.sock.recv()))
+            if len(replies) == 10:
+                self.server.send_signal(signal.SIGTERM)
+        self.assertEqual(self.server.wait(timeout=30), 0)
+        self.wait_log("terminating")
+        self.assertTrue(all(reply["committed"] for reply in replies))
+        conn = sqlite3.connect(os.path.join(self.directory.name, "topotests.db"))
+        stored = conn.execute("SELECT count(*) FROM testresults").fetchone()[0]
+        conn.close()
+        self.assertEqual(stored, sum(reply["stored"] for reply in replies))
+        self.assertEqual(stored, 20 * len(replies))
+
+
+class AsyncioChunkedUploadTest(ChunkedUploadTest):
+    server_options = {"db_staging_timeout_s": 1, "server_loop": "asyncio"}
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Data Model Tests
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import json
+import calendar
+import unittest
+from unittest import mock
+from datetime import datetime, timezone
+
+from lib.topostat import (
+    Message,
+    MessageEncodingError,
+    TopotestResult,
+    TopotestRun,
+    message_encoding_available,
+    timestamp_to_epoch,
+    zstandard,
+)
+
+
+# result of a test of the run of agent, PLAN, build 1 and JOB
+def topotest_result(
+    name, result="passed", time="1.0", timestamp="2021-01-05 12:16:30.245931"
+):
+    return TopotestResult(name, result, time, "agent", timestamp, "PLAN", "1", "JOB")
+
+
+# signed message with results of test names and its frames, a version 2
+# message carries the results as a run
+def message_frames(names, version=2, encoding="zlib", upload_id="upload"):
+    results = [topotest_result(name) for name in names]
+    msg = Message(version=version)
+    if version == 1:
+        msg.add_payload([result.to_json() for result in results])
+    else:
+        run = TopotestRun("agent", "PLAN", "1", "JOB")
+        for result in results:
+            run.add(result)
+        msg.add_payload(run.to_json())
+    msg.upload_id = upload_id
+    msg.gen_auth("key")
+    return msg, msg.to_frames(encoding)
+
+
+class TimestampTest(unittest.TestCase):
+    def test_epoch_utc(self):
+        self.assertEqual(timestamp_to_epoch("1970-01-01 00:00:00.000000"), 0)
+        self.assertEqual(
+            timestamp_to_epoch("2021-01-05 12:16:30"),
+            calendar.timegm((2021, 1, 5, 12, 16, 30)),
+        )
+
+    def test_epoch_truncates_fraction(self):
+        self.assertEqual(
+            timestamp_to_epoch("2021-01-05 12:16:30.999999"),
+            timestamp_to_epoch("2021-01-05 12:16:30.000000"),
+        )
+
+    def test_epoch_invalid_fraction(self):
+        with self.assertRaises(ValueError):
+            timestamp_to_epoch("2021-01-05 12:16:30.abc")
+
+    def test_testcase_timestamp_utc(self):
+        before = int(datetime.now(timezone.utc).timestamp())
+        ttr = TopotestResult().from_testcase(
+            "bgp.test_bgp", "test_case", "passed", 1.5, "host", "PLAN", "1", "JOB"
+        )
+        after = int(datetime.now(timezone.utc).timestamp())
+        self.assertTrue(before <= timestamp_to_epoch(ttr.timestamp) <= after)
+
+
+class CompactTest(unittest.TestCase):
+    def test_result_slots(self):
+        result = topotest_result("a")
+        self.assertFalse(hasattr(result, "__dict__"))
+        obj = result.to_json()
+        self.assertEqual(list(obj), TopotestResult.__slots__)
+        self.assertEqual(obj, {var: getattr(result, var) for var in obj})
+        self.assertEqual(TopotestResult().from_json(obj).to_json(), obj)
+
+    def test_result_check(self):
+        for var in TopotestResult.__slots__:
+            result = topotest_result("a")
+            setattr(result, var, None)
+            self.assertFalse(result.check(), var)
+            self.assertIsNone(result.to_json(), var)
+
+    # the payload is referenced by the message and serialized once
+    def test_message_payload(self):
+        self.assertFalse(hasattr(Message(), "__dict__"))
+        payload = [topotest_result("a").to_json(), topotest_result("b").to_json()]
+        msg = Message(version=1)
+        msg.add_payload(payload)
+        msg.gen_auth("key")
+        self.assertIs(msg.payload, payload)
+        self.assertIs(msg.to_json()["payload"], payload)
+        frames = msg.to_frames()
+        self.assertEqual(frames, [json.dumps(msg.to_json()).encode()])
+        self.assertEqual(json.loads(frames[0])["payload"], payload)
+
+    def test_message_check(self):
+        for var in Message.__slots__:
+            msg = Message()
+            msg.add_payload([])
+            msg.gen_auth("key")
+            self.assertTrue(msg.check())
+            setattr(msg, var, None)
+            self.assertFalse(msg.check(), var)
+            self.assertIsNone(msg.to_frames(), var)
+
+
+class TopotestRunTest(unittest.TestCase):
+    def run_of(self, results):
+        run = TopotestRun("agent", "PLAN", "1", "JOB")
+        for result in results:
+            self.assertTrue(run.add(result))
+        return run
+
+    # a run yields the rows of its results without a result object per row
+    def test_rows(self):
+        results = [
+            topotest_result("a"),
+            topotest_result("b", "failed", "2.5"),
+            topotest_result("c", "skipped", "0", "2021-01-05 12:16:31"),
+        ]
+        run = TopotestRun().from_json(
+            json.loads(json.dumps(self.run_of(results).to_json()))
+        )
+        self.assertEqual(len(run), 3)
+        self.assertEqual(run.to_rows(), ([result.to_row() for result in results], 0))
+
+    def test_invalid_values(self):
+        results = [
+            topotest_result("a"),
+            topotest_result("", "passed"),
+            topotest_result("b", "error"),
+            topotest_result("c", "passed", "abc"),
+            topotest_result("d", "passed", "1.0", "bad"),
+            topotest_result("e", None),
+        ]
+        rows, invalid = self.run_of(results).to_rows()
+        self.assertEqual(rows, [results[0].to_row()])
+        self.assertEqual(invalid, 5)
+
+    # results of another run are not added
+    def test_add_other_run(self):
+        run = self.run_of([])
+        for var, val in [
+            ["host", "other"],
+            ["plan", "P"],
+            ["build", "2"],
+            ["job", "J"],
+        ]:
+            result = topotest_result("a")
+            setattr(result, var, val)
+            self.assertFalse(run.add(result))
+        self.assertEqual(len(run), 0)
+
+    def test_invalid_columns(self):
+        obj = self.run_of([topotest_result("a"), topotest_result("b")]).to_json()
+        self.assertIsNotNone(TopotestRun().from_json(dict(obj)))
+        for column in ["name", "result", "time", "timestamp"]:
+            for val in [obj[column][:1], "ab", None]:
+                invalid = dict(obj)
+                invalid[column] = val
+                self.assertIsNone(TopotestRun().from_json(invalid), column)
+        for var in ["host", "plan", "build", "job", "version"]:
+            invalid = dict(obj)
+            del invalid[var]
+            self.assertIsNone(TopotestRun().from_json(invalid), var)
+
+    # shared values are sent once per run instead of once per result
+    def test_size(self):
+        results = [topotest_result("suite.test_{}".format(i)) for i in range(100)]
+        run = json.dumps(self.run_of(results).to_json())
+        rows = json.dumps([result.to_json() for result in results])
+        self.assertLess(len(run), len(rows) / 2)
+
+
+class MessageFramesTest(unittest.TestCase):
+    def assertRoundTrip(self, msg, frames):
+        received = Message()
+        received.from_frames(frames)
+        for var in Message.__slots__:
+            self.assertEqual(getattr(received, var), getattr(msg, var), var)
+        self.assertTrue(received.check_auth("key"))
+        self.assertFalse(received.check_auth("other"))
+
+    def test_version_1(self):
+        msg, frames = message_frames(["a", "b"], version=1)
+        self.assertEqual(len(frames), 1)
+        self.assertRoundTrip(msg, frames)
+
+    def test_version_2(self):
+        for encoding in ["none", "zlib", "zstd"]:
+            if not message_encoding_available(encoding):
+                continue
+            msg, frames = message_frames(["a", "b"], encoding=encoding)
+            self.assertEqual(len(frames), 2)
+            self.assertEqual(json.loads(frames[0])["encoding"], encoding)
+            self.assertRoundTrip(msg, frames)
+
+    def test_chunk(self):
+        msg = Message()
+        msg.add_payload([])
+        msg.upload_id = "upload"
+        msg.chunk = 2
+        msg.chunks = 3
+        msg.gen_auth("key")
+        self.assertRoundTrip(msg, msg.to_frames("zlib"))
+        # chunked uploads have no version 1 messages
+        msg.version = 1
+        self.assertIsNone(msg.to_frames())
+
+    def test_invalid_frames(self):
+        msg, frames = message_frames(["a"])
+        with self.assertRaises(ValueError):
+            Message().from_frames(frames + [b""])
+        header = json.loads(frames[0])
+        header["version"] = 1
+        with self.assertRaises(ValueError):
+            Message().from_frames([json.dumps(header).encode(), frames[1]])
+        header["version"] = 2
+        header["encoding"] = "lzma"
+        with self.assertRaises(MessageEncodingError):
+            Message().from_frames([json.dumps(header).encode(), frames[1]])
+        with self.assertRaises(ValueError):
+            Message().from_frames([frames[0], frames[1][:-4]])
+
+    # payloads decompressing to more than the maximum payload size are
+    # rejected without decompressing them completely
+    @mock.patch("lib.topostat.TOPOSTAT_MESSAGE_MAX_PAYLOAD", 4096)
+    def test_payload_cap(self):
+        names = ["suite.test_case_{}".format(i) for i in range(200)]
+        for encoding in ["none", "zlib", "zstd"]:
+            if not message_encoding_available(encoding):
+                continue
+            msg, frames = message_frames(names[:10], encoding=encoding)
+            self.assertRoundTrip(msg, frames)
+            msg, frames = message_frames(names, encoding=encoding)
+            with self.assertRaises(ValueError):
+                Message().from_frames(frames)
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    @mock.patch("lib.topostat.TOPOSTAT_MESSAGE_MAX_PAYLOAD", 4096)
+    def test_payload_cap_zstd_size(self):
+        msg, frames = message_frames(["a"], encoding="zstd")
+        payload = b" " * 8192
+        for content_size in [True, False]:
+            data = zstandard.ZstdCompressor(write_content_size=content_size).compress(
+                payload
+            )
+            with self.assertRaises(ValueError):
+                Message().from_frames([frames[0], data])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Upload Tests
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import os
+import json
+import tempfile
+import threading
+import unittest
+
+import zmq
+
+from lib.config import ClientConfig
+from lib.topostat import Logger
+from lib.upload import UploadSocket, UploadError, UploadRejectedError
+from tests.test_server import free_port
+
+
+class UploadSocketTestCase(unittest.TestCase):
+    """
+    Sends messages with an UploadSocket of delivery ack to a ROUTER socket
+    answering every message with the next of the replies of a test.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.conf = ClientConfig()
+        self.conf.log_file = os.path.join(self.directory.name, "client.log")
+        self.conf.connection_timeout = 2
+        port = free_port()
+        self.conf.socket_address_str = "tcp://127.0.0.1:{}".format(port)
+        self.log = Logger(self.conf)
+        self.log.start()
+        self.context = zmq.Context()
+        self.router = self.context.socket(zmq.ROUTER)
+        self.router.setsockopt(zmq.LINGER, 0)
+        self.router.bind(self.conf.socket_address_str)
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.join()
+        self.router.close()
+        self.context.term()
+        self.log.stop()
+        self.directory.cleanup()
+
+    # answer the next messages with replies in a thread, the router socket is
+    # only used by the thread from here on
+    def serve(self, replies):
+        def reply_thread():
+            for reply in replies:
+                if not self.router.poll(10000):
+                    return
+                identity = self.router.recv_multipart()[0]
+                self.router.send_multipart([identity, json.dumps(reply).encode()])
+
+        self.server = threading.Thread(target=reply_thread)
+        self.server.start()
+
+    # send a message and return the upload socket
+    def send(self, reply):
+        self.serve([reply])
+        sock = UploadSocket(self.conf, self.log)
+        try:
+            sock.send([b"{}"])
+        finally:
+            sock.drop()
+        return sock
+
+
+class UploadReplyTest(UploadSocketTestCase):
+    def test_stored(self):
+        sock = self.send(
+            {
+                "status": "ok",
+                "chunks": 1,
+                "committed": True,
+                "stored": 5,
+                "duplicates": 1,
+            }
+        )
+        self.assertEqual(sock.stored, 5)
+        self.assertEqual(sock.duplicates, 1)
+
+    def test_rejected(self):
+        with self.assertRaises(UploadRejectedError) as cm:
+            self.send({"status": "error", "error": "invalid run"})
+        self.assertEqual(cm.exception.error, "invalid run")
+
+    # an incomplete upload is sent again, it is not rejected
+    def test_incomplete_upload(self):
+        with self.assertRaises(UploadError) as cm:
+            self.send(
+                {"status": "error", "error": "incomplete upload", "upload_id": "up"}
+            )
+        self.assertNotIsInstance(cm.exception, UploadRejectedError)
+
+    def test_chunk_staged(self):
+        sock = self.send({"status": "ok", "chunks": 0, "committed": False, "staged": 5})
+        self.assertEqual(sock.stored, 0)
+
+    # a final chunk only staged is not confirmed
+    def test_final_chunk_not_committed(self):
+        with self.assertRaises(UploadError) as cm:
+            self.send(
+                {
+                    "status": "ok",
+                    "upload_id": "up",
+                    "chunk": 1,
+                    "chunks": 2,
+                    "committed": False,
+                    "stored": 0,
+                    "staged": 5,
+                }
+            )
+        self.assertNotIsInstance(cm.exception, UploadRejectedError)
+
+
+if __name__ == "__main__":
+    unittest.main()
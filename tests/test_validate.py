@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+
+#
+# NetDEF FRR Topotest Results Statistics Tool Batch Validation Tests
+# Copyright (C) 2021 Network Device Education Foundation, Inc. ("NetDEF")
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+import unittest
+
+import lib.validate as validate
+from lib.topostat import TopotestResult, TopotestRun
+from lib.validate import validate_result_list
+
+
+VALID = {
+    "version": 1,
+    "name": "bgp.test_bgp",
+    "result": "passed",
+    "time": "1.5",
+    "host": "agent",
+    "timestamp": "2021-01-05 12:16:30.245931",
+    "plan": "PLAN",
+    "build": "4711",
+    "job": "JOB",
+}
+
+# invalid or questionable values of every field
+VARIANTS = {
+    "version": [1.0, True, "1", 2, None],
+    "name": ["", "None", 5, None, 1.5],
+    "result": ["error", "", 0, None],
+    "time": ["nan", "abc", "", 3, None],
+    "host": ["", 7, None],
+    "timestamp": ["2021-01-05 12:16:30.x", "bad", 5, None],
+    "build": [4711, "None", "12-rerun", "1.5", " 12", "", True, -3],
+    "job": [""],
+}
+
+
+# rows and rejected indices of results validated one object at a time
+def validate_objects(results):
+    rows = []
+    rejected = []
+    for i, obj in enumerate(results):
+        try:
+            result = TopotestResult().from_json(obj)
+        except:
+            result = None
+        if result is None or not result.check():
+            rejected.append(i)
+            continue
+        try:
+            rows.append(result.to_row())
+        except:
+            rejected.append(i)
+    return rows, rejected
+
+
+# results with one field of a valid result replaced by each of its variants
+def variant_results():
+    results = [dict(VALID)]
+    for field, values in VARIANTS.items():
+        for val in values:
+            result = dict(VALID)
+            result[field] = val
+            results.append(result)
+    return results + ["result", None, {"version": 1}]
+
+
+class ValidateParityTest(unittest.TestCase):
+    def check_parity(self, results):
+        rows, reasons = validate_result_list(results)
+        expected_rows, expected_rejected = validate_objects(results)
+        self.assertEqual(repr(rows), repr(expected_rows))
+        self.assertEqual([i for i, reason in reasons], expected_rejected)
+
+    def test_float_version(self):
+        result = dict(VALID)
+        result["version"] = 1.0
+        self.assertIsNone(TopotestResult().from_json(result))
+        rows, reasons = validate_result_list([result])
+        self.assertEqual(rows, [])
+        self.assertEqual(reasons, [(0, "version")])
+        self.check_parity([result, dict(VALID)])
+
+    def test_variants(self):
+        self.check_parity(variant_results())
+
+    def test_variants_without_numpy(self):
+        numpy = validate.numpy
+        validate.numpy = None
+        try:
+            self.check_parity(variant_results())
+        finally:
+            validate.numpy = numpy
+
+    def test_run_float_version(self):
+        run = TopotestRun("agent", "PLAN", "4711", "JOB")
+        run.add(TopotestResult().from_json(VALID))
+        obj = run.to_json()
+        self.assertIsNotNone(TopotestRun().from_json(dict(obj)))
+        obj["version"] = 1.0
+        self.assertIsNone(TopotestRun().from_json(obj))
+
+    # builds are stored as integers, other builds reject all results of a run
+    def test_run_build(self):
+        for build, valid in [["4711", True], [4711, True], ["12-rerun", False]]:
+            run = TopotestRun("agent", "PLAN", build, "JOB")
+            result = TopotestResult().from_json(VALID)
+            result.build = build
+            run.add(result)
+            rows, reasons = validate.validate_run_columns(run)
+            self.assertEqual(rows, run.to_rows()[0])
+            if valid:
+                self.assertEqual(rows[0][6], 4711)
+            else:
+                self.assertEqual(reasons, [(0, "build")])
+
+
+if __name__ == "__main__":
+    unittest.main()